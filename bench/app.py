@@ -1,4 +1,5 @@
 # imports - standard imports
+import contextlib
 import json
 import logging
 import os
@@ -7,22 +8,21 @@ import shutil
 import subprocess
 import sys
 import tarfile
+import time
 import typing
 from collections import OrderedDict
 from datetime import date
 from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 from urllib.parse import urlparse
 
 # imports - third party imports
 import click
-import git
-import semantic_version as sv
 
 # imports - module imports
 import bench
-from bench.exceptions import NotInBenchDirectoryError
+from bench.exceptions import InvalidBranchException, NotInBenchDirectoryError
 from bench.utils import (
 	UNSET_ARG,
 	fetch_details_from_tag,
@@ -35,7 +35,29 @@ from bench.utils import (
 	log,
 	run_frappe_cmd,
 )
-from bench.utils.bench import build_assets, install_python_dev_dependencies
+from bench.utils.bench import (
+	build_assets,
+	install_python_dev_dependencies,
+	install_yarn_dependencies,
+)
+from bench.utils.cache import (
+	COMPRESSED_SUFFIXES,
+	CacheMiss,
+	CountingWriter,
+	cache_lock,
+	compressed_reader,
+	compressed_writer,
+	evict_cache_items,
+	get_cache_config,
+	get_compressed_suffix,
+	get_compression_backend,
+	get_manifest_filename,
+	materialize,
+	read_manifest,
+	store_directory,
+	update_cache_index,
+	write_manifest,
+)
 from bench.utils.render import step
 
 if typing.TYPE_CHECKING:
@@ -113,6 +135,8 @@ class AppMeta:
 			self.app_name = self.repo
 
 	def _setup_details_from_mounted_disk(self):
+		import git
+
 		# If app is a git repo
 		self.git_repo = git.Repo(self.mount_path)
 		try:
@@ -333,12 +357,17 @@ class App(AppMeta):
 
 	Code that updates the `env` and `sites` subdirs still need
 	to be run.
+
+	Uncompressed caches are kept in the content addressed store of
+	`bench.utils.cache`, compressed ones as tar archives streamed through
+	zstd or gzip. Uncompressed tar archives of older versions are still
+	read.
 	"""
 
 	def get_app_path(self) -> Path:
 		return Path(self.bench.name) / "apps" / self.app_name
 
-	def get_app_cache_path(self, is_compressed=False) -> Path:
+	def get_app_cache_path(self, is_compressed=False, suffix=None) -> Path:
 		assert self.cache_key is not None
 
 		cache_path = get_bench_cache_path("apps")
@@ -346,23 +375,25 @@ class App(AppMeta):
 			self.app_name,
 			self.cache_key,
 			is_compressed,
+			suffix,
 		)
 		return cache_path / tarfile_name
 
+	def get_app_manifest_path(self) -> Path:
+		assert self.cache_key is not None
+		return get_bench_cache_path("apps") / get_manifest_filename(
+			self.app_name, self.cache_key
+		)
+
 	def get_cached(self) -> bool:
 		if not self.cache_key:
 			return False
 
-		cache_path = self.get_app_cache_path(False)
-		mode = "r"
-
-		# Check if cache exists without gzip
-		if not cache_path.is_file():
-			cache_path = self.get_app_cache_path(True)
-			mode = "r:gz"
+		if self.get_cached_from_store():
+			return True
 
-		# Check if cache exists with gzip
-		if not cache_path.is_file():
+		cache_path = get_cached_archive(self.app_name, self.cache_key)
+		if not cache_path:
 			return False
 
 		app_path = self.get_app_path()
@@ -370,17 +401,53 @@ class App(AppMeta):
 			shutil.rmtree(app_path)
 
 		click.secho(f"Getting {self.app_name} from cache", fg="yellow")
-		with tarfile.open(cache_path, mode) as tar:
-			extraction_filter = get_app_cache_extract_filter(count_threshold=150_000)
-			try:
-				tar.extractall(app_path.parent, filter=extraction_filter)
-			except Exception:
-				message = f"Cache extraction failed for {self.app_name}, skipping cache"
-				click.secho(message, fg="yellow")
-				logger.exception(message)
-				shutil.rmtree(app_path)
-				return False
+		start = time.monotonic()
+		extraction_filter = get_app_cache_extract_filter(count_threshold=150_000)
+		try:
+			if cache_path.suffix == ".tar":
+				with tarfile.open(cache_path, "r") as tar:
+					tar.extractall(app_path.parent, filter=extraction_filter)
+			else:
+				# decompress and extract as a stream, the filter sees each member as it comes
+				with compressed_reader(cache_path) as f, tarfile.open(fileobj=f, mode="r|") as tar:
+					tar.extractall(app_path.parent, filter=extraction_filter)
+		except Exception:
+			message = f"Cache extraction failed for {self.app_name}, skipping cache"
+			click.secho(message, fg="yellow")
+			logger.exception(message)
+			shutil.rmtree(app_path, ignore_errors=True)
+			return False
 
+		update_cache_index(
+			cache_path.name, extract_time=time.monotonic() - start, accessed=time.time()
+		)
+		return True
+
+	def get_cached_from_store(self) -> bool:
+		manifest = read_manifest(self.get_app_manifest_path())
+		if not manifest:
+			return False
+
+		app_path = self.get_app_path()
+		tmp_path = app_path.with_name(f".{app_path.name}.cache")
+		if tmp_path.exists():
+			shutil.rmtree(tmp_path)
+
+		click.secho(f"Getting {self.app_name} from cache", fg="yellow")
+		try:
+			hardlink = bool(get_cache_config().get("hardlink_objects"))
+			materialize(manifest, tmp_path, hardlink=hardlink)
+		except (CacheMiss, OSError):
+			message = f"Cache extraction failed for {self.app_name}, skipping cache"
+			click.secho(message, fg="yellow")
+			logger.exception(message)
+			shutil.rmtree(tmp_path, ignore_errors=True)
+			return False
+
+		if app_path.is_dir():
+			shutil.rmtree(app_path)
+		os.rename(tmp_path, app_path)
+		update_cache_index(self.get_app_manifest_path().name, accessed=time.time())
 		return True
 
 	def set_cache(self, compress_artifacts=False) -> bool:
@@ -391,29 +458,70 @@ class App(AppMeta):
 		if not app_path.is_dir():
 			return False
 
-		cwd = os.getcwd()
-		cache_path = self.get_app_cache_path(compress_artifacts)
-		mode = "w:gz" if compress_artifacts else "w"
-
-		message = f"Caching {self.app_name} app directory"
 		if compress_artifacts:
-			message += " (compressed)"
-		click.secho(message)
+			success = self.set_cache_compressed()
+		else:
+			success = self.set_cache_in_store()
+
+		if success:
+			evicted, freed = evict_cache_items()
+			if evicted:
+				click.secho(
+					f"Evicted {evicted} least recently used cache items, freeing"
+					f" {freed / 1_000_000:.3f} MB"
+				)
+
+		return success
+
+	def set_cache_compressed(self) -> bool:
+		app_path = self.get_app_path()
+		backend = get_compression_backend()
+		cache_path = self.get_app_cache_path(True, get_compressed_suffix(backend))
+
+		click.secho(f"Caching {self.app_name} app directory (compressed with {backend})")
 
 		self.prune_app_directory()
 
-		success = False
-		os.chdir(app_path.parent)
+		start = time.monotonic()
 		try:
-			with tarfile.open(cache_path, mode) as tar:
-				tar.add(app_path.name)
-			success = True
+			# compress as a stream while the directory is walked
+			with compressed_writer(cache_path, backend) as f:
+				counter = CountingWriter(f)
+				with tarfile.open(fileobj=counter, mode="w|") as tar:
+					tar.add(app_path, arcname=app_path.name)
 		except Exception:
 			log(f"Failed to cache {app_path}", level=3)
-			success = False
-		finally:
-			os.chdir(cwd)
-		return success
+			with contextlib.suppress(FileNotFoundError):
+				cache_path.unlink()
+			return False
+
+		update_cache_index(
+			cache_path.name,
+			backend=backend,
+			raw_size=counter.count,
+			compress_time=time.monotonic() - start,
+			accessed=time.time(),
+		)
+		return True
+
+	def set_cache_in_store(self) -> bool:
+		click.secho(f"Caching {self.app_name} app directory")
+		self.prune_app_directory()
+
+		try:
+			# objects aren't referenced until the manifest is written, pruning waits
+			with cache_lock(shared=True):
+				manifest = store_directory(self.get_app_path(), self.app_name, self.cache_key)
+				write_manifest(self.get_app_manifest_path(), manifest)
+		except Exception:
+			log(f"Failed to cache {self.get_app_path()}", level=3)
+			return False
+
+		# superseded by the manifest
+		with contextlib.suppress(FileNotFoundError):
+			self.get_app_cache_path(False).unlink()
+		update_cache_index(self.get_app_manifest_path().name, accessed=time.time())
+		return True
 
 	def prune_app_directory(self):
 		app_path = self.get_app_path()
@@ -438,30 +546,28 @@ def can_get_cached(app_name: str, cache_key: str) -> bool:
 	get-app command params the same.
 	"""
 	cache_path = get_bench_cache_path("apps")
-	tarfile_path = cache_path / get_cache_filename(
-		app_name,
-		cache_key,
-		True,
-	)
-
-	if tarfile_path.is_file():
+	if (cache_path / get_manifest_filename(app_name, cache_key)).is_file():
 		return True
 
-	tarfile_path = cache_path / get_cache_filename(
-		app_name,
-		cache_key,
-		False,
-	)
+	return bool(get_cached_archive(app_name, cache_key))
 
-	return tarfile_path.is_file()
 
+def get_cached_archive(app_name: str, cache_key: str) -> Optional[Path]:
+	cache_path = get_bench_cache_path("apps")
+	for suffix in (".tar", *COMPRESSED_SUFFIXES):
+		tarfile_path = cache_path / get_cache_filename(app_name, cache_key, suffix=suffix)
+		if tarfile_path.is_file():
+			return tarfile_path
 
-def get_cache_filename(app_name: str, cache_key: str, is_compressed=False):
-	ext = "tgz" if is_compressed else "tar"
-	return f"{app_name}-{cache_key[:10]}.{ext}"
+
+def get_cache_filename(app_name: str, cache_key: str, is_compressed=False, suffix=None):
+	ext = suffix or (".tgz" if is_compressed else ".tar")
+	return f"{app_name}-{cache_key[:10]}{ext}"
 
 
 def can_frappe_use_cached(app: App) -> bool:
+	import semantic_version as sv
+
 	min_frappe = get_required_frappe_version(app)
 	if not min_frappe:
 		return False
@@ -488,6 +594,8 @@ def can_frappe_use_cached(app: App) -> bool:
 
 
 def validate_dependency(app: App, dep: str, req_version: str, throw=False) -> None:
+	import semantic_version as sv
+
 	dep_path = Path(app.bench.name) / "apps" / dep
 	if not dep_path.is_dir():
 		click.secho(f"Required frappe-dependency '{dep}' not found.", fg="yellow")
@@ -779,6 +887,7 @@ def install_resolved_deps(
 	verbose=False,
 ):
 	from bench.utils.app import check_existing_dir
+	from bench.utils.git import get_git_state
 
 	if "frappe" in resolution:
 		# Terminal dependency
@@ -788,38 +897,17 @@ def install_resolved_deps(
 		existing_dir, path_to_app = check_existing_dir(bench_path, repo_name)
 		if existing_dir:
 			is_compatible = False
+			state = get_git_state(path_to_app)
 
 			try:
 				installed_branch = bench.apps.states[repo_name]["resolution"]["branch"].strip()
 			except Exception:
-				installed_branch = (
-					subprocess.check_output(
-						"git rev-parse --abbrev-ref HEAD", shell=True, cwd=path_to_app
-					)
-					.decode("utf-8")
-					.rstrip()
-				)
+				installed_branch = state.branch or "HEAD"
 			try:
 				if app.tag is None:
-					current_remote = (
-						subprocess.check_output(
-							f"git config branch.{installed_branch}.remote", shell=True, cwd=path_to_app
-						)
-						.decode("utf-8")
-						.rstrip()
-					)
-
-					default_branch = (
-						subprocess.check_output(
-							f"git symbolic-ref refs/remotes/{current_remote}/HEAD",
-							shell=True,
-							cwd=path_to_app,
-						)
-						.decode("utf-8")
-						.rsplit("/")[-1]
-						.strip()
-					)
-					is_compatible = default_branch == installed_branch
+					current_remote = state.get_branch_remote(installed_branch)
+					default_branch = state.get_upstream_head(current_remote)
+					is_compatible = bool(current_remote) and default_branch == installed_branch
 				else:
 					is_compatible = installed_branch == app.tag
 			except Exception:
@@ -906,10 +994,7 @@ def install_app(
 		install_python_dev_dependencies(apps=app, bench_path=bench_path, verbose=verbose)
 
 	if not using_cached and os.path.exists(os.path.join(app_path, "package.json")):
-		yarn_install = "yarn install --check-files"
-		if verbose:
-			yarn_install += " --verbose"
-		bench.run(yarn_install, cwd=app_path)
+		install_yarn_dependencies(bench, app, verbose=verbose)
 
 	bench.apps.sync(app_name=app, required=resolution, branch=tag, app_dir=app_path)
 
@@ -922,29 +1007,59 @@ def install_app(
 		bench.reload(_raise=False)
 
 
-def pull_apps(apps=None, bench_path=".", reset=False):
-	"""Check all apps if there no local changes, pull"""
+def pull_apps(apps=None, bench_path=".", reset=False, jobs=None):
+	"""Check all apps if there no local changes, pull
+
+	Apps are checked and pulled on `jobs` parallel workers, which defaults to the
+	`pull_concurrency` set in common_site_config.json, else one app at a time.
+	"""
 	from bench.bench import Bench
-	from bench.utils.app import get_current_branch, get_remote
+	from bench.utils import run_in_parallel
+	from bench.utils.timings import Timing
 
 	bench = Bench(bench_path)
 	rebase = "--rebase" if bench.conf.get("rebase_on_pull") else ""
+	jobs = jobs or bench.conf.get("pull_concurrency") or 1
+
+	def pull(app, output):
+		with Timing("pull_app", app=app):
+			return pull_app(bench, app, reset=reset, rebase=rebase, output=output)
+
+	with Timing("pull_apps"):
+		apps_to_pull = get_apps_to_pull(bench, apps, reset=reset, jobs=jobs)
+		pulled = run_in_parallel(pull, apps_to_pull, workers=jobs)
+		exclude_apps_without_remote(pulled, bench_path=bench_path)
+
+
+def get_apps_to_pull(bench: "Bench", apps=None, reset=False, jobs=1) -> List[str]:
+	"""Returns apps that are git repos on a branch and not excluded. Exits if any of them
+	has local changes, unless they're to be reset."""
+	from bench.utils import run_in_parallel
+	from bench.utils.app import get_current_branch
+
+	bench_path = bench.name
 	apps = apps or bench.apps
 	excluded_apps = bench.excluded_apps
 
 	# check for local changes
 	if not reset:
+		apps_to_check = []
 		for app in apps:
 			if app in excluded_apps:
 				print(f"Skipping reset for app {app}")
 				continue
-			app_dir = get_repo_dir(app, bench_path=bench_path)
-			if os.path.exists(os.path.join(app_dir, ".git")):
-				out = subprocess.check_output("git status", shell=True, cwd=app_dir)
-				out = out.decode("utf-8")
-				if not re.search(r"nothing to commit, working (directory|tree) clean", out):
-					print(
-						f"""
+			apps_to_check.append(app)
+
+		local_changes = run_in_parallel(
+			lambda app, output: has_local_changes(app, bench_path=bench_path),
+			apps_to_check,
+			workers=jobs,
+		)
+
+		for app in apps_to_check:
+			if local_changes[app]:
+				print(
+					f"""
 
 Cannot proceed with update: You have local changes in app "{app}" that are not committed.
 
@@ -955,47 +1070,375 @@ Here are your choices:
 	with "bench update --reset" or for individual repositries "git reset --hard"
 3. If your changes are helpful for others, send in a pull request via GitHub and
 	wait for them to be merged in the core."""
-					)
-					sys.exit(1)
+				)
+				sys.exit(1)
 
+	apps_to_pull = []
 	for app in apps:
 		if app in excluded_apps:
 			print(f"Skipping pull for app {app}")
 			continue
 		app_dir = get_repo_dir(app, bench_path=bench_path)
-		if os.path.exists(os.path.join(app_dir, ".git")):
-			remote = get_remote(app)
-			if not remote:
-				# remote is False, i.e. remote doesn't exist, add the app to excluded_apps.txt
-				add_to_excluded_apps_txt(app, bench_path=bench_path)
-				print(
-					f"Skipping pull for app {app}, since remote doesn't exist, and"
-					" adding it to excluded apps"
-				)
-				continue
+		if not os.path.exists(os.path.join(app_dir, ".git")):
+			continue
+		if not get_current_branch(app, bench_path=bench_path):
+			print(f"Skipping pull for app {app}, its HEAD is detached")
+			continue
+		apps_to_pull.append(app)
 
-			if not bench.conf.get("shallow_clone") or not reset:
-				is_shallow = os.path.exists(os.path.join(app_dir, ".git", "shallow"))
-				if is_shallow:
-					s = " to safely pull remote changes." if not reset else ""
-					print(f"Unshallowing {app}{s}")
-					bench.run(f"git fetch {remote} --unshallow", cwd=app_dir)
-
-			branch = get_current_branch(app, bench_path=bench_path)
-			logger.log(f"pulling {app}")
-			if reset:
-				reset_cmd = f"git reset --hard {remote}/{branch}"
-				if bench.conf.get("shallow_clone"):
-					bench.run(f"git fetch --depth=1 --no-tags {remote} {branch}", cwd=app_dir)
-					bench.run(reset_cmd, cwd=app_dir)
-					bench.run("git reflog expire --all", cwd=app_dir)
-					bench.run("git gc --prune=all", cwd=app_dir)
-				else:
-					bench.run("git fetch --all", cwd=app_dir)
-					bench.run(reset_cmd, cwd=app_dir)
-			else:
-				bench.run(f"git pull {rebase} {remote} {branch}", cwd=app_dir)
-			bench.run('find . -name "*.pyc" -delete', cwd=app_dir)
+	return apps_to_pull
+
+
+def exclude_apps_without_remote(pulled: dict, bench_path="."):
+	"""Takes a dict of app to the return value of `pull_app`"""
+	for app in pulled:
+		if pulled[app] is False:
+			# remote is False, i.e. remote doesn't exist, add the app to excluded_apps.txt
+			add_to_excluded_apps_txt(app, bench_path=bench_path)
+			print(
+				f"Skipping pull for app {app}, since remote doesn't exist, and"
+				" adding it to excluded apps"
+			)
+
+
+def has_local_changes(app, bench_path=".") -> bool:
+	app_dir = get_repo_dir(app, bench_path=bench_path)
+	if not os.path.exists(os.path.join(app_dir, ".git")):
+		return False
+
+	out = subprocess.check_output("git status", shell=True, cwd=app_dir)
+	out = out.decode("utf-8")
+	return not re.search(r"nothing to commit, working (directory|tree) clean", out)
+
+
+def pull_app(bench: "Bench", app, reset=False, rebase="", output=None):
+	"""Pulls remote changes for app, or with reset, hard resets it to the remote branch.
+	Returns False if the app has no remote to pull from."""
+	from bench.utils import echo
+	from bench.utils.app import get_current_branch, get_remote
+	from bench.utils.git import get_git_state
+
+	def run(cmd):
+		bench.run(cmd, cwd=app_dir, output=output)
+
+	bench_path = bench.name
+	app_dir = get_repo_dir(app, bench_path=bench_path)
+	remote = get_remote(app, bench_path=bench_path)
+	if not remote:
+		return False
+
+	if not bench.conf.get("shallow_clone") or not reset:
+		if get_git_state(app_dir).is_shallow:
+			s = " to safely pull remote changes." if not reset else ""
+			echo(f"Unshallowing {app}{s}", output)
+			run(f"git fetch {remote} --unshallow")
+
+	branch = get_current_branch(app, bench_path=bench_path)
+	if not branch:
+		raise InvalidBranchException(f"Cannot pull {app}, its HEAD is detached")
+	logger.log(f"pulling {app}")
+	if reset:
+		reset_cmd = f"git reset --hard {remote}/{branch}"
+		if bench.conf.get("shallow_clone"):
+			run(f"git fetch --depth=1 --no-tags {remote} {branch}")
+			run(reset_cmd)
+			run("git reflog expire --all")
+			run("git gc --prune=all")
+		else:
+			run("git fetch --all")
+			run(reset_cmd)
+	else:
+		run(f"git pull {rebase} {remote} {branch}")
+	run('find . -name "*.pyc" -delete')
+
+	return True
+
+
+def stage_app(
+	bench: "Bench",
+	app,
+	staging_path,
+	reset=False,
+	requirements=True,
+	build=True,
+	yarn_cache=None,
+	output=None,
+) -> Optional[str]:
+	"""Fetches remote changes of app and prepares for applying them while the app is in
+	use: the new commit is checked out in a worktree under staging_path, from which
+	wheels of its python dependencies are built into staging_path/wheels and its node
+	dependencies are installed, filling the yarn cache and letting `stage_assets` build
+	its assets.
+
+	Returns the commit to apply with `apply_staged_app`, or None if the app has no remote
+	or has local commits, so it needs the usual pull.
+	"""
+	from bench.utils import echo, get_cmd_output
+	from bench.utils.app import get_current_branch, get_remote
+
+	def run(cmd):
+		bench.run(cmd, cwd=app_dir, output=output)
+
+	bench_path = bench.name
+	app_dir = get_repo_dir(app, bench_path=bench_path)
+	remote = get_remote(app, bench_path=bench_path)
+	if not remote:
+		return None
+
+	branch = get_current_branch(app, bench_path=bench_path)
+	depth = "--depth=1 " if reset and bench.conf.get("shallow_clone") else ""
+	run(f"git fetch {depth}{remote} {branch}")
+	target = get_cmd_output("git rev-parse FETCH_HEAD", cwd=app_dir)
+
+	if target == get_cmd_output("git rev-parse HEAD", cwd=app_dir):
+		echo(f"{app} is up to date", output)
+		return target
+
+	if not reset and subprocess.call(
+		["git", "merge-base", "--is-ancestor", "HEAD", target], cwd=app_dir
+	):
+		echo(f"{app} has local commits, it will be pulled during maintenance", output)
+		return None
+
+	# the worktree is kept for stage_assets, remove_staging removes it
+	worktree = add_staging_worktree(
+		bench,
+		app,
+		staging_path,
+		target,
+		node_modules=requirements or build,
+		yarn_cache=yarn_cache,
+		output=output,
+	)
+	if requirements:
+		wheels = os.path.abspath(os.path.join(staging_path, "wheels"))
+		run(f"{bench.python} -m pip wheel --quiet --wheel-dir {wheels} {worktree}")
+
+	echo(f"Staged {app} at {target[:10]}", output)
+	return target
+
+
+def add_staging_worktree(
+	bench: "Bench",
+	app,
+	staging_path,
+	commit,
+	node_modules=True,
+	yarn_cache=None,
+	output=None,
+) -> str:
+	"""Checks out commit of app in a worktree under staging_path/apps, with its node
+	dependencies installed if node_modules is set. Returns the worktree's path"""
+	worktree = os.path.abspath(os.path.join(staging_path, "apps", app))
+	app_dir = get_repo_dir(app, bench_path=bench.name)
+	bench.run(f"git worktree add --detach {worktree} {commit}", cwd=app_dir, output=output)
+
+	if node_modules and os.path.exists(os.path.join(worktree, "package.json")):
+		yarn_cache = yarn_cache or get_bench_cache_path("yarn")
+		bench.run(
+			f"yarn install --prefer-offline --cache-folder {yarn_cache}", cwd=worktree, output=output
+		)
+
+	return worktree
+
+
+def stage_apps(
+	staging_path,
+	apps=None,
+	bench_path=".",
+	reset=False,
+	requirements=True,
+	build=True,
+	jobs=None,
+) -> dict:
+	"""Stages apps with `stage_app` on `jobs` parallel workers, see `pull_apps`. Returns a
+	dict of app to its staged commit, to apply with `apply_staged_apps`."""
+	from bench.bench import Bench
+	from bench.utils import run_in_parallel
+	from bench.utils.bench import get_yarn_caches, use_yarn_cache
+
+	bench = Bench(bench_path)
+	jobs = jobs or bench.conf.get("pull_concurrency") or 1
+	apps_to_pull = get_apps_to_pull(bench, apps, reset=reset, jobs=jobs)
+	yarn_caches = get_yarn_caches(jobs)
+
+	def stage(app, output):
+		with use_yarn_cache(yarn_caches) as yarn_cache:
+			return stage_app(
+				bench,
+				app,
+				staging_path,
+				reset=reset,
+				requirements=requirements,
+				build=build,
+				yarn_cache=yarn_cache,
+				output=output,
+			)
+
+	return run_in_parallel(stage, apps_to_pull, workers=jobs)
+
+
+def stage_assets(staged: dict, staging_path, bench_path=".") -> Optional[List[str]]:
+	"""Builds assets of apps staged by `stage_apps` whose frontend sources changed, or of
+	all apps if frappe's did, from their worktrees under staging_path. The bench's env
+	imports the staged apps through PYTHONPATH, so frappe's build tooling writes to the
+	worktrees and staging_path/sites/assets, for `apply_staged_assets` to swap in.
+
+	Returns the apps built, or None if assets can only be built once apps are updated,
+	i.e. some apps are pulled during maintenance or frappe can't build a subset of apps.
+	"""
+	from bench.bench import Bench
+	from bench.utils import exec_cmd
+	from bench.utils.app import get_current_frappe_version
+	from bench.utils.bench import get_build_hash, get_build_manifest
+
+	bench = Bench(bench_path)
+	if not all(staged.values()) or get_current_frappe_version(bench_path=bench_path) < 14:
+		return None
+
+	apps_path = os.path.join(staging_path, "apps")
+	manifest = get_build_manifest(bench_path)
+	apps = [
+		app
+		for app in bench.apps
+		if os.path.isdir(os.path.join(apps_path, app))
+		and get_build_hash(staging_path, app) != manifest.get(app)
+	]
+	if not apps:
+		return []
+	if "frappe" in apps:
+		apps = list(bench.apps)
+
+	# frappe runs the build and apps being built need their own worktree, others are
+	# only read from the bench
+	for app in bench.apps:
+		path = os.path.join(apps_path, app)
+		if os.path.exists(path):
+			continue
+		if app in apps or app == "frappe":
+			add_staging_worktree(bench, app, staging_path, "HEAD")
+		else:
+			os.symlink(os.path.abspath(get_repo_dir(app, bench_path=bench_path)), path)
+
+	sites_path = os.path.join(staging_path, "sites")
+	os.makedirs(os.path.join(sites_path, "assets"))
+	shutil.copy(bench.apps_txt, os.path.join(sites_path, "apps.txt"))
+	common_site_config = os.path.abspath(
+		os.path.join(bench_path, "sites", "common_site_config.json")
+	)
+	os.symlink(
+		os.path.relpath(common_site_config, sites_path),
+		os.path.join(sites_path, "common_site_config.json"),
+	)
+
+	python_path = os.pathsep.join(
+		os.path.abspath(os.path.join(apps_path, app)) for app in bench.apps
+	)
+	exec_cmd(
+		f"{bench.python} -m frappe.utils.bench_helper frappe build --apps {','.join(apps)}",
+		cwd=sites_path,
+		env={"PYTHONPATH": python_path},
+	)
+	return apps
+
+
+def apply_staged_assets(apps, staging_path, bench_path="."):
+	"""Swaps assets built by `stage_assets` in for those of apps, once their staged
+	commits are applied"""
+	from bench.bench import Bench
+	from bench.utils.bench import update_build_manifest
+
+	for app in apps:
+		staged_dist = os.path.join(staging_path, "apps", app, app, "public", "dist")
+		if not os.path.isdir(staged_dist):
+			continue
+		dist = os.path.join(get_repo_dir(app, bench_path=bench_path), app, "public", "dist")
+		shutil.rmtree(dist, ignore_errors=True)
+		shutil.move(staged_dist, dist)
+
+	assets_path = os.path.join(bench_path, "sites", "assets")
+	for filename in ("assets.json", "assets-rtl.json"):
+		staged_file = os.path.join(staging_path, "sites", "assets", filename)
+		if not os.path.exists(staged_file):
+			continue
+		path = os.path.join(assets_path, filename)
+		try:
+			with open(path) as f:
+				assets = json.load(f)
+		except FileNotFoundError:
+			assets = {}
+		with open(staged_file) as f:
+			assets.update(json.load(f))
+		with open(f"{path}.tmp", "w") as f:
+			json.dump(assets, f, indent=4)
+		os.replace(f"{path}.tmp", path)
+
+	update_build_manifest(bench_path, apps)
+
+	# frappe caches the bundles of assets.json in redis
+	bench = Bench(bench_path)
+	bench.run(
+		f"{bench.python} -c \"import frappe; frappe.init(''); "
+		"frappe.cache().delete_value('assets_json', shared=True)\"",
+		cwd=os.path.join(bench_path, "sites"),
+	)
+	logger.log(f"applied staged assets of {', '.join(apps)}")
+
+
+def remove_staging(staging_path, bench_path="."):
+	"""Removes staging_path and the worktrees of apps staged in it"""
+	from bench.bench import Bench
+
+	if not os.path.exists(staging_path):
+		return
+
+	shutil.rmtree(staging_path, ignore_errors=True)
+	for app in Bench(bench_path).apps:
+		subprocess.call(
+			["git", "worktree", "prune"],
+			cwd=get_repo_dir(app, bench_path=bench_path),
+			stdout=subprocess.DEVNULL,
+			stderr=subprocess.DEVNULL,
+		)
+
+
+def apply_staged_apps(staged: dict, bench_path=".", reset=False, jobs=None):
+	"""Applies commits staged by `stage_apps`, apps without one are pulled as usual"""
+	from bench.bench import Bench
+	from bench.utils import run_in_parallel
+
+	bench = Bench(bench_path)
+	rebase = "--rebase" if bench.conf.get("rebase_on_pull") else ""
+	jobs = jobs or bench.conf.get("pull_concurrency") or 1
+
+	def apply(app, output):
+		if staged[app]:
+			return apply_staged_app(
+				bench, app, staged[app], reset=reset, rebase=rebase, output=output
+			)
+		return pull_app(bench, app, reset=reset, rebase=rebase, output=output)
+
+	pulled = run_in_parallel(apply, list(staged), workers=jobs)
+	exclude_apps_without_remote(pulled, bench_path=bench_path)
+
+
+def apply_staged_app(bench: "Bench", app, target, reset=False, rebase="", output=None):
+	"""Moves app to the commit staged by `stage_app`. With rebase, as set by rebase_on_pull,
+	commits made on the app since it was staged are rebased onto it, else it's only fast
+	forwarded."""
+
+	def run(cmd):
+		bench.run(cmd, cwd=app_dir, output=output)
+
+	app_dir = get_repo_dir(app, bench_path=bench.name)
+	logger.log(f"applying staged commit {target} of {app}")
+	if reset:
+		run(f"git reset --hard {target}")
+	elif rebase:
+		run(f"git rebase {target}")
+	else:
+		run(f"git merge --ff-only {target}")
+	run('find . -name "*.pyc" -delete')
 
 
 def use_rq(bench_path):
@@ -1009,6 +1452,8 @@ def get_repo_dir(app, bench_path="."):
 
 
 def is_git_repo(app_path):
+	import git
+
 	try:
 		git.Repo(app_path, search_parent_directories=False)
 		return True
@@ -1,10 +1,8 @@
 # imports - standard imports
-import subprocess
 from functools import lru_cache
 import os
 import shutil
 import json
-import sys
 import logging
 from typing import List, MutableSequence, TYPE_CHECKING, Union
 
@@ -17,7 +15,7 @@ from bench.utils import (
 	paths_in_bench,
 	exec_cmd,
 	is_bench_directory,
-	is_frappe_app,
+	get_frappe_apps,
 	get_cmd_output,
 	get_git_version,
 	log,
@@ -34,6 +32,7 @@ from bench.utils.bench import (
 )
 from bench.utils.render import job, step
 from bench.utils.app import get_current_version
+from bench.utils.git import get_git_state
 from bench.app import is_git_repo
 
 
@@ -44,8 +43,8 @@ logger = logging.getLogger(bench.PROJECT_NAME)
 
 
 class Base:
-	def run(self, cmd, cwd=None, _raise=True):
-		return exec_cmd(cmd, cwd=cwd or self.cwd, _raise=_raise)
+	def run(self, cmd, cwd=None, _raise=True, output=None):
+		return exec_cmd(cmd, cwd=cwd or self.cwd, _raise=_raise, output=output)
 
 
 class Validator:
@@ -93,11 +92,9 @@ class Bench(Base, Validator):
 
 	@property
 	def sites(self) -> List:
-		return [
-			path
-			for path in os.listdir(os.path.join(self.name, "sites"))
-			if os.path.exists(os.path.join("sites", path, "site_config.json"))
-		]
+		from bench.config.site_config import get_site_inventory
+
+		return list(get_site_inventory(self.name))
 
 	@property
 	def conf(self):
@@ -112,6 +109,7 @@ class Bench(Base, Validator):
 
 	def drop(self):
 		self.teardown.backups()
+		self.teardown.ports()
 		self.teardown.dirs()
 
 	def install(self, app, branch=None):
@@ -137,9 +135,27 @@ class Bench(Base, Validator):
 		self.reload(_raise=False)
 
 	@step(title="Building Bench Assets", success="Bench Assets Built")
-	def build(self):
-		# build assets & stuff
-		run_frappe_cmd("build", bench_path=self.name)
+	def build(self, force=False):
+		"""Builds assets of apps whose frontend sources changed since their last build, or
+		of all apps if force is set. Returns the apps that were skipped."""
+		from bench.utils.app import get_current_frappe_version
+		from bench.utils.bench import get_unchanged_apps, update_build_manifest
+
+		skipped = [] if force else get_unchanged_apps(self.name, self.apps)
+		apps = [app for app in self.apps if app not in skipped]
+
+		if not skipped:
+			run_frappe_cmd("build", bench_path=self.name)
+		elif not apps:
+			return skipped
+		elif get_current_frappe_version(bench_path=self.name) >= 14:
+			run_frappe_cmd("build", "--apps", ",".join(apps), bench_path=self.name)
+		else:
+			for app in apps:
+				run_frappe_cmd("build", "--app", app, bench_path=self.name)
+
+		update_build_manifest(self.name, apps if skipped else None)
+		return skipped
 
 	@step(title="Reloading Bench Processes", success="Bench Processes Reloaded")
 	def reload(self, web=False, supervisor=True, systemd=True, _raise=True):
@@ -226,20 +242,12 @@ class BenchApps(MutableSequence):
 			app_dir = os.path.join(self.apps_path, app_dir)
 			is_repo = is_git_repo(app_dir)
 			if is_repo:
+				state = get_git_state(app_dir)
 				if not branch:
-					branch = (
-						subprocess.check_output(
-							"git rev-parse --abbrev-ref HEAD", shell=True, cwd=app_dir
-						)
-						.decode("utf-8")
-						.rstrip()
-					)
-
-				commit_hash = (
-					subprocess.check_output(f"git rev-parse {branch}", shell=True, cwd=app_dir)
-					.decode("utf-8")
-					.rstrip()
-				)
+					# equivalent of `git rev-parse --abbrev-ref HEAD`
+					branch = state.branch or "HEAD"
+
+				commit_hash = state.resolve(branch)
 
 			self.states[app_name] = {
 				"is_repo": is_repo,
@@ -274,11 +282,9 @@ class BenchApps(MutableSequence):
 
 	def initialize_apps(self):
 		try:
-			self.apps = [
-				x
-				for x in os.listdir(os.path.join(self.bench.name, "apps"))
-				if is_frappe_app(os.path.join(self.bench.name, "apps", x))
-			]
+			self.apps = get_frappe_apps(
+				self.apps_path, os.path.join(self.bench.name, "sites", ".bench_index.json")
+			)
 			self.apps.remove("frappe")
 			self.apps.insert(0, "frappe")
 		except FileNotFoundError:
@@ -432,39 +438,118 @@ class BenchSetup(Base):
 
 		from crontab import CronTab
 
+		from bench.utils.bench import get_backup_job_commands
+		from bench.utils.system import BACKUP_TICK
+
 		bench_dir = os.path.abspath(self.bench.name)
 		user = self.bench.conf.get("frappe_user")
-		logfile = os.path.join(bench_dir, "logs", "backup.log")
 		system_crontab = CronTab(user=user)
-		backup_command = f"cd {bench_dir} && {sys.argv[0]} --verbose --site all backup"
-		job_command = f"{backup_command} >> {logfile} 2>&1"
+		job_command, *old_job_commands = get_backup_job_commands(bench_dir)
+
+		for old_job_command in old_job_commands:
+			system_crontab.remove_all(command=old_job_command)
 
 		if job_command not in str(system_crontab):
 			job = system_crontab.new(
-				command=job_command, comment="bench auto backups set for every 6 hours"
+				command=job_command,
+				comment="bench auto backups set for every 6 hours, staggered across sites",
 			)
-			job.every(6).hours()
-			system_crontab.write()
+			job.minute.every(BACKUP_TICK)
+
+		system_crontab.write()
 
 		logger.log("backups were set up")
 
 	@job(title="Setting Up Bench Dependencies", success="Bench Dependencies Set Up")
-	def requirements(self, apps=None):
-		"""Install and upgrade specified / all installed apps on given Bench"""
+	def requirements(self, apps=None, batch=None):
+		"""Install and upgrade specified / all installed apps on given Bench
+
+		If batch is set, or batch_requirements is set in common_site_config.json, all
+		apps are installed through a single pip call while node dependencies are
+		installed alongside it.
+		"""
 		from bench.app import App
 
 		apps = apps or self.bench.apps
+		if batch is None:
+			batch = self.bench.conf.get("batch_requirements")
 
 		self.pip()
 
 		print(f"Installing {len(apps)} applications...")
 
+		if batch:
+			return self.batched_requirements(apps)
+
 		for app in apps:
 			path_to_app = os.path.join(self.bench.name, "apps", app)
 			app = App(path_to_app, bench=self.bench, to_clone=False).install(
 				skip_assets=True, restart_bench=False, ignore_resolution=True
 			)
 
+	def batched_requirements(self, apps):
+		"""Installs all apps with one `pip install -e app1 -e app2 ...` so that pip resolves
+		the dependencies of the whole bench once instead of once per app. Node dependencies
+		are installed in parallel and timings are reported per app once both are done."""
+		import time
+		from concurrent.futures import ThreadPoolExecutor
+
+		import bench.cli
+		import click
+
+		from bench.app import App
+		from bench.utils.app import get_app_name
+		from bench.utils.bench import install_python_dev_dependencies
+
+		quiet_flag = "" if bench.cli.verbose else "--quiet"
+		apps_path = os.path.join(self.bench.name, "apps")
+
+		resolved_apps = {}
+		for app in apps:
+			app = App(os.path.join(apps_path, app), bench=self.bench, to_clone=False)
+			app.validate_app_dependencies()
+			resolved_apps[get_app_name(self.bench.name, app.app_name)] = app
+
+		node_output = []
+		with ThreadPoolExecutor(max_workers=1) as executor:
+			node_install = executor.submit(self.node, apps=list(resolved_apps), output=node_output)
+
+			start = time.monotonic()
+			editables = " ".join(
+				f"-e {os.path.realpath(os.path.join(apps_path, app))}" for app in resolved_apps
+			)
+			try:
+				self.run(f"{self.bench.python} -m pip install {quiet_flag} --upgrade {editables}")
+			finally:
+				python_time = time.monotonic() - start
+				# wait for node installs before raising so that its output isn't lost
+				node_timings = node_install.exception() or node_install.result()
+				click.echo("".join(node_output), nl=False)
+
+		if isinstance(node_timings, BaseException):
+			raise node_timings
+
+		setup_timings = {}
+		for app_name, app in resolved_apps.items():
+			start = time.monotonic()
+			if self.bench.conf.get("developer_mode"):
+				install_python_dev_dependencies(apps=app_name, bench_path=self.bench.name)
+			self.bench.apps.sync(
+				app_name=app_name,
+				required=app.local_resolution,
+				branch=app.tag,
+				app_dir=os.path.join(apps_path, app_name),
+			)
+			setup_timings[app_name] = time.monotonic() - start
+
+		click.echo(
+			f"\nInstalled python dependencies of {len(resolved_apps)} apps in {python_time:.1f}s"
+		)
+		click.echo(f"{'APP':25}  {'NODE':>8}  {'SETUP':>8}")
+		for app in resolved_apps:
+			node_time = f"{node_timings[app]:.1f}s" if app in node_timings else "-"
+			click.echo(f"{app:25}  {node_time:>8}  {setup_timings[app]:>7.1f}s")
+
 	def python(self, apps=None):
 		"""Install and upgrade Python dependencies for specified / all installed apps on given Bench"""
 		import bench.cli
@@ -480,11 +565,11 @@ class BenchSetup(Base):
 			log(f"\nInstalling python dependencies for {app}", level=3, no_log=True)
 			self.run(f"{self.bench.python} -m pip install {quiet_flag} --upgrade -e {app_path}")
 
-	def node(self, apps=None):
+	def node(self, apps=None, output=None):
 		"""Install and upgrade Node dependencies for specified / all apps on given Bench"""
 		from bench.utils.bench import update_node_packages
 
-		return update_node_packages(bench_path=self.bench.name, apps=apps)
+		return update_node_packages(bench_path=self.bench.name, apps=apps, output=output)
 
 
 class BenchTearDown:
@@ -494,5 +579,10 @@ class BenchTearDown:
 	def backups(self):
 		remove_backups_crontab(self.bench.name)
 
+	def ports(self):
+		from bench.config.ports import release_ports
+
+		release_ports(self.bench.name)
+
 	def dirs(self):
 		shutil.rmtree(self.bench.name)
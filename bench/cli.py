@@ -1,4 +1,9 @@
 # imports - standard imports
+import time
+
+# taken before any other import for --profile-startup to include import time
+startup_timings = [("start", time.perf_counter())]
+
 import atexit
 from contextlib import contextmanager
 from logging import Logger
@@ -18,6 +23,7 @@ from bench.utils import (
 	check_latest_version,
 	drop_privileges,
 	find_parent_bench,
+	get_cached_frappe_output,
 	get_env_frappe_commands,
 	get_cmd_output,
 	is_bench_directory,
@@ -28,14 +34,17 @@ from bench.utils import (
 	get_cmd_from_sysargv,
 )
 from bench.utils.bench import get_env_cmd
+from bench.utils.timings import Timing, setup_timings
 from importlib.util import find_spec
 
+startup_timings.append(("imports", time.perf_counter()))
 
 # these variables are used to show dynamic outputs on the terminal
 dynamic_feed = False
 verbose = False
 is_envvar_warn_set = None
 from_command_line = False  # set when commands are executed via the CLI
+profile_startup = False
 bench.LOG_BUFFER = []
 
 change_uid_msg = "You should not run this command as root"
@@ -49,7 +58,8 @@ def execute_cmd(check_for_update=True, command: str = None, logger: Logger = Non
 		atexit.register(check_latest_version)
 
 	try:
-		yield
+		with Timing(" ".join(sys.argv[1:]), kind="command"):
+			yield
 	except BaseException as e:
 		return_code = getattr(e, "code", 1)
 
@@ -64,7 +74,19 @@ def execute_cmd(check_for_update=True, command: str = None, logger: Logger = Non
 
 def cli():
 	setup_clear_cache()
-	global from_command_line, bench_config, is_envvar_warn_set, verbose
+	global from_command_line, bench_config, is_envvar_warn_set, verbose, profile_startup
+
+	if "--profile-startup" in sys.argv:
+		# not passed on, as frappe's bench_helper doesn't know it
+		sys.argv.remove("--profile-startup")
+		profile_startup = True
+		atexit.register(print_startup_profile)
+
+	if "--resource-report" in sys.argv:
+		from bench.utils.resources import print_resource_report
+
+		sys.argv.remove("--resource-report")
+		atexit.register(print_resource_report)
 
 	from_command_line = True
 	command = " ".join(sys.argv)
@@ -72,6 +94,7 @@ def cli():
 	is_envvar_warn_set = not (os.environ.get("BENCH_DEVELOPER") or os.environ.get("CI"))
 	is_cli_command = len(sys.argv) > 1 and not argv.intersection({"src", "--version"})
 	cmd_from_sys = get_cmd_from_sysargv()
+	mark_startup("parse command")
 
 	if "--verbose" in argv:
 		verbose = True
@@ -79,8 +102,10 @@ def cli():
 	change_working_directory()
 	logger = setup_logging()
 	logger.info(command)
+	mark_startup("setup logging")
 
 	bench_config = get_config(".")
+	mark_startup("read config")
 
 	if is_cli_command:
 		check_uid()
@@ -101,6 +126,9 @@ def cli():
 		)
 
 	in_bench = is_bench_directory()
+	if in_bench and is_cli_command:
+		setup_timings(" ".join(sys.argv[1:]))
+	mark_startup("checks")
 
 	if (
 		not in_bench
@@ -127,7 +155,8 @@ def cli():
 	if cmd_from_sys and cmd_from_sys.split("=", 1)[0].strip() in opts:
 		bench_command()
 
-	if cmd_from_sys in bench_command.commands:
+	if bench_command.has_command(cmd_from_sys):
+		mark_startup("dispatch")
 		with execute_cmd(check_for_update=is_cli_command, command=command, logger=logger):
 			bench_command()
 
@@ -189,14 +218,42 @@ def change_uid():
 			sys.exit(1)
 
 
+def mark_startup(label: str) -> None:
+	if profile_startup:
+		startup_timings.append((label, time.perf_counter()))
+
+
+def print_startup_profile() -> None:
+	"""Prints time taken by each stage of bench's startup to stderr"""
+	if not profile_startup:
+		return
+
+	start = previous = startup_timings[0][1]
+	for label, timestamp in startup_timings[1:]:
+		click.echo(f"{label:20} {(timestamp - previous) * 1000:8.1f} ms", err=True)
+		previous = timestamp
+	click.echo(f"{'total':20} {(previous - start) * 1000:8.1f} ms", err=True)
+
+
 def app_cmd(bench_path="."):
 	f = get_env_cmd("python", bench_path=bench_path)
+	mark_startup("exec frappe")
+	print_startup_profile()
 	os.chdir(os.path.join(bench_path, "sites"))
 	os.execv(f, [f] + ["-m", "frappe.utils.bench_helper"] + sys.argv[1:])
 
 
 def frappe_cmd(bench_path="."):
+	from bench.utils.helper_daemon import run_in_daemon
+
 	f = get_env_cmd("python", bench_path=bench_path)
+	mark_startup("exec frappe")
+	print_startup_profile()
+
+	return_code = run_in_daemon(sys.argv[1:], bench_path=bench_path)
+	if return_code is not None:
+		sys.exit(return_code)
+
 	os.chdir(os.path.join(bench_path, "sites"))
 	os.execv(f, [f] + ["-m", "frappe.utils.bench_helper", "frappe"] + sys.argv[1:])
 
@@ -209,15 +266,18 @@ def get_frappe_commands():
 
 
 def get_frappe_help(bench_path="."):
-	python = get_env_cmd("python", bench_path=bench_path)
-	sites_path = os.path.join(bench_path, "sites")
-	try:
-		out = get_cmd_output(
-			f"{python} -m frappe.utils.bench_helper get-frappe-help", cwd=sites_path
-		)
-		return "\n\nFramework commands:\n" + out.split("Commands:")[1]
-	except Exception:
-		return ""
+	def generate():
+		python = get_env_cmd("python", bench_path=bench_path)
+		sites_path = os.path.join(bench_path, "sites")
+		try:
+			out = get_cmd_output(
+				f"{python} -m frappe.utils.bench_helper get-frappe-help", cwd=sites_path
+			)
+			return "\n\nFramework commands:\n" + out.split("Commands:")[1]
+		except Exception:
+			return ""
+
+	return get_cached_frappe_output("frappe_help", generate, bench_path=bench_path)
 
 
 def change_working_directory():
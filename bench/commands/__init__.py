@@ -3,14 +3,62 @@ import click
 
 # imports - module imports
 from bench.utils.cli import (
-	MultiCommandGroup,
+	LazyCommandGroup,
 	print_bench_version,
 	use_experimental_feature,
 	setup_verbosity,
 )
 
-
-@click.group(cls=MultiCommandGroup)
+# command modules are imported only when one of their commands is invoked
+lazy_commands = {
+	"init": "bench.commands.make:init",
+	"drop": "bench.commands.make:drop",
+	"get": "bench.commands.make:get_app",
+	"get-app": "bench.commands.make:get_app",
+	"new-app": "bench.commands.make:new_app",
+	"remove": "bench.commands.make:remove_app",
+	"rm": "bench.commands.make:remove_app",
+	"remove-app": "bench.commands.make:remove_app",
+	"exclude-app": "bench.commands.make:exclude_app_for_update",
+	"include-app": "bench.commands.make:include_app_for_update",
+	"pip": "bench.commands.make:pip",
+	"validate-dependencies": "bench.commands.make:validate_dependencies",
+	"update": "bench.commands.update:update",
+	"retry-upgrade": "bench.commands.update:retry_upgrade",
+	"switch-to-branch": "bench.commands.update:switch_to_branch",
+	"switch-to-develop": "bench.commands.update:switch_to_develop",
+	"start": "bench.commands.utils:start",
+	"restart": "bench.commands.utils:restart",
+	"set-nginx-port": "bench.commands.utils:set_nginx_port",
+	"set-ssl-certificate": "bench.commands.utils:set_ssl_certificate",
+	"set-ssl-key": "bench.commands.utils:set_ssl_certificate_key",
+	"set-url-root": "bench.commands.utils:set_url_root",
+	"set-mariadb-host": "bench.commands.utils:set_mariadb_host",
+	"set-redis-cache-host": "bench.commands.utils:set_redis_cache_host",
+	"set-redis-queue-host": "bench.commands.utils:set_redis_queue_host",
+	"set-redis-socketio-host": "bench.commands.utils:set_redis_socketio_host",
+	"download-translations": "bench.commands.utils:download_translations",
+	"backup-all-sites": "bench.commands.utils:backup_all_sites",
+	"renew-lets-encrypt": "bench.commands.utils:renew_lets_encrypt",
+	"disable-production": "bench.commands.utils:disable_production",
+	"src": "bench.commands.utils:bench_src",
+	"find": "bench.commands.utils:find_benches",
+	"migrate-env": "bench.commands.utils:migrate_env",
+	"app-cache": "bench.commands.utils:app_cache_helper",
+	"timings": "bench.commands.utils:timings",
+	"ports": "bench.commands.utils:ports",
+	"setup": "bench.commands.setup:setup",
+	"config": "bench.commands.config:config",
+	"remote-set-url": "bench.commands.git:remote_set_url",
+	"remote-reset-url": "bench.commands.git:remote_reset_url",
+	"remote-urls": "bench.commands.git:remote_urls",
+	"install": "bench.commands.install:install",
+	"helper-daemon": "bench.commands.daemon:helper_daemon",
+	"release": "bench.commands.release:release",
+}
+
+
+@click.group(cls=LazyCommandGroup, lazy_commands=lazy_commands)
 @click.option(
 	"--version",
 	is_flag=True,
@@ -24,6 +72,18 @@ from bench.utils.cli import (
 	callback=use_experimental_feature,
 	expose_value=False,
 )
+@click.option(
+	"--profile-startup",
+	is_flag=True,
+	expose_value=False,
+	help="Print time taken by imports and setup of bench before running the command",
+)
+@click.option(
+	"--resource-report",
+	is_flag=True,
+	expose_value=False,
+	help="Print CPU time, memory and I/O used by processes bench ran, per process and step",
+)
 @click.option(
 	"-v",
 	"--verbose",
@@ -36,98 +96,3 @@ def bench_command(bench_path="."):
 
 	bench.set_frappe_version(bench_path=bench_path)
 
-
-from bench.commands.make import (
-	drop,
-	exclude_app_for_update,
-	get_app,
-	include_app_for_update,
-	init,
-	new_app,
-	pip,
-	remove_app,
-	validate_dependencies,
-)
-
-bench_command.add_command(init)
-bench_command.add_command(drop)
-bench_command.add_command(get_app)
-bench_command.add_command(new_app)
-bench_command.add_command(remove_app)
-bench_command.add_command(exclude_app_for_update)
-bench_command.add_command(include_app_for_update)
-bench_command.add_command(pip)
-bench_command.add_command(validate_dependencies)
-
-
-from bench.commands.update import (
-	retry_upgrade,
-	switch_to_branch,
-	switch_to_develop,
-	update,
-)
-
-bench_command.add_command(update)
-bench_command.add_command(retry_upgrade)
-bench_command.add_command(switch_to_branch)
-bench_command.add_command(switch_to_develop)
-
-
-from bench.commands.utils import (
-	app_cache_helper,
-	backup_all_sites,
-	bench_src,
-	disable_production,
-	download_translations,
-	find_benches,
-	migrate_env,
-	renew_lets_encrypt,
-	restart,
-	set_mariadb_host,
-	set_nginx_port,
-	set_redis_cache_host,
-	set_redis_queue_host,
-	set_redis_socketio_host,
-	set_ssl_certificate,
-	set_ssl_certificate_key,
-	set_url_root,
-	start,
-)
-
-bench_command.add_command(start)
-bench_command.add_command(restart)
-bench_command.add_command(set_nginx_port)
-bench_command.add_command(set_ssl_certificate)
-bench_command.add_command(set_ssl_certificate_key)
-bench_command.add_command(set_url_root)
-bench_command.add_command(set_mariadb_host)
-bench_command.add_command(set_redis_cache_host)
-bench_command.add_command(set_redis_queue_host)
-bench_command.add_command(set_redis_socketio_host)
-bench_command.add_command(download_translations)
-bench_command.add_command(backup_all_sites)
-bench_command.add_command(renew_lets_encrypt)
-bench_command.add_command(disable_production)
-bench_command.add_command(bench_src)
-bench_command.add_command(find_benches)
-bench_command.add_command(migrate_env)
-bench_command.add_command(app_cache_helper)
-
-from bench.commands.setup import setup
-
-bench_command.add_command(setup)
-
-
-from bench.commands.config import config
-
-bench_command.add_command(config)
-
-from bench.commands.git import remote_reset_url, remote_set_url, remote_urls
-
-bench_command.add_command(remote_set_url)
-bench_command.add_command(remote_reset_url)
-bench_command.add_command(remote_urls)
-
-from bench.commands.install import install
-
-bench_command.add_command(install)
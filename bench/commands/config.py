@@ -1,5 +1,5 @@
 # imports - module imports
-from bench.config.common_site_config import update_config, put_config
+from bench.config.common_site_config import config_transaction, update_config
 
 # imports - third party imports
 import click
@@ -79,14 +79,9 @@ def set_common_config(configs):
 )
 @click.argument("keys", nargs=-1)
 def remove_common_config(keys):
-	from bench.bench import Bench
-
-	common_site_config = Bench(".").conf
-	for key in keys:
-		if key in common_site_config:
-			del common_site_config[key]
-
-	put_config(common_site_config)
+	with config_transaction(".") as common_site_config:
+		for key in keys:
+			common_site_config.pop(key, None)
 
 
 config.add_command(config_restart_supervisor_on_update)
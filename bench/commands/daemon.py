@@ -0,0 +1,39 @@
+# imports - third party imports
+import click
+
+
+@click.group(
+	"helper-daemon",
+	help="Keep a process with frappe imported to run frappe commands of this bench faster",
+)
+def helper_daemon():
+	pass
+
+
+@click.command(
+	"start",
+	help="Start the helper daemon. Frappe commands are sent to it until apps change or it's stopped",
+)
+def start_helper_daemon():
+	from bench.utils.helper_daemon import start_daemon
+
+	start_daemon()
+
+
+@click.command("stop", help="Stop the helper daemon")
+def stop_helper_daemon():
+	from bench.utils.helper_daemon import stop_daemon
+
+	stop_daemon()
+
+
+@click.command("status", help="Show whether the helper daemon is running and up to date")
+def helper_daemon_status():
+	from bench.utils.helper_daemon import print_daemon_status
+
+	print_daemon_status()
+
+
+helper_daemon.add_command(start_helper_daemon)
+helper_daemon.add_command(stop_helper_daemon)
+helper_daemon.add_command(helper_daemon_status)
@@ -1,12 +1,11 @@
 # imports - standard imports
 import os
-import subprocess
 
 # imports - module imports
 from bench.bench import Bench
 from bench.app import get_repo_dir
 from bench.utils import set_git_remote_url
-from bench.utils.app import get_remote
+from bench.utils.git import get_git_state
 
 # imports - third party imports
 import click
@@ -31,7 +30,7 @@ def remote_urls():
 		repo_dir = get_repo_dir(app)
 
 		if os.path.exists(os.path.join(repo_dir, '.git')):
-			remote = get_remote(app)
-			remote_url = subprocess.check_output(['git', 'config', '--get', f'remote.{remote}.url'], cwd=repo_dir).strip()
+			state = get_git_state(repo_dir)
+			remote_url = state.remotes.get(state.get_remote())
 			print(f"{app}\t{remote_url}")
 
@@ -103,7 +103,10 @@ def init(
 
 		log(f"There was a problem while creating {path}", level=2)
 		if click.confirm("Do you want to rollback these changes?", abort=True):
+			from bench.config.ports import release_ports
+
 			log(f'Rolling back Bench "{path}"')
+			release_ports(path)
 			if os.path.exists(path):
 				shutil.rmtree(path)
 
@@ -0,0 +1,69 @@
+# imports - third party imports
+import click
+
+
+@click.group(
+	"release",
+	help="Run the bench from releases, which are switched between atomically",
+)
+def release():
+	pass
+
+
+@click.command(
+	"prepare",
+	help="Prepare a release of the apps at their current commits, with its own env and built assets",
+)
+def prepare_release():
+	from bench.utils.release import prepare_release
+
+	prepare_release(bench_path=".")
+
+
+@click.command(
+	"activate",
+	help="Switch to a prepared release, or the latest one, migrate sites and reload processes",
+)
+@click.argument("name", required=False)
+@click.option("--skip-migrate", is_flag=True, help="Don't migrate sites after switching")
+@click.option("--restart-supervisor", is_flag=True, help="Restart supervisor processes")
+@click.option("--restart-systemd", is_flag=True, help="Restart systemd units")
+def activate_release(name, skip_migrate, restart_supervisor, restart_systemd):
+	from bench.utils.release import activate_release
+
+	activate_release(
+		name,
+		bench_path=".",
+		migrate=not skip_migrate,
+		restart_supervisor=restart_supervisor,
+		restart_systemd=restart_systemd,
+	)
+
+
+@click.command(
+	"rollback",
+	help="Switch back to the release that was active before the current one and reload processes",
+)
+@click.option("--restart-supervisor", is_flag=True, help="Restart supervisor processes")
+@click.option("--restart-systemd", is_flag=True, help="Restart systemd units")
+def rollback_release(restart_supervisor, restart_systemd):
+	from bench.utils.release import rollback_release
+
+	rollback_release(
+		bench_path=".",
+		restart_supervisor=restart_supervisor,
+		restart_systemd=restart_systemd,
+	)
+
+
+@click.command("list", help="List prepared releases")
+def list_releases():
+	from bench.utils.release import print_releases
+
+	print_releases(bench_path=".")
+
+
+release.add_command(prepare_release)
+release.add_command(activate_release)
+release.add_command(rollback_release)
+release.add_command(list_releases)
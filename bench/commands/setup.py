@@ -39,10 +39,16 @@ def setup_sudoers(user):
 @click.option(
 	"--yes", help="Yes to regeneration of nginx config file", default=False, is_flag=True
 )
-def setup_nginx(yes=False, logging="combined", log_format=None):
+@click.option(
+	"--reload", help="Reload NGINX if the generated config changed", default=False, is_flag=True
+)
+def setup_nginx(yes=False, logging="combined", log_format=None, reload=False):
 	from bench.config.nginx import make_nginx_conf
 
-	make_nginx_conf(bench_path=".", yes=yes, logging=logging, log_format=log_format)
+	if not make_nginx_conf(
+		bench_path=".", yes=yes, logging=logging, log_format=log_format, reload=reload
+	):
+		click.echo("NGINX config is unchanged")
 
 
 @click.command("reload-nginx", help="Checks NGINX config file and reloads service")
@@ -215,8 +221,14 @@ def setup_socketio():
 	default=False,
 	is_flag=True,
 )
+@click.option(
+	"--batch",
+	help="Install Python packages of all apps with a single pip call, and Node packages alongside it",
+	default=False,
+	is_flag=True,
+)
 @click.argument("apps", nargs=-1)
-def setup_requirements(node=False, python=False, dev=False, apps=None):
+def setup_requirements(node=False, python=False, dev=False, batch=False, apps=None):
 	"""
 	Setup Python and Node dependencies.
 
@@ -227,7 +239,7 @@ def setup_requirements(node=False, python=False, dev=False, apps=None):
 	bench = Bench(".")
 
 	if not (node or python or dev):
-		bench.setup.requirements(apps=apps)
+		bench.setup.requirements(apps=apps, batch=batch or None)
 
 	elif not node and not dev:
 		bench.setup.python(apps=apps)
@@ -41,6 +41,27 @@ from bench.utils.bench import post_upgrade, patch_sites, build_assets
 	is_flag=True,
 	help="Hard resets git branch's to their new states overriding any changes and overriding rebase on pull",
 )
+@click.option(
+	"--jobs",
+	"-j",
+	type=int,
+	help="Number of apps to pull in parallel. Defaults to pull_concurrency set in common_site_config.json or 1",
+)
+@click.option(
+	"--site-concurrency",
+	type=int,
+	help="Number of sites to backup and migrate in parallel. Defaults to site_concurrency set in common_site_config.json or 1",
+)
+@click.option(
+	"--pipeline",
+	is_flag=True,
+	help="Run update tasks of apps and sites as soon as the tasks they depend on are done, instead of stage by stage, and report their timings",
+)
+@click.option(
+	"--minimal-downtime",
+	is_flag=True,
+	help="Backup sites, fetch apps, prebuild their dependencies and build their assets before enabling maintenance mode, and report how long sites were down",
+)
 def update(
 	pull,
 	apps,
@@ -53,6 +74,10 @@ def update(
 	no_compile,
 	force,
 	reset,
+	jobs,
+	site_concurrency,
+	pipeline,
+	minimal_downtime,
 ):
 	from bench.utils.bench import update
 
@@ -68,6 +93,10 @@ def update(
 		compile=not no_compile,
 		force=force,
 		reset=reset,
+		jobs=jobs,
+		site_concurrency=site_concurrency,
+		pipeline=pipeline,
+		minimal_downtime=minimal_downtime,
 	)
 
 
@@ -135,10 +135,23 @@ def renew_lets_encrypt():
 
 
 @click.command("backup-all-sites", help="Backup all sites in current bench")
-def backup_all_sites():
-	from bench.utils.system import backup_all_sites
+@click.option(
+	"--site-concurrency",
+	type=int,
+	help="Number of sites to backup in parallel. Defaults to site_concurrency set in common_site_config.json or 1",
+)
+@click.option(
+	"--scheduled",
+	is_flag=True,
+	help="Backup only sites due in this run of the backups cronjob, which spreads backups of sites over 6 hours",
+)
+def backup_all_sites(site_concurrency, scheduled):
+	from bench.utils.system import backup_all_sites, backup_scheduled_sites
 
-	backup_all_sites(bench_path=".")
+	if scheduled:
+		backup_scheduled_sites(bench_path=".")
+	else:
+		backup_all_sites(bench_path=".", concurrency=site_concurrency)
 
 
 @click.command(
@@ -190,7 +203,34 @@ def migrate_env(python, backup=True):
 	default="",
 	help="Removes all items that matches provided cache key",
 )
-def app_cache_helper(clear=False, remove_app="", remove_key=""):
+@click.option(
+	"--gc",
+	is_flag=True,
+	default=False,
+	help="Show items that would be evicted as per max_cache_size and max_cache_age set in ~/.cache/bench/config.json",
+)
+def app_cache_helper(clear=False, remove_app="", remove_key="", gc=False):
 	from bench.utils.bench import cache_helper
 
-	cache_helper(clear, remove_app, remove_key)
+	cache_helper(clear, remove_app, remove_key, gc)
+
+
+@click.command(
+	"timings", help="Summarise time taken by steps of bench commands, from logs/bench-timings.jsonl"
+)
+@click.option("--runs", default=10, type=int, help="Number of recent runs to summarise")
+@click.option("--command", help="Only include runs of this command, e.g. update")
+@click.option("--app", help="Only include steps of this app")
+def timings(runs, command, app):
+	from bench.utils.timings import print_timings
+
+	print_timings(runs=runs, command=command, app=app)
+
+
+@click.command("ports", help="List ports allocated to benches on this host")
+@click.option("--check", is_flag=True, help="Highlight ports that are in use")
+@click.option("--prune", is_flag=True, help="Release ports of benches that don't exist anymore")
+def ports(check, prune):
+	from bench.config.ports import print_ports
+
+	print_ports(check=check, prune=prune)
@@ -1,7 +1,11 @@
 # imports - standard imports
+import contextlib
+import fcntl
 import getpass
 import json
 import os
+import threading
+from contextlib import contextmanager
 
 default_config = {
 	"restart_supervisor_on_update": False,
@@ -17,17 +21,20 @@ default_config = {
 
 DEFAULT_MAX_REQUESTS = 5000
 
+# parsed configs by path, along with the (inode, mtime, size) of the file they were read
+# from. Configs are replaced on write, so a changed file is always a changed key.
+_config_cache = {}
+_locks = threading.local()
+
 
 def setup_config(bench_path, additional_config=None):
 	make_pid_folder(bench_path)
-	bench_config = get_config(bench_path)
-	bench_config.update(default_config)
-	bench_config.update(get_gunicorn_workers())
-	update_config_for_frappe(bench_config, bench_path)
-	if additional_config:
-		bench_config.update(additional_config)
-
-	put_config(bench_config, bench_path)
+	with config_transaction(bench_path) as bench_config:
+		bench_config.update(default_config)
+		bench_config.update(get_gunicorn_workers())
+		update_config_for_frappe(bench_config, bench_path)
+		if additional_config:
+			bench_config.update(additional_config)
 
 
 def get_config(bench_path):
@@ -35,23 +42,124 @@ def get_config(bench_path):
 
 
 def get_common_site_config(bench_path):
-	config_path = get_config_path(bench_path)
-	if not os.path.exists(config_path):
+	"""Returns a copy of the parsed common_site_config.json, parsed again only if the file
+	changed since it was last read"""
+	config_path = os.path.abspath(get_config_path(bench_path))
+	try:
+		stat = os.stat(config_path)
+	except FileNotFoundError:
 		return {}
-	with open(config_path) as f:
-		return json.load(f)
+
+	key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+	cached = _config_cache.get(config_path)
+	if not cached or cached[0] != key:
+		with open(config_path) as f:
+			cached = _config_cache[config_path] = (key, json.load(f))
+
+	return copy_config(cached[1])
+
+
+def copy_config(value):
+	if isinstance(value, dict):
+		return {key: copy_config(item) for key, item in value.items()}
+	if isinstance(value, list):
+		return [copy_config(item) for item in value]
+	return value
+
+
+@contextmanager
+def config_lock(bench_path="."):
+	"""Holds an advisory lock on the bench's common_site_config.json against other bench
+	processes changing it, re-entrant within a thread"""
+	config_dir = os.path.dirname(os.path.realpath(get_config_path(bench_path)))
+	lock_path = os.path.join(config_dir, ".common_site_config.json.lock")
+	held = _locks.__dict__.setdefault("held", {})
+	if lock_path in held:
+		held[lock_path] += 1
+		try:
+			yield
+		finally:
+			held[lock_path] -= 1
+		return
+
+	# opened read only, so that a lock file left by root can be locked by the bench's user
+	fd = os.open(lock_path, os.O_RDONLY | os.O_CREAT, 0o644)
+	try:
+		fcntl.flock(fd, fcntl.LOCK_EX)
+		held[lock_path] = 1
+		try:
+			yield
+		finally:
+			del held[lock_path]
+	finally:
+		os.close(fd)
+
+
+@contextmanager
+def config_transaction(bench_path="."):
+	"""Yields the bench's config to change in place, which is written once when the block
+	exits, if changed. Other bench processes can't change the config in the meantime, and
+	transactions & `update_config` calls nested in the block change the same config.
+
+	with config_transaction(bench_path) as config:
+	        config.update({"maintenance_mode": 1})
+	"""
+	config_path = os.path.realpath(get_config_path(bench_path))
+	transactions = _locks.__dict__.setdefault("transactions", {})
+	if config_path in transactions:
+		yield transactions[config_path]
+		return
+
+	with config_lock(bench_path):
+		config = transactions[config_path] = get_config(bench_path)
+		original = copy_config(config)
+		try:
+			yield config
+		finally:
+			del transactions[config_path]
+
+		if config != original:
+			put_config(config, bench_path=bench_path)
 
 
 def put_config(config, bench_path="."):
-	config_path = get_config_path(bench_path)
-	with open(config_path, "w") as f:
-		return json.dump(config, f, indent=1, sort_keys=True)
+	"""Writes the config to a temporary file that replaces common_site_config.json, so that
+	readers like gunicorn workers never see a partly written file"""
+	# resolved, as sites/ of releases link to the bench's config
+	config_path = os.path.realpath(get_config_path(bench_path))
+	tmp_path = f"{config_path}.{os.getpid()}.tmp"
+
+	with config_lock(bench_path):
+		try:
+			with open(tmp_path, "w") as f:
+				json.dump(config, f, indent=1, sort_keys=True)
+				f.flush()
+				os.fsync(f.fileno())
+			copy_file_owner(config_path, tmp_path)
+			os.replace(tmp_path, config_path)
+		except Exception:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(tmp_path)
+			raise
+
+
+def copy_file_owner(path, tmp_path):
+	"""Gives tmp_path, which is to replace path, the mode & owner of path, or the owner of
+	its directory if it doesn't exist yet. Files replaced as root, e.g. by `sudo bench
+	setup production`, stay writable by the bench's user."""
+	try:
+		st = os.stat(path)
+		os.chmod(tmp_path, st.st_mode & 0o7777)
+	except FileNotFoundError:
+		st = os.stat(os.path.dirname(path))
+
+	if os.geteuid() == 0:
+		os.chown(tmp_path, st.st_uid, st.st_gid)
 
 
 def update_config(new_config, bench_path="."):
-	config = get_config(bench_path=bench_path)
-	config.update(new_config)
-	put_config(config, bench_path=bench_path)
+	with config_transaction(bench_path) as config:
+		config.update(new_config)
 
 
 def get_config_path(bench_path):
@@ -93,49 +201,9 @@ def update_config_for_frappe(config, bench_path):
 
 
 def make_ports(bench_path):
-	from urllib.parse import urlparse
-
-	benches_path = os.path.dirname(os.path.abspath(bench_path))
-
-	default_ports = {
-		"webserver_port": 8000,
-		"socketio_port": 9000,
-		"file_watcher_port": 6787,
-		"redis_queue": 11000,
-		"redis_socketio": 13000,
-		"redis_cache": 13000,
-	}
-
-	# collect all existing ports
-	existing_ports = {}
-	for folder in os.listdir(benches_path):
-		bench_path = os.path.join(benches_path, folder)
-		if os.path.isdir(bench_path):
-			bench_config = get_config(bench_path)
-			for key in list(default_ports.keys()):
-				value = bench_config.get(key)
-
-				# extract port from redis url
-				if value and (key in ("redis_cache", "redis_queue", "redis_socketio")):
-					value = urlparse(value).port
-
-				if value:
-					existing_ports.setdefault(key, []).append(value)
-
-	# new port value = max of existing port value + 1
-	ports = {}
-	for key, value in list(default_ports.items()):
-		existing_value = existing_ports.get(key, [])
-		if existing_value:
-			value = max(existing_value) + 1
-
-		ports[key] = value
-
-	# Backward compatbility: always keep redis_cache and redis_socketio port same
-	# Note: not required from v15
-	ports["redis_socketio"] = ports["redis_cache"]
-
-	return ports
+	from bench.config.ports import allocate_ports
+
+	return allocate_ports(bench_path)
 
 
 def make_pid_folder(bench_path):
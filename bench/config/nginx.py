@@ -1,8 +1,12 @@
 # imports - standard imports
+import glob
 import hashlib
+import json
+import math
 import os
-import random
-import string
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
 
 # imports - third party imports
 import click
@@ -14,22 +18,56 @@ from bench.bench import Bench
 from bench.utils import get_bench_name
 
 
-def make_nginx_conf(bench_path, yes=False, logging=None, log_format=None):
+NGINX_INCLUDES_DIR = "nginx.d"
+
+# nginx's defaults for the hash tables it looks server names and map keys up in, see
+# https://nginx.org/en/docs/hash.html
+NGINX_HASH_SIZES = {
+	"server_names_hash_bucket_size": 64,
+	"server_names_hash_max_size": 512,
+	"map_hash_bucket_size": 64,
+	"map_hash_max_size": 2048,
+}
+NGINX_CONF_PATHS = [
+	"/etc/nginx/nginx.conf",
+	"/etc/nginx/conf.d/*.conf",
+	"/etc/nginx/sites-enabled/*",
+]
+
+
+def make_nginx_conf(
+	bench_path, yes=False, logging=None, log_format=None, reload=False
+) -> bool:
+	"""Generates config/nginx.conf, and with `nginx_per_site_config` set in
+	common_site_config.json, a file per site under config/nginx.d that nginx.conf
+	includes, see `make_nginx_includes`. Returns whether any of them changed, and with
+	`reload`, reloads nginx if they changed and are linked in nginx's config."""
 	conf_path = os.path.join(bench_path, "config", "nginx.conf")
 
 	if not yes and os.path.exists(conf_path):
 		if not click.confirm(
 			"nginx.conf already exists and this will overwrite it. Do you want to continue?"
 		):
-			return
+			return False
 
-	template = bench.config.env().get_template("nginx.conf")
+	env = bench.config.env()
 	bench_path = os.path.abspath(bench_path)
 	sites_path = os.path.join(bench_path, "sites")
 
 	config = Bench(bench_path).conf
 	sites = prepare_sites(config, bench_path)
 	bench_name = get_bench_name(bench_path)
+	map_routing = bool(config.get("dns_multitenant") and config.get("nginx_map_routing"))
+
+	# map routing serves sites from the default server of port 80, nginx allows only one
+	default_server = map_routing and get_default_server(80, exclude=conf_path)
+	if default_server:
+		click.secho(
+			f"{default_server} already has a default server on port 80, not using"
+			" nginx_map_routing for sites that use DNS",
+			fg="yellow",
+		)
+		map_routing = False
 
 	allow_rate_limiting = config.get("allow_rate_limiting", False)
 
@@ -42,8 +80,11 @@ def make_nginx_conf(bench_path, yes=False, logging=None, log_format=None):
 		"bench_name": bench_name,
 		"error_pages": get_error_pages(),
 		"allow_rate_limiting": allow_rate_limiting,
-		# for nginx map variable
-		"random_string": "".join(random.choice(string.ascii_lowercase) for i in range(7)),
+		# for nginx map variable, unique per bench and stable so that unchanged config
+		# renders the same
+		"random_string": hashlib.sha256(bench_path.encode()).hexdigest()[:7],
+		"map_routing": map_routing,
+		"hash_sizes": get_hash_sizes(sites, map_routing=map_routing, exclude=conf_path),
 	}
 
 	if logging and logging != "none":
@@ -55,15 +96,254 @@ def make_nginx_conf(bench_path, yes=False, logging=None, log_format=None):
 	if allow_rate_limiting:
 		template_vars.update(
 			{
-				"bench_name_hash": hashlib.sha256(bench_name).hexdigest()[:16],
+				"bench_name_hash": hashlib.sha256(bench_name.encode()).hexdigest()[:16],
 				"limit_conn_shared_memory": get_limit_conn_shared_memory(),
 			}
 		)
 
-	nginx_conf = template.render(**template_vars)
+	changed = False
+	if config.get("nginx_per_site_config"):
+		includes_path = os.path.join(bench_path, "config", NGINX_INCLUDES_DIR)
+		# the host is always mapped to the site, so that domains can be added to sites
+		# without changing nginx.conf
+		template_vars.update(
+			{
+				"includes_path": includes_path,
+				"site_name_variable": "$site_name_{}".format(template_vars["random_string"]),
+			}
+		)
+		changed = make_nginx_includes(env, template_vars, includes_path)
+		nginx_conf = env.get_template("nginx_includes.conf").render(**template_vars)
+	else:
+		nginx_conf = env.get_template("nginx.conf").render(**template_vars)
+
+	changed = write_if_changed(conf_path, nginx_conf) or changed
 
-	with open(conf_path, "w") as f:
-		f.write(nginx_conf)
+	if reload and changed and os.path.islink(f"/etc/nginx/conf.d/{bench_name}.conf"):
+		from bench.config.production_setup import reload_nginx
+
+		reload_nginx()
+
+	return changed
+
+
+def make_nginx_includes(env, template_vars, includes_path) -> bool:
+	"""Writes the nginx config of each site to files under `includes_path`, which the
+	nginx.conf of `nginx_includes.conf` includes:
+
+	- servers/<site>.conf: server blocks of the site and its domains with their own port
+	  or certificate
+	- names/<site>.conf & wildcard/<site>.conf: server names of the site in the server
+	  blocks shared by sites on DNS, without & with the wildcard certificate
+	- map/<site>.conf: domains of the site, to map the host to the site by
+
+	Files are only rendered for sites whose part of the config changed since the last run,
+	as recorded in .manifest.json, and only written if their content changed. Returns
+	whether any file changed.
+	"""
+	sites = template_vars["sites"]
+	site_name_variable = template_vars["site_name_variable"]
+	domain_map = sites["domain_map"]
+
+	def get_site(name):
+		return domain_map.get(name, name)
+
+	files = defaultdict(lambda: defaultdict(list))
+	for site in sites["that_use_ssl"]:
+		files[f"servers/{site['name']}.conf"]["ssl"].append(site)
+	for site in sites["that_use_port"]:
+		files[f"servers/{site['name']}.conf"]["port"].append(site)
+	for name in [] if template_vars["map_routing"] else sites["that_use_dns"]:
+		files[f"names/{get_site(name)}.conf"]["names"].append(name)
+	for name in sites["that_use_wildcard_ssl"]:
+		files[f"wildcard/{get_site(name)}.conf"]["names"].append(name)
+	for domain, site in domain_map.items():
+		files[f"map/{site}.conf"]["map"].append([domain, site])
+
+	# inputs the files are rendered from other than their sites
+	shared_inputs = {key: value for key, value in template_vars.items() if key != "sites"}
+	shared_inputs["template"] = env.loader.get_source(env, "nginx_macros.conf")[0]
+	shared_hash = hashlib.sha256(json.dumps(shared_inputs, sort_keys=True).encode()).hexdigest()
+
+	manifest_path = os.path.join(includes_path, ".manifest.json")
+	try:
+		with open(manifest_path) as f:
+			manifest = json.load(f)
+	except (FileNotFoundError, ValueError):
+		manifest = {}
+
+	macros = None
+	changed = False
+	new_manifest = {}
+
+	for path, inputs in files.items():
+		inputs_hash = hashlib.sha256(
+			(shared_hash + json.dumps(inputs, sort_keys=True)).encode()
+		).hexdigest()
+		new_manifest[path] = inputs_hash
+		file_path = os.path.join(includes_path, path)
+		if manifest.get(path) == inputs_hash and os.path.exists(file_path):
+			continue
+
+		if macros is None:
+			macros = env.get_template("nginx_macros.conf").make_module(template_vars)
+
+		content = []
+		for site in inputs["ssl"]:
+			content.append(
+				macros.server_block(
+					template_vars["bench_name"],
+					port=443,
+					server_names=[site.get("domain") or site["name"]],
+					site_name=site_name_variable,
+					sites_path=template_vars["sites_path"],
+					ssl_certificate=site["ssl_certificate"],
+					ssl_certificate_key=site["ssl_certificate_key"],
+				)
+			)
+		for site in inputs["port"]:
+			content.append(
+				macros.server_block(
+					template_vars["bench_name"],
+					port=site["port"],
+					server_names=[site["name"]],
+					site_name=site["name"],
+					sites_path=template_vars["sites_path"],
+				)
+			)
+		if inputs["names"]:
+			content.append(f"server_name {' '.join(inputs['names'])};\n")
+		for domain, site in inputs["map"]:
+			content.append(f"{domain} {site};\n")
+
+		changed = write_if_changed(file_path, "".join(content)) or changed
+
+	for path in set(manifest) - set(new_manifest):
+		file_path = os.path.join(includes_path, path)
+		if os.path.exists(file_path):
+			os.remove(file_path)
+			changed = True
+
+	if new_manifest != manifest:
+		write_if_changed(manifest_path, json.dumps(new_manifest, indent=1, sort_keys=True))
+
+	return changed
+
+
+def get_hash_sizes(sites, map_routing=False, exclude=None) -> Dict[str, int]:
+	"""Sizes of the server names & map hash tables of nginx that fit the bench's server
+	names and mapped domains, where nginx's defaults are too small. Sizes set in nginx's
+	config already aren't returned as nginx rejects duplicates, but warned about if too
+	small. With map routing, sites that use DNS don't have server names."""
+	server_names = [site.get("domain") or site["name"] for site in sites["that_use_ssl"]]
+	server_names += [site["name"] for site in sites["that_use_port"]]
+	server_names += sites["that_use_wildcard_ssl"]
+	if not map_routing:
+		server_names += sites["that_use_dns"]
+
+	required = {}
+	tables = {"server_names_hash": server_names, "map_hash": list(sites["domain_map"])}
+	for table, keys in tables.items():
+		bucket_size, max_size = get_hash_size(
+			keys, NGINX_HASH_SIZES[f"{table}_bucket_size"], NGINX_HASH_SIZES[f"{table}_max_size"]
+		)
+		required[f"{table}_bucket_size"] = bucket_size
+		required[f"{table}_max_size"] = max_size
+
+	configured = get_configured_hash_sizes(exclude=exclude)
+	hash_sizes = {}
+	for directive, size in required.items():
+		if directive not in configured:
+			if size > NGINX_HASH_SIZES[directive]:
+				hash_sizes[directive] = size
+		elif configured[directive][0] < size:
+			click.secho(
+				f"{directive} is {configured[directive][0]} in {configured[directive][1]},"
+				f" set it to {size} for nginx to fit the domains of this bench",
+				fg="yellow",
+			)
+	return hash_sizes
+
+
+def get_hash_size(keys: List[str], bucket_size: int, max_size: int) -> Tuple[int, int]:
+	"""Bucket & max size of an nginx hash table for `keys`, at least `bucket_size` and
+	`max_size`. nginx tries table sizes up to max size until the keys hashed into its
+	buckets fit them, so the table is allowed 2 buckets per key and buckets fit as many
+	keys as the fullest of them is expected to hold at that size."""
+	if not keys:
+		return bucket_size, max_size
+
+	max_size = max(max_size, 2 ** math.ceil(math.log2(2 * len(keys))))
+
+	# a bucket holds a pointer & the key's length and characters aligned to pointers
+	# per key, and a pointer ending it
+	entry_size = max(8 + math.ceil((len(key) + 2) / 8) * 8 for key in keys)
+
+	# keys per bucket is poisson distributed, allow as many as less than one bucket of
+	# the table is expected to exceed
+	load = len(keys) / max_size
+	capacity, probability = 1, math.exp(-load) * load
+	tail = 1 - math.exp(-load) - probability
+	while tail * max_size >= 1:
+		capacity += 1
+		probability *= load / capacity
+		tail -= probability
+	bucket_size = max(bucket_size, 2 ** math.ceil(math.log2(8 + capacity * entry_size)))
+
+	return bucket_size, max_size
+
+
+def get_configured_hash_sizes(exclude=None) -> Dict[str, Tuple[int, str]]:
+	"""Hash sizes set in nginx's config other than the file `exclude`, with the file they're
+	set in"""
+	pattern = re.compile(rf"^\s*({'|'.join(NGINX_HASH_SIZES)})\s+(\d+)\s*;", re.MULTILINE)
+	configured = {}
+
+	for path, content in get_nginx_configs(exclude=exclude):
+		for directive, size in pattern.findall(content):
+			configured.setdefault(directive, (int(size), path))
+
+	return configured
+
+
+def get_default_server(port: int, exclude=None) -> Optional[str]:
+	"""File of nginx's config other than `exclude` that has a default server on `port`"""
+	pattern = re.compile(
+		rf"^\s*listen\s+(?:\S*:)?{port}(?:\s[^;]*)?\sdefault_server\b", re.MULTILINE
+	)
+	for path, content in get_nginx_configs(exclude=exclude):
+		if pattern.search(content):
+			return path
+
+
+def get_nginx_configs(exclude=None) -> Iterable[Tuple[str, str]]:
+	"""Paths & contents of nginx's config files in NGINX_CONF_PATHS other than `exclude`"""
+	exclude = exclude and os.path.realpath(exclude)
+
+	for path in [path for paths in NGINX_CONF_PATHS for path in sorted(glob.glob(paths))]:
+		if os.path.realpath(path) == exclude:
+			continue
+		try:
+			with open(path) as f:
+				yield path, f.read()
+		except OSError:
+			continue
+
+
+def write_if_changed(path, content) -> bool:
+	"""Writes `content` to `path` through a temporary file, unless it already has that
+	content. Returns whether it was written."""
+	try:
+		with open(path) as f:
+			if f.read() == content:
+				return False
+	except FileNotFoundError:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+
+	with open(f"{path}.tmp", "w") as f:
+		f.write(content)
+	os.replace(f"{path}.tmp", path)
+	return True
 
 
 def make_bench_manager_nginx_conf(bench_path, yes=False, port=23624, domain=None):
@@ -195,18 +475,15 @@ def prepare_sites(config, bench_path):
 
 def get_sites_with_config(bench_path):
 	from bench.bench import Bench
-	from bench.config.site_config import get_site_config
+	from bench.config.site_config import get_site_inventory
 
 	bench = Bench(bench_path)
-	sites = bench.sites
 	conf = bench.conf
 	dns_multitenant = conf.get("dns_multitenant")
 
 	ret = []
-	for site in sites:
-		try:
-			site_config = get_site_config(site, bench_path=bench_path)
-		except Exception as e:
+	for site, site_config in get_site_inventory(bench_path).items():
+		if "error" in site_config:
 			strict_nginx = conf.get("strict_nginx")
 			if strict_nginx:
 				print(
@@ -215,7 +492,7 @@ def get_sites_with_config(bench_path):
 					"You may remove the 'strict_nginx' flag from common_site_config.json or set it to 0",
 					"\n\n",
 				)
-				raise e
+				raise Exception(site_config["error"])
 			else:
 				print(
 					f"\n\nWARNING: The site config for the site {site} is broken.",
@@ -0,0 +1,209 @@
+# imports - standard imports
+import fcntl
+import json
+import os
+import socket
+from contextlib import contextmanager
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+# imports - third party imports
+import click
+
+# imports - module imports
+from bench.config.common_site_config import get_config
+
+DEFAULT_PORTS = {
+	"webserver_port": 8000,
+	"socketio_port": 9000,
+	"file_watcher_port": 6787,
+	"redis_queue": 11000,
+	"redis_socketio": 13000,
+	"redis_cache": 13000,
+}
+REDIS_PORTS = ("redis_cache", "redis_queue", "redis_socketio")
+
+# Ports of the benches on this host are allocated from a registry in the user's config
+# directory, instead of reading the config of every bench next to the one being set up:
+# {"benches": {path: ports}, "next": {key: port}, "free": {key: [ports]}, "scanned": [dirs]}
+
+
+def get_registry_path() -> str:
+	config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+	return os.path.join(config_home, "bench", "ports.json")
+
+
+@contextmanager
+def port_registry():
+	"""Yields the port registry of this host, locked against other bench processes until
+	the block exits, and saves changes made to it"""
+	registry_path = get_registry_path()
+	os.makedirs(os.path.dirname(registry_path), exist_ok=True)
+
+	with open(f"{registry_path}.lock", "w") as lock_file:
+		fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+		try:
+			with open(registry_path) as f:
+				registry = json.load(f)
+		except (FileNotFoundError, ValueError):
+			registry = {}
+
+		for key in ("benches", "next", "free"):
+			registry.setdefault(key, {})
+		registry.setdefault("scanned", [])
+
+		yield registry
+
+		with open(f"{registry_path}.tmp", "w") as f:
+			json.dump(registry, f, indent=1, sort_keys=True)
+		os.replace(f"{registry_path}.tmp", registry_path)
+
+
+def get_bench_ports(bench_path) -> Dict[str, int]:
+	"""Ports set in the bench's common_site_config.json"""
+	bench_config = get_config(bench_path)
+	ports = {}
+	for key in DEFAULT_PORTS:
+		value = bench_config.get(key)
+
+		# extract port from redis url
+		if value and key in REDIS_PORTS:
+			value = urlparse(value).port
+
+		if value:
+			ports[key] = value
+	return ports
+
+
+def register_benches_in(benches_path, registry):
+	"""Registers the ports of benches in `benches_path` that were set up before the
+	registry, once per directory"""
+	if benches_path in registry["scanned"]:
+		return
+
+	for folder in os.listdir(benches_path):
+		bench_path = os.path.join(benches_path, folder)
+		if bench_path in registry["benches"] or not os.path.isdir(bench_path):
+			continue
+
+		ports = get_bench_ports(bench_path)
+		if not ports:
+			continue
+
+		registry["benches"][bench_path] = ports
+		for key, port in ports.items():
+			registry["next"][key] = max(registry["next"].get(key, 0), port + 1)
+
+	registry["scanned"].append(benches_path)
+
+
+def release_stale_ports(registry):
+	"""Releases ports of registered benches that don't exist anymore"""
+	for bench_path in list(registry["benches"]):
+		if not os.path.isdir(bench_path):
+			release_bench_ports(bench_path, registry)
+
+
+def release_bench_ports(bench_path, registry) -> Optional[Dict[str, int]]:
+	ports = registry["benches"].pop(bench_path, None)
+	for key, port in (ports or {}).items():
+		# redis_socketio shares its port with redis_cache
+		if key != "redis_socketio":
+			free = registry["free"].setdefault(key, [])
+			free.append(port)
+			free.sort()
+	return ports
+
+
+def is_port_in_use(port) -> bool:
+	with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+		try:
+			sock.bind(("", port))
+		except OSError:
+			return True
+	return False
+
+
+def take_port(key, registry, verify=False) -> int:
+	"""Takes the lowest released port for `key`, else the one after the highest
+	allocated. With `verify`, ports that something is listening on are skipped."""
+	while True:
+		free = registry["free"].get(key)
+		if free:
+			port = free.pop(0)
+		else:
+			port = registry["next"].get(key, DEFAULT_PORTS[key])
+			registry["next"][key] = port + 1
+
+		if not (verify and is_port_in_use(port)):
+			return port
+
+
+def allocate_ports(bench_path, verify=None) -> Dict[str, int]:
+	"""Returns ports for the bench from the host's port registry, registering those set
+	in its config and allocating the rest if the bench isn't registered yet. Allocated
+	ports are checked by binding them if `verify` is set, which defaults to the
+	BENCH_VERIFY_PORTS environment variable."""
+	bench_path = os.path.abspath(bench_path)
+	if verify is None:
+		verify = os.environ.get("BENCH_VERIFY_PORTS", "").lower() in ("1", "true", "yes")
+
+	with port_registry() as registry:
+		register_benches_in(os.path.dirname(bench_path), registry)
+
+		if bench_path not in registry["benches"]:
+			if not any(registry["free"].values()):
+				release_stale_ports(registry)
+
+			ports = get_bench_ports(bench_path)
+			for key, port in ports.items():
+				registry["next"][key] = max(registry["next"].get(key, 0), port + 1)
+			for key in DEFAULT_PORTS:
+				if key not in ports and key != "redis_socketio":
+					ports[key] = take_port(key, registry, verify=verify)
+
+			# Backward compatbility: always keep redis_cache and redis_socketio port same
+			# Note: not required from v15
+			ports["redis_socketio"] = ports["redis_cache"]
+			registry["benches"][bench_path] = ports
+
+		return {**DEFAULT_PORTS, **registry["benches"][bench_path]}
+
+
+def release_ports(bench_path):
+	"""Releases the bench's ports in the host's port registry for other benches to use"""
+	with port_registry() as registry:
+		release_bench_ports(os.path.abspath(bench_path), registry)
+
+
+def print_ports(check=False, prune=False):
+	with port_registry() as registry:
+		if prune:
+			release_stale_ports(registry)
+		benches = dict(registry["benches"])
+
+	if not benches:
+		click.echo("No ports allocated")
+		return
+
+	keys = [key for key in DEFAULT_PORTS if key != "redis_socketio"]
+	click.echo(f"{'BENCH':40}" + "".join(f"  {key.replace('_port', ''):>14}" for key in keys))
+	for bench_path, ports in sorted(benches.items()):
+		columns = []
+		for key in keys:
+			port = ports.get(key)
+			column = f"{port or '-':>14}"
+			if check and port and is_port_in_use(port):
+				column = click.style(column, fg="green")
+			columns.append(column)
+
+		name = bench_path if len(bench_path) <= 40 else f"...{bench_path[-37:]}"
+		line = f"{name:40}" + "".join(f"  {column}" for column in columns)
+		if os.path.isdir(bench_path):
+			click.echo(line)
+		else:
+			click.secho(f"{line}  (missing, release with --prune)", fg="yellow")
+
+	if check:
+		click.echo("\nPorts in use are highlighted")
@@ -7,6 +7,7 @@ import bench
 from bench.app import use_rq
 from bench.bench import Bench
 from bench.utils import which
+from bench.utils.release import get_runtime_path
 
 
 def setup_procfile(bench_path, yes=False, skip_redis=False):
@@ -25,6 +26,9 @@ def setup_procfile(bench_path, yes=False, skip_redis=False):
 		.get_template("Procfile")
 		.render(
 			node=which("node") or which("nodejs"),
+			apps_dir=os.path.relpath(
+				os.path.join(get_runtime_path(bench_path), "apps"), os.path.abspath(bench_path)
+			),
 			use_rq=use_rq(bench_path),
 			webserver_port=config.get("webserver_port"),
 			CI=os.environ.get("CI"),
@@ -52,9 +52,10 @@ def setup_production(user, bench_path=".", yes=False):
 		generate_supervisor_config(bench_path=bench_path, user=user, yes=yes)
 
 	print("Setting Up NGINX...")
+	# before generating the bench's config, which checks for other default servers
+	remove_default_nginx_configs()
 	make_nginx_conf(bench_path=bench_path, yes=yes)
 	fix_prod_setup_perms(bench_path, frappe_user=user)
-	remove_default_nginx_configs()
 
 	bench_name = get_bench_name(bench_path)
 	nginx_conf = f"/etc/nginx/conf.d/{bench_name}.conf"
@@ -1,7 +1,19 @@
 # imports - standard imports
+import contextlib
 import json
 import os
 from collections import defaultdict
+from typing import Dict
+
+# imports - module imports
+from bench.config.common_site_config import copy_file_owner
+
+# keys of site_config.json kept in the site inventory, credentials aren't
+INVENTORY_KEYS = ("domains", "host_name", "nginx_port", "ssl_certificate", "ssl_certificate_key")
+INVENTORY_FILE = "site_inventory.json"
+
+# sites are checked on a pool of threads in batches of this many
+INVENTORY_BATCH_SIZE = 256
 
 
 def get_site_config(site, bench_path="."):
@@ -13,9 +25,88 @@ def get_site_config(site, bench_path="."):
 
 
 def put_site_config(site, config, bench_path="."):
+	"""Writes site_config.json through a temporary file, so that frappe processes reading it
+	don't see it partly written"""
 	config_path = os.path.join(bench_path, "sites", site, "site_config.json")
-	with open(config_path, "w") as f:
-		return json.dump(config, f, indent=1)
+	tmp_path = f"{config_path}.{os.getpid()}.tmp"
+	try:
+		with open(tmp_path, "w") as f:
+			json.dump(config, f, indent=1)
+		copy_file_owner(config_path, tmp_path)
+		os.replace(tmp_path, config_path)
+	except Exception:
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(tmp_path)
+		raise
+
+
+def get_site_inventory(bench_path=".") -> Dict[str, Dict]:
+	"""Returns the bench's sites, in order, each with the INVENTORY_KEYS of its
+	site_config.json, or with an `error` if it can't be parsed.
+
+	Parsed configs are kept in config/site_inventory.json along with the mtime & size of
+	the file they were parsed from, so only configs that changed since are parsed again.
+	Sites are looked up with a scandir of sites/, their configs checked in parallel.
+	"""
+	from concurrent.futures import ThreadPoolExecutor
+
+	sites_path = os.path.join(bench_path, "sites")
+	inventory_path = os.path.join(bench_path, "config", INVENTORY_FILE)
+
+	try:
+		with open(inventory_path) as f:
+			inventory = json.load(f)
+	except (FileNotFoundError, ValueError):
+		inventory = {}
+
+	with os.scandir(sites_path) as entries:
+		names = sorted(entry.name for entry in entries if entry.is_dir())
+
+	def check(site):
+		config_path = os.path.join(sites_path, site, "site_config.json")
+		try:
+			stat = os.stat(config_path)
+		except (FileNotFoundError, NotADirectoryError):
+			return None
+
+		key = [stat.st_mtime_ns, stat.st_size]
+		entry = inventory.get(site)
+		if entry and entry["key"] == key:
+			return entry
+
+		try:
+			with open(config_path) as f:
+				site_config = json.load(f)
+			config = {k: site_config[k] for k in INVENTORY_KEYS if k in site_config}
+			return {"key": key, "config": config}
+		except Exception as e:
+			return {"key": key, "error": repr(e)}
+
+	def check_batch(batch):
+		return [(site, check(site)) for site in batch]
+
+	batches = [
+		names[i : i + INVENTORY_BATCH_SIZE] for i in range(0, len(names), INVENTORY_BATCH_SIZE)
+	]
+	if len(batches) > 1:
+		with ThreadPoolExecutor(max_workers=min(8, len(batches))) as executor:
+			results = [result for batch in executor.map(check_batch, batches) for result in batch]
+	else:
+		results = check_batch(names)
+
+	refreshed = {site: entry for site, entry in results if entry}
+	if refreshed != inventory and os.path.isdir(os.path.dirname(inventory_path)):
+		try:
+			with open(f"{inventory_path}.{os.getpid()}.tmp", "w") as f:
+				json.dump(refreshed, f)
+			os.replace(f"{inventory_path}.{os.getpid()}.tmp", inventory_path)
+		except OSError:
+			pass
+
+	return {
+		site: entry["config"] if "config" in entry else {"error": entry["error"]}
+		for site, entry in refreshed.items()
+	}
 
 
 def update_site_config(site, new_config, bench_path="."):
@@ -56,7 +147,7 @@ def set_site_config_nginx_property(site, config, bench_path=".", gen_config=True
 		raise Exception("No such site")
 	update_site_config(site, config, bench_path=bench_path)
 	if gen_config:
-		make_nginx_conf(bench_path=bench_path)
+		make_nginx_conf(bench_path=bench_path, reload=True)
 
 
 def set_url_root(site, url_root, bench_path="."):
@@ -108,7 +199,7 @@ def sync_domains(site, domains, bench_path="."):
 
 	if changed:
 		# replace existing domains with this one
-		update_site_config(site, {"domains": domains}, bench_path=".")
+		update_site_config(site, {"domains": domains}, bench_path=bench_path)
 
 	return changed
 
@@ -18,6 +18,7 @@ from bench.config.common_site_config import (
 	update_config,
 )
 from bench.utils import get_bench_name, which
+from bench.utils.release import get_runtime_path
 
 logger = logging.getLogger(bench.PROJECT_NAME)
 
@@ -42,6 +43,8 @@ def generate_supervisor_config(bench_path, user=None, yes=False, skip_redis=Fals
 		**{
 			"bench_dir": bench_dir,
 			"sites_dir": os.path.join(bench_dir, "sites"),
+			"env_dir": os.path.join(get_runtime_path(bench_path), "env"),
+			"apps_dir": os.path.join(get_runtime_path(bench_path), "apps"),
 			"user": user,
 			"use_rq": use_rq(bench_path),
 			"http_timeout": config.get("http_timeout", 120),
@@ -73,8 +76,10 @@ def generate_supervisor_config(bench_path, user=None, yes=False, skip_redis=Fals
 	with open(conf_path, "w") as f:
 		f.write(config)
 
-	update_config({"restart_supervisor_on_update": True}, bench_path=bench_path)
-	update_config({"restart_systemd_on_update": False}, bench_path=bench_path)
+	update_config(
+		{"restart_supervisor_on_update": True, "restart_systemd_on_update": False},
+		bench_path=bench_path,
+	)
 	sync_socketio_port(bench_path)
 
 
@@ -100,7 +105,7 @@ def sync_socketio_port(bench_path):
 	socketio_port = common_config.get("redis_socketio")
 	cache_port = common_config.get("redis_cache")
 	if socketio_port and socketio_port != cache_port:
-		update_config({"redis_socketio": cache_port})
+		update_config({"redis_socketio": cache_port}, bench_path=bench_path)
 
 
 def can_enable_multi_queue_consumption(bench_path: str) -> bool:
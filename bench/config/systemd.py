@@ -16,6 +16,7 @@ from bench.config.common_site_config import (
 	compute_max_requests_jitter,
 )
 from bench.utils import exec_cmd, which, get_bench_name
+from bench.utils.release import get_runtime_path
 
 
 def generate_systemd_config(
@@ -76,6 +77,8 @@ def generate_systemd_config(
 	bench_info = {
 		"bench_dir": bench_dir,
 		"sites_dir": os.path.join(bench_dir, "sites"),
+		"env_dir": os.path.join(get_runtime_path(bench_path), "env"),
+		"apps_dir": os.path.join(get_runtime_path(bench_path), "apps"),
 		"user": user,
 		"use_rq": use_rq(bench_path),
 		"http_timeout": config.get("http_timeout", 120),
@@ -104,8 +107,10 @@ def generate_systemd_config(
 	setup_web_config(bench_info, bench_path)
 	setup_redis_config(bench_info, bench_path)
 
-	update_config({"restart_systemd_on_update": False}, bench_path=bench_path)
-	update_config({"restart_supervisor_on_update": False}, bench_path=bench_path)
+	update_config(
+		{"restart_systemd_on_update": False, "restart_supervisor_on_update": False},
+		bench_path=bench_path,
+	)
 
 
 def setup_systemd_directory(bench_path):
@@ -1,15 +1,49 @@
 import os
 import shutil
+import stat
 import subprocess
 import unittest
 
 from bench.app import App
 from bench.bench import Bench
 from bench.exceptions import InvalidRemoteException
-from bench.utils import is_valid_frappe_branch
+from bench.utils import is_valid_frappe_branch, run_in_parallel, setup_logging
+from bench.utils.git import get_git_state, invalidate_git_state
+
+
+def make_test_bench(apps, node_apps=()) -> str:
+	"""Creates a bench in a temporary directory with empty frappe apps, each with a
+	pyproject.toml and `node_apps` of them with a package.json"""
+	import tempfile
+
+	bench_path = tempfile.mkdtemp()
+	for folder in ("sites", "config", "logs"):
+		os.makedirs(os.path.join(bench_path, folder))
+	with open(os.path.join(bench_path, "sites", "apps.txt"), "w") as f:
+		f.write("\n".join(apps))
+
+	for app in apps:
+		module_path = os.path.join(bench_path, "apps", app, app)
+		os.makedirs(module_path)
+		with open(os.path.join(module_path, "__init__.py"), "w") as f:
+			f.write('__version__ = "15.0.0"\n')
+		for filename in ("hooks.py", "modules.txt", "patches.txt"):
+			open(os.path.join(module_path, filename), "w").close()
+		with open(os.path.join(bench_path, "apps", app, "pyproject.toml"), "w") as f:
+			f.write(f'[project]\nname = "{app}"\n')
+		if app in node_apps:
+			with open(os.path.join(bench_path, "apps", app, "package.json"), "w") as f:
+				f.write("{}")
+
+	return bench_path
 
 
 class TestUtils(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		# as in the CLI, which sets up bench's logger that code logs to with logger.log
+		setup_logging()
+
 	def test_app_utils(self):
 		git_url = "https://github.com/frappe/frappe"
 		branch = "develop"
@@ -104,3 +138,644 @@ class TestUtils(unittest.TestCase):
 		self.assertEqual(
 			(app.use_ssh, app.org, app.repo, app.app_name), (True, "frappe", "frappe", "frappe")
 		)
+
+	def test_run_in_parallel(self):
+		def square(item, output):
+			output.append(f"{item}\n")
+			return item * item
+
+		self.assertEqual(run_in_parallel(square, [1, 2, 3], workers=2), {1: 1, 2: 4, 3: 9})
+
+		def fail_on_two(item, output):
+			if item == 2:
+				raise ValueError(item)
+			return item
+
+		with self.assertRaises(ValueError):
+			run_in_parallel(fail_on_two, [1, 2, 3], workers=2)
+
+		results = run_in_parallel(fail_on_two, [1, 2, 3], workers=2, stop_on_failure=False)
+		self.assertEqual((results[1], results[3]), (1, 3))
+		self.assertIsInstance(results[2], ValueError)
+
+		def exit_on_two(item, output):
+			if item == 2:
+				raise SystemExit(1)
+			return item
+
+		with self.assertRaises(SystemExit):
+			run_in_parallel(exit_on_two, [1, 2, 3], workers=2, stop_on_failure=False)
+
+	def test_git_state(self):
+		repo_dir = "./sandbox_git_state"
+		os.makedirs(repo_dir)
+
+		def git(*args):
+			return subprocess.run(
+				["git", *args], cwd=repo_dir, capture_output=True, check=True, text=True
+			).stdout.strip()
+
+		git("init", "-b", "develop")
+		git("config", "user.email", "bench-test_git_state@gha.com")
+		git("config", "user.name", "Git State Test")
+		git("commit", "--allow-empty", "-m", "temp")
+		git("remote", "add", "origin", "https://github.com/frappe/frappe.git")
+
+		state = get_git_state(repo_dir)
+		self.assertIs(state, get_git_state(repo_dir))
+		self.assertEqual(state.branch, "develop")
+		self.assertEqual(state.head, git("rev-parse", "HEAD"))
+		self.assertEqual(state.get_remote(), "origin")
+		self.assertEqual(state.remotes["origin"], "https://github.com/frappe/frappe.git")
+		self.assertFalse(state.is_shallow)
+
+		git("tag", "v1.0.0")
+		git("pack-refs", "--all")
+		invalidate_git_state(repo_dir)
+		state = get_git_state(repo_dir)
+		self.assertEqual(state.resolve("v1.0.0"), git("rev-parse", "v1.0.0"))
+		self.assertEqual(state.resolve("develop"), state.head)
+
+		git("checkout", "-b", "feature/x")
+		invalidate_git_state(repo_dir)
+		self.assertEqual(get_git_state(repo_dir).branch, "feature/x")
+
+		# remotes of included config files are resolved by git
+		with open(os.path.join(repo_dir, ".git", "remotes.inc"), "w") as f:
+			f.write('[remote "upstream"]\n\turl = https://github.com/frappe/bench.git\n')
+		git("config", "include.path", "remotes.inc")
+		invalidate_git_state(repo_dir)
+		state = get_git_state(repo_dir)
+		self.assertEqual(state.get_remote(), "upstream")
+		self.assertEqual(state.remotes["origin"], "https://github.com/frappe/frappe.git")
+
+		git("checkout", "--detach")
+		invalidate_git_state(repo_dir)
+		self.assertIsNone(get_git_state(repo_dir).branch)
+
+		self.assertIsNone(get_git_state(os.path.join(repo_dir, ".git")))
+		shutil.rmtree(repo_dir)
+
+	def test_app_cache_store(self):
+		from pathlib import Path
+
+		from bench.utils.cache import materialize, store_directory
+
+		app_dir = Path("./sandbox_app_cache/app")
+		(app_dir / "app" / "__pycache__").mkdir(parents=True)
+		(app_dir / "app" / "__init__.py").write_text("__version__ = '1.0.0'\n")
+		(app_dir / "app" / "__pycache__" / "__init__.pyc").write_bytes(b"")
+		(app_dir / "app" / "hooks.py").write_text("__version__ = '1.0.0'\n")
+		(app_dir / "run.sh").write_text("#!/bin/sh\n")
+		(app_dir / "run.sh").chmod(0o755)
+		(app_dir / "hooks.py").symlink_to("app/hooks.py")
+
+		manifest = store_directory(app_dir, "app", "test_app_cache_store")
+		objects = {entry[3] for entry in manifest["entries"] if entry[1] == "f"}
+		self.assertEqual(len(objects), 2)
+
+		restored_dir = Path("./sandbox_app_cache/restored")
+		materialize(manifest, restored_dir)
+		self.assertEqual((restored_dir / "hooks.py").read_text(), "__version__ = '1.0.0'\n")
+		self.assertTrue(os.access(restored_dir / "run.sh", os.X_OK))
+		# restored files are copies with their own mode, not read-only links to objects
+		for name in ("run.sh", "app/hooks.py"):
+			self.assertEqual(
+				stat.S_IMODE((restored_dir / name).stat().st_mode),
+				stat.S_IMODE((app_dir / name).stat().st_mode),
+			)
+		self.assertFalse((restored_dir / "app" / "__pycache__").exists())
+		shutil.rmtree("./sandbox_app_cache")
+
+	def test_parallel_yarn_installs(self):
+		import time
+		from unittest.mock import patch
+
+		from bench.utils.bench import update_yarn_packages
+
+		apps = ["frappe", "app_b", "app_c"]
+		bench_path = make_test_bench(apps, node_apps=apps)
+		self.addCleanup(shutil.rmtree, bench_path)
+
+		# records the cache folder each install uses
+		bin_path = os.path.join(bench_path, "bin")
+		os.makedirs(bin_path)
+		with open(os.path.join(bin_path, "yarn"), "w") as f:
+			f.write(
+				"#!/bin/sh\nsleep 1\nmkdir -p node_modules\ntouch node_modules/.yarn-integrity\n"
+				'for arg; do cache=$arg; done\necho "$cache" > node_modules/cache\n'
+			)
+		os.chmod(os.path.join(bin_path, "yarn"), 0o755)
+
+		env = {"HOME": bench_path, "PATH": f"{bin_path}:{os.environ['PATH']}"}
+		with patch.dict(os.environ, env):
+			start = time.monotonic()
+			timings = update_yarn_packages(bench_path, apps=apps, jobs=3)
+			self.assertLess(time.monotonic() - start, 2.5)
+
+			self.assertEqual(sorted(timings), sorted(apps))
+			caches = set()
+			for app in apps:
+				with open(os.path.join(bench_path, "apps", app, "node_modules", "cache")) as f:
+					caches.add(f.read())
+			self.assertEqual(len(caches), 3)
+
+			# unchanged apps with complete node_modules are skipped
+			self.assertEqual(update_yarn_packages(bench_path, apps=apps, jobs=3), {})
+
+	def test_helper_daemon(self):
+		import sys
+
+		from bench.utils.bench import get_env_cmd
+		from bench.utils.helper_daemon import (
+			get_command_name,
+			run_in_daemon,
+			start_daemon,
+			stop_daemon,
+		)
+
+		bench_path = make_test_bench(["frappe"])
+		self.addCleanup(shutil.rmtree, bench_path)
+		os.makedirs(os.path.join(bench_path, "env", "bin"))
+		os.symlink(sys.executable, os.path.join(bench_path, "env", "bin", "python"))
+		site_packages = os.path.join(bench_path, "env", "lib", "python3", "site-packages")
+		os.makedirs(site_packages)
+		get_env_cmd.cache_clear()
+		self.addCleanup(get_env_cmd.cache_clear)
+
+		# the daemon imports frappe's bench_helper from sites/, this one logs commands
+		helper_path = os.path.join(bench_path, "sites", "frappe", "utils")
+		os.makedirs(helper_path)
+		for module in ("__init__.py", "utils/__init__.py"):
+			open(os.path.join(bench_path, "sites", "frappe", module), "w").close()
+		with open(os.path.join(helper_path, "bench_helper.py"), "w") as f:
+			f.write(
+				"import sys\n\ndef get_app_groups():\n\tpass\n\ndef main():\n"
+				"\twith open('commands.log', 'a') as f:\n\t\tf.write(' '.join(sys.argv[2:]))\n"
+				"\tsys.exit(int(sys.argv[-1]))\n"
+			)
+
+		self.assertEqual(get_command_name(["--site", "a.local", "migrate", "--force"]), "migrate")
+		self.assertEqual(get_command_name(["--verbose", "--site", "all", "console"]), "console")
+
+		start_daemon(bench_path)
+		self.addCleanup(stop_daemon, bench_path)
+
+		self.assertEqual(run_in_daemon(["--site", "a.local", "exit", "3"], bench_path), 3)
+		with open(os.path.join(bench_path, "sites", "commands.log")) as f:
+			self.assertEqual(f.read(), "--site a.local exit 3")
+
+		# excluded commands always run in their own process
+		self.assertIsNone(run_in_daemon(["--site", "a.local", "console", "0"], bench_path))
+
+		# the daemon is stale once packages are installed in the env
+		os.utime(site_packages, (0, 0))
+		self.assertIsNone(run_in_daemon(["--site", "a.local", "exit", "0"], bench_path))
+
+	def test_batched_requirements(self):
+		import time
+		from unittest.mock import patch
+
+		from bench.utils.bench import get_env_cmd
+
+		apps = ["frappe", "app_b"]
+		bench_path = make_test_bench(apps, node_apps=["app_b"])
+		self.addCleanup(shutil.rmtree, bench_path)
+		with open(os.path.join(bench_path, "apps", "frappe", "frappe", "hooks.py"), "w") as f:
+			f.write('develop_version = "15.x.x-develop"\n')
+		for app in apps:
+			subprocess.run(["git", "init", "-q"], cwd=os.path.join(bench_path, "apps", app), check=True)
+
+		# pip & yarn stand-ins that log their arguments, installs of apps take a second
+		bin_path = os.path.join(bench_path, "env", "bin")
+		os.makedirs(bin_path)
+		for name in ("python", "yarn"):
+			with open(os.path.join(bin_path, name), "w") as f:
+				f.write(
+					f'#!/bin/sh\necho "{name} $*" >> {bench_path}/commands.log\n'
+					'case "$*" in *"-e "*|*install\\ --check-files*) sleep 1;; esac\n'
+				)
+			os.chmod(os.path.join(bin_path, name), 0o755)
+		get_env_cmd.cache_clear()
+		self.addCleanup(get_env_cmd.cache_clear)
+
+		env = {"HOME": bench_path, "PATH": f"{bin_path}:{os.environ['PATH']}"}
+		with patch.dict(os.environ, env):
+			start = time.monotonic()
+			Bench(bench_path).setup.requirements(batch=True)
+			duration = time.monotonic() - start
+
+		with open(os.path.join(bench_path, "commands.log")) as f:
+			commands = f.read().splitlines()
+		pip_installs = [command for command in commands if "install" in command and "-e" in command]
+		self.assertEqual(len(pip_installs), 1)
+		for app in apps:
+			self.assertIn(f"-e {os.path.realpath(os.path.join(bench_path, 'apps', app))}", pip_installs[0])
+		# app_b's yarn install runs alongside the pip install
+		self.assertTrue(any(command.startswith("yarn install") for command in commands))
+		self.assertLess(duration, 1.8)
+
+	def test_build_manifest(self):
+		from bench.utils.bench import get_unchanged_apps, update_build_manifest
+
+		apps = ["frappe", "app_b"]
+		bench_path = make_test_bench(apps)
+		self.addCleanup(shutil.rmtree, bench_path)
+
+		def commit(app, path, content):
+			app_path = os.path.join(bench_path, "apps", app)
+			os.makedirs(os.path.dirname(os.path.join(app_path, path)), exist_ok=True)
+			with open(os.path.join(app_path, path), "w") as f:
+				f.write(content)
+			for args in (["add", "."], ["commit", "-qm", path]):
+				subprocess.run(
+					["git", "-c", "user.name=test", "-c", "user.email=test@localhost", *args],
+					cwd=app_path,
+					check=True,
+				)
+
+		for app in apps:
+			subprocess.run(["git", "init", "-q"], cwd=os.path.join(bench_path, "apps", app))
+			commit(app, f"{app}/public/js/{app}.js", "")
+			os.makedirs(os.path.join(bench_path, "sites", "assets", app))
+
+		self.assertEqual(get_unchanged_apps(bench_path, apps), [])
+		update_build_manifest(bench_path)
+		self.assertEqual(get_unchanged_apps(bench_path, apps), apps)
+
+		# changes outside of frontend sources don't need a build
+		commit("app_b", "app_b/hooks.py", "app_name = 'app_b'\n")
+		self.assertEqual(get_unchanged_apps(bench_path, apps), apps)
+
+		commit("app_b", "app_b/public/js/app_b.js", "console.log('app_b')\n")
+		self.assertEqual(get_unchanged_apps(bench_path, apps), ["frappe"])
+		update_build_manifest(bench_path, ["app_b"])
+		self.assertEqual(get_unchanged_apps(bench_path, apps), apps)
+
+		# uncommitted sources can't be hashed
+		with open(os.path.join(bench_path, "apps", "app_b", "package.json"), "w") as f:
+			f.write("{}")
+		self.assertEqual(get_unchanged_apps(bench_path, apps), ["frappe"])
+
+		# every app is rebuilt when frappe changes
+		commit("frappe", "frappe/public/js/frappe.js", "console.log('frappe')\n")
+		self.assertEqual(get_unchanged_apps(bench_path, apps), [])
+
+	def test_run_on_sites(self):
+		from bench.utils.bench import get_env_cmd
+		from bench.utils.system import run_on_sites
+
+		bench_path = make_test_bench(["frappe"])
+		self.addCleanup(shutil.rmtree, bench_path)
+		bin_path = os.path.join(bench_path, "env", "bin")
+		os.makedirs(bin_path)
+		with open(os.path.join(bin_path, "python"), "w") as f:
+			f.write('#!/bin/sh\necho "$*"\ncase "$*" in *b.local*) exit 3;; esac\n')
+		os.chmod(os.path.join(bin_path, "python"), 0o755)
+		get_env_cmd.cache_clear()
+		self.addCleanup(get_env_cmd.cache_clear)
+
+		sites = ["a.local", "b.local"]
+		results = run_on_sites(
+			"backup", sites, bench_path=bench_path, concurrency=2, args=["--compress"]
+		)
+		self.assertEqual(results, {"a.local": 0, "b.local": 3})
+
+		# each site's output goes to its own log under logs/<command>
+		logs_path = os.path.join(bench_path, "logs", "backup")
+		self.assertEqual(sorted(os.listdir(logs_path)), ["a.local.log", "b.local.log"])
+		for site in sites:
+			with open(os.path.join(logs_path, f"{site}.log")) as f:
+				self.assertEqual(
+					f.read(), f"-m frappe.utils.bench_helper frappe --site {site} backup --compress\n"
+				)
+
+	def test_releases(self):
+		import json
+		import time
+
+		from bench.utils.release import (
+			RELEASES_DIR,
+			activate_release,
+			add_release_apps,
+			gc_releases,
+			get_current_release,
+			get_releases,
+			rollback_release,
+		)
+
+		bench_path = make_test_bench(["frappe"])
+		self.addCleanup(shutil.rmtree, bench_path)
+		app_path = os.path.join(bench_path, "apps", "frappe")
+		subprocess.run(["git", "init", "-q"], cwd=app_path, check=True)
+		subprocess.run(["git", "add", "."], cwd=app_path, check=True)
+		subprocess.run(
+			["git", "-c", "user.name=test", "-c", "user.email=test@localhost", "commit", "-qm", "init"],
+			cwd=app_path,
+			check=True,
+		)
+		os.makedirs(os.path.join(bench_path, "sites", "assets"))
+
+		# releases as prepare_release makes them, without an env or built assets
+		for name in ("r1", "r2", "r3"):
+			release_path = os.path.join(bench_path, RELEASES_DIR, name)
+			os.makedirs(os.path.join(release_path, "apps"))
+			os.makedirs(os.path.join(release_path, "sites", "assets"))
+			commits = add_release_apps(Bench(bench_path), release_path)
+			with open(os.path.join(release_path, "release.json"), "w") as f:
+				json.dump({"name": name, "created": time.time(), "apps": commits}, f)
+		self.assertEqual(get_releases(bench_path), ["r1", "r2", "r3"])
+
+		activate_release("r1", bench_path=bench_path, migrate=False)
+		activate_release("r2", bench_path=bench_path, migrate=False)
+		self.assertEqual(get_current_release(bench_path), "r2")
+		self.assertEqual(
+			os.path.realpath(os.path.join(bench_path, "sites", "assets")),
+			os.path.realpath(os.path.join(bench_path, RELEASES_DIR, "r2", "sites", "assets")),
+		)
+		# assets built before releases are archived, not removed
+		self.assertTrue(os.path.isdir(os.path.join(bench_path, "archived", "assets-r1")))
+
+		rollback_release(bench_path=bench_path)
+		self.assertEqual(get_current_release(bench_path), "r1")
+
+		# the newest release, the current one and the one before it are kept
+		activate_release("r3", bench_path=bench_path, migrate=False)
+		gc_releases(bench_path=bench_path, retention=1)
+		self.assertEqual(get_releases(bench_path), ["r1", "r3"])
+		worktrees = subprocess.check_output(["git", "worktree", "list"], cwd=app_path, text=True)
+		self.assertNotIn(os.path.join(RELEASES_DIR, "r2"), worktrees)
+
+	def test_backup_schedule(self):
+		from bench.utils.system import (
+			BACKUP_INTERVAL,
+			BACKUP_TICK,
+			get_backup_schedule,
+			get_backup_slot,
+			get_due_sites,
+			get_retry_delay,
+		)
+
+		slots = BACKUP_INTERVAL // BACKUP_TICK
+		sites = [f"site{i}.local" for i in range(100)]
+
+		schedule = get_backup_schedule(sites, {}, slots)
+		self.assertEqual(schedule, {site: get_backup_slot(site, slots) for site in sites})
+		self.assertGreater(len(set(schedule.values())), slots // 2)
+
+		stats = {site: {"duration": 100 if i < 3 else 1} for i, site in enumerate(sites)}
+		schedule = get_backup_schedule(sites, stats, slots)
+		self.assertEqual(len({schedule[site] for site in sites[:3]}), 3)
+
+		now = 1000 * slots * BACKUP_TICK * 60
+		current = [site for site in sites if schedule[site] == 0]
+		stats = {site: {"last_backup": now - BACKUP_INTERVAL * 60} for site in sites}
+		stats[sites[-1]]["last_backup"] = now - 2 * BACKUP_INTERVAL * 60
+		stats[sites[-2]]["failed"] = True
+		self.assertEqual(
+			set(get_due_sites(schedule, stats, now)), set(current) | set(sites[-2:])
+		)
+
+		# failing sites are retried after 1, 2, 4... ticks, at most once an interval
+		site = next(site for site in sites if site not in current)
+		stats[site].update(failed=True, failures=3, last_attempt=now - 3 * BACKUP_TICK * 60)
+		self.assertNotIn(site, get_due_sites(schedule, stats, now))
+		stats[site]["last_attempt"] = now - 4 * BACKUP_TICK * 60 + 5
+		self.assertIn(site, get_due_sites(schedule, stats, now))
+		self.assertEqual(get_retry_delay(100), BACKUP_INTERVAL)
+
+	def test_task_graph(self):
+		import time
+
+		from bench.utils.pipeline import TaskGraph
+
+		graph = TaskGraph(workers=4, resources={"pip": 1})
+		graph.add("fetch", lambda output: time.sleep(0.1))
+		graph.add("python:a", lambda output: time.sleep(0.05), deps=["fetch"], resource="pip")
+		graph.add("python:b", lambda output: time.sleep(0.05), deps=["fetch"], resource="pip")
+		graph.add("backup", lambda output: output.append("backup\n"))
+		graph.add("reload", lambda output: None, deps=list(graph.tasks))
+		graph.run()
+
+		tasks = graph.tasks
+		self.assertLess(tasks["backup"].start, tasks["fetch"].end)
+		self.assertGreaterEqual(tasks["python:a"].start, tasks["fetch"].end)
+		first, second = sorted((tasks["python:a"], tasks["python:b"]), key=lambda t: t.start)
+		self.assertGreaterEqual(second.start, first.end)
+		self.assertEqual(
+			[task.name for task in graph.get_critical_path()],
+			["fetch", second.name, "reload"],
+		)
+
+		graph = TaskGraph(workers=1)
+		graph.add("fail", lambda output: 1 / 0)
+		graph.add("after", lambda output: None, deps=["fail"])
+		self.assertRaises(ZeroDivisionError, graph.run)
+		self.assertIsNone(graph.tasks["after"].start)
+
+		with self.assertRaises(ValueError):
+			graph.add("typo", lambda output: None, deps=["fial"])
+
+	def test_output_relay(self):
+		import io
+		import sys
+
+		from bench.utils.relay import OutputRelay
+
+		script = (
+			"import sys\n"
+			"for i in range(3): print(i)\n"
+			"sys.stderr.write('error\\n')\n"
+			"sys.stdout.write('50%\\r100%\\rdone')\n"
+		)
+		p = subprocess.Popen(
+			[sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+		)
+		output, log = [], io.StringIO()
+		with OutputRelay(prefix="a.local: ", tee=[log], output=output) as relay:
+			relay.relay_process(p)
+		p.wait()
+
+		lines = "".join(output).splitlines(keepends=True)
+		self.assertEqual(
+			[line for line in lines if line != "a.local: error\n"],
+			["a.local: 0\n", "a.local: 1\n", "a.local: 2\n", "a.local: 50%\r", "a.local: 100%\r", "a.local: done"],
+		)
+		self.assertIn("a.local: error\n", lines)
+		self.assertEqual(log.getvalue(), "".join(output))
+
+	def test_port_registry(self):
+		import tempfile
+		from unittest.mock import patch
+
+		from bench.config.ports import allocate_ports, release_ports
+
+		tmp_path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, tmp_path)
+		benches = [os.path.join(tmp_path, "benches", name) for name in ("a", "b", "c")]
+		for bench_path in benches:
+			os.makedirs(os.path.join(bench_path, "sites"))
+
+		with patch.dict(os.environ, {"XDG_CONFIG_HOME": os.path.join(tmp_path, "config")}):
+			a, b = allocate_ports(benches[0]), allocate_ports(benches[1])
+			self.assertEqual(a["webserver_port"], 8000)
+			self.assertEqual(b["webserver_port"], 8001)
+			self.assertEqual(b["redis_socketio"], b["redis_cache"])
+			self.assertEqual(allocate_ports(benches[0]), a)
+
+			release_ports(benches[0])
+			self.assertEqual(allocate_ports(benches[2])["webserver_port"], 8000)
+
+	def test_config_transaction(self):
+		import tempfile
+
+		from bench.config.common_site_config import (
+			config_transaction,
+			get_config,
+			get_config_path,
+			update_config,
+		)
+
+		bench_path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_path)
+		os.makedirs(os.path.join(bench_path, "sites"))
+		config_path = get_config_path(bench_path)
+
+		update_config({"workers": {"short": 1}}, bench_path=bench_path)
+		get_config(bench_path)["workers"]["short"] = 2
+		self.assertEqual(get_config(bench_path)["workers"], {"short": 1})
+
+		inode = os.stat(config_path).st_ino
+		with config_transaction(bench_path) as config:
+			config["maintenance_mode"] = 1
+			update_config({"pause_scheduler": 1}, bench_path=bench_path)
+			self.assertEqual(os.stat(config_path).st_ino, inode)
+		self.assertNotEqual(os.stat(config_path).st_ino, inode)
+		config = get_config(bench_path)
+		self.assertEqual((config["maintenance_mode"], config["pause_scheduler"]), (1, 1))
+
+		inode = os.stat(config_path).st_ino
+		with config_transaction(bench_path):
+			pass
+		self.assertEqual(os.stat(config_path).st_ino, inode)
+
+	def test_site_inventory(self):
+		import json
+		import tempfile
+
+		from bench.config.site_config import get_site_inventory, update_site_config
+
+		bench_path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_path)
+		os.makedirs(os.path.join(bench_path, "config"))
+		os.makedirs(os.path.join(bench_path, "sites", "assets"))
+		for site in ("b.local", "a.local", "broken.local"):
+			os.makedirs(os.path.join(bench_path, "sites", site))
+			with open(os.path.join(bench_path, "sites", site, "site_config.json"), "w") as f:
+				f.write("{" if site == "broken.local" else json.dumps({"db_password": "x"}))
+
+		inventory = get_site_inventory(bench_path)
+		self.assertEqual(list(inventory), ["a.local", "b.local", "broken.local"])
+		self.assertEqual(inventory["a.local"], {})
+		self.assertIn("error", inventory["broken.local"])
+
+		update_site_config("a.local", {"nginx_port": 8080}, bench_path=bench_path)
+		self.assertEqual(get_site_inventory(bench_path)["a.local"], {"nginx_port": 8080})
+		with open(os.path.join(bench_path, "config", "site_inventory.json")) as f:
+			self.assertNotIn("db_password", f.read())
+
+	def test_nginx_per_site_config(self):
+		import json
+		import tempfile
+
+		from bench.config.nginx import make_nginx_conf
+		from bench.config.site_config import update_site_config
+
+		bench_path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, bench_path)
+		os.makedirs(os.path.join(bench_path, "config"))
+		os.makedirs(os.path.join(bench_path, "sites", "assets"))
+		with open(os.path.join(bench_path, "sites", "common_site_config.json"), "w") as f:
+			json.dump({"dns_multitenant": 1, "nginx_per_site_config": 1}, f)
+		for site in ("a.local", "b.local"):
+			os.makedirs(os.path.join(bench_path, "sites", site))
+			update_site_config(site, {}, bench_path=bench_path)
+
+		includes_path = os.path.join(bench_path, "config", "nginx.d")
+		self.assertTrue(make_nginx_conf(bench_path, yes=True))
+		self.assertFalse(make_nginx_conf(bench_path, yes=True))
+		self.assertEqual(
+			sorted(os.listdir(os.path.join(includes_path, "names"))),
+			["a.local.conf", "b.local.conf"],
+		)
+
+		update_site_config("a.local", {"domains": ["a.com"]}, bench_path=bench_path)
+		self.assertTrue(make_nginx_conf(bench_path, yes=True))
+		with open(os.path.join(includes_path, "names", "a.local.conf")) as f:
+			self.assertEqual(f.read(), "server_name a.local a.com;\n")
+		with open(os.path.join(includes_path, "map", "a.local.conf")) as f:
+			self.assertEqual(f.read(), "a.com a.local;\n")
+
+		update_site_config("a.local", {"domains": []}, bench_path=bench_path)
+		self.assertTrue(make_nginx_conf(bench_path, yes=True))
+		self.assertFalse(os.path.exists(os.path.join(includes_path, "map", "a.local.conf")))
+
+	def test_nginx_hash_sizes(self):
+		import tempfile
+		from unittest.mock import patch
+
+		from bench.config.nginx import get_default_server, get_hash_size, get_hash_sizes
+
+		self.assertEqual(get_hash_size(["a.local", "b.local"], 64, 512), (64, 512))
+
+		domains = [f"site-{i}.example.com" for i in range(5000)]
+		bucket_size, max_size = get_hash_size(domains, 64, 512)
+		self.assertGreaterEqual(max_size, 2 * len(domains))
+		self.assertGreater(bucket_size, 64)
+
+		sites = {
+			"that_use_port": [],
+			"that_use_dns": domains,
+			"that_use_ssl": [],
+			"that_use_wildcard_ssl": [],
+			"domain_map": {},
+		}
+		# sizes set in the host's nginx config aren't repeated
+		with patch("bench.config.nginx.NGINX_CONF_PATHS", []):
+			self.assertIn("server_names_hash_max_size", get_hash_sizes(sites))
+			self.assertEqual(get_hash_sizes(sites, map_routing=True), {})
+
+		# map routing needs the default server of port 80
+		with tempfile.NamedTemporaryFile("w", suffix=".conf") as f:
+			f.write("server {\n\tlisten [::]:80 default_server;\n}\n")
+			f.flush()
+			with patch("bench.config.nginx.NGINX_CONF_PATHS", [f.name]):
+				self.assertEqual(get_default_server(80), f.name)
+				self.assertIsNone(get_default_server(8080))
+				self.assertIsNone(get_default_server(80, exclude=f.name))
+
+	def test_timings(self):
+		import tempfile
+
+		from bench.utils import timings
+
+		bench_path = tempfile.mkdtemp()
+		os.makedirs(os.path.join(bench_path, "logs"))
+		self.addCleanup(shutil.rmtree, bench_path)
+		self.addCleanup(setattr, timings, "timings_path", None)
+		timings.setup_timings("update", bench_path=bench_path)
+
+		def migrate(site, output):
+			with timings.Timing("migrate", kind="site", site=site) as timing:
+				timing.exit_code = int(site == "b.local")
+
+		with timings.Timing("update", kind="command"):
+			with timings.Timing("patch_sites"):
+				run_in_parallel(migrate, ["a.local", "b.local"], workers=2, stop_on_failure=False)
+
+		records = {r.get("site", r["name"]): r for r in timings.get_timings(bench_path)}
+		self.assertEqual(records["a.local"]["parent"], records["patch_sites"]["id"])
+		self.assertEqual(records["a.local"]["depth"], 2)
+		self.assertEqual(records["a.local"]["status"], "ok")
+		self.assertEqual(records["b.local"]["status"], "failed")
+		self.assertEqual(records["update"]["run"], records["b.local"]["run"])
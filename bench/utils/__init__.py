@@ -41,6 +41,11 @@ def is_bench_directory(directory=os.path.curdir):
 
 
 def is_frappe_app(directory: str) -> bool:
+	# apps usually keep these in the module named after the app folder
+	module_path = os.path.join(directory, os.path.basename(directory))
+	if all(os.path.isfile(os.path.join(module_path, path)) for path in paths_in_app):
+		return True
+
 	is_frappe_app = True
 
 	for folder in paths_in_app:
@@ -52,6 +57,54 @@ def is_frappe_app(directory: str) -> bool:
 
 	return bool(is_frappe_app)
 
+
+def get_frappe_apps(apps_path: str, index_path: str) -> List[str]:
+	"""Returns names of frappe apps in apps_path, in directory order. Results are kept in
+	the index at index_path and only re-checked for apps whose folder or module folder
+	changed since, or for all apps if apps_path itself changed."""
+
+	def get_mtime(path):
+		try:
+			return os.stat(path).st_mtime
+		except (FileNotFoundError, NotADirectoryError):
+			return None
+
+	try:
+		with open(index_path) as f:
+			index = json.load(f)
+	except (FileNotFoundError, ValueError):
+		index = {}
+
+	apps_mtime = os.stat(apps_path).st_mtime
+	if index.get("apps_mtime") == apps_mtime:
+		names = index.get("names", [])
+	else:
+		names = os.listdir(apps_path)
+
+	cached = index.get("apps", {})
+	apps = {}
+	for name in names:
+		app_path = os.path.join(apps_path, name)
+		key = [get_mtime(app_path), get_mtime(os.path.join(app_path, name))]
+		if cached.get(name, {}).get("key") == key:
+			apps[name] = cached[name]
+		else:
+			apps[name] = {"key": key, "is_frappe_app": is_frappe_app(app_path)}
+
+	updated_index = {"apps_mtime": apps_mtime, "names": names, "apps": apps}
+	if updated_index != index and os.path.isdir(os.path.dirname(index_path)):
+		tmp_path = f"{index_path}.{os.getpid()}.tmp"
+		try:
+			with open(tmp_path, "w") as f:
+				json.dump(updated_index, f)
+			os.replace(tmp_path, index_path)
+		except OSError:
+			# index is an optimization, a read-only bench still works without it
+			pass
+
+	return [name for name in names if apps[name]["is_frappe_app"]]
+
+
 def get_bench_cache_path(sub_dir: Optional[str]) -> Path:
 	relative_path = "~/.cache/bench"
 	if sub_dir and not sub_dir.startswith("/"):
@@ -152,17 +205,39 @@ def pause_exec(seconds=10):
 	print(" " * 40, end="\r")
 
 
-def exec_cmd(cmd, cwd=".", env=None, _raise=True):
+def exec_cmd(cmd, cwd=".", env=None, _raise=True, output=None):
+	"""Runs `cmd` streaming its output to the terminal. If a list is passed as `output`,
+	the combined stdout & stderr of the command is appended to it instead."""
+	from bench.utils.resources import run_process
+
 	if env:
 		env.update(os.environ.copy())
 
-	click.secho(f"$ {cmd}", fg="bright_black")
+	if output is None:
+		click.secho(f"$ {cmd}", fg="bright_black")
+	else:
+		output.append(click.style(f"$ {cmd}", fg="bright_black") + "\n")
 
 	cwd_info = f"cd {cwd} && " if cwd != "." else ""
 	cmd_log = f"{cwd_info}{cmd}"
 	logger.debug(cmd_log)
 	spl_cmd = split(cmd)
-	return_code = subprocess.call(spl_cmd, cwd=cwd, universal_newlines=True, env=env)
+	if output is None:
+		return_code, _ = run_process(spl_cmd, cwd=cwd, universal_newlines=True, env=env)
+	else:
+		return_code, stdout = run_process(
+			spl_cmd,
+			cwd=cwd,
+			env=env,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.STDOUT,
+			universal_newlines=True,
+		)
+		output.append(stdout)
+	if spl_cmd[0] == "git":
+		from bench.utils.git import invalidate_git_state
+
+		invalidate_git_state(cwd)
 	if return_code:
 		logger.warning(f"{cmd_log} executed with exit code {return_code}")
 		if _raise:
@@ -170,6 +245,89 @@ def exec_cmd(cmd, cwd=".", env=None, _raise=True):
 	return return_code
 
 
+def echo(message, output=None):
+	"""Prints message, or appends it to `output` if a list is passed, see `exec_cmd`"""
+	if output is None:
+		click.echo(message)
+	else:
+		output.append(f"{message}\n")
+
+
+def run_in_parallel(fn, items, workers=1, stop_on_failure=True, output=None) -> dict:
+	"""Calls `fn(item, output)` for each of the items on a pool of at most `workers` threads
+	and returns a dict of item to return value.
+
+	With more than one worker, `output` is a list the call can collect its output into,
+	which is printed in one piece once the item is done so that output of concurrent
+	items doesn't interleave. With a single worker, items run in order and `output` is
+	None, so output streams as usual.
+
+	If stop_on_failure is set, items that haven't started yet are skipped after the first
+	exception, which is re-raised once the running items are done. Threads can't be
+	interrupted, so items already running when another fails run to completion and keep
+	their side effects, e.g. an app pulled while another app's pull failed. Otherwise
+	exceptions are returned in place of results.
+
+	If a list is passed as `output`, output of the items is appended to it instead of
+	being printed.
+	"""
+	from concurrent.futures import ThreadPoolExecutor
+	from threading import Event, Lock
+
+	from bench.utils.timings import get_timing_context, set_timing_context
+
+	items = list(items)
+	workers = max(1, min(workers or 1, len(items)))
+	results = {}
+
+	if workers == 1:
+		for item in items:
+			try:
+				results[item] = fn(item, output)
+			except Exception as e:
+				if stop_on_failure:
+					raise
+				results[item] = e
+		return results
+
+	failed = Event()
+	print_lock = Lock()
+	errors = []
+	timing_context = get_timing_context()
+
+	def run(item):
+		if failed.is_set():
+			return
+
+		set_timing_context(timing_context)
+		item_output = []
+		try:
+			results[item] = fn(item, item_output)
+		except Exception as e:
+			results[item] = e
+			if stop_on_failure:
+				errors.append(e)
+				failed.set()
+		except BaseException:
+			# e.g. SystemExit, skip the remaining items and let it propagate
+			failed.set()
+			raise
+		finally:
+			with print_lock:
+				if output is None:
+					click.echo("".join(item_output), nl=False)
+				else:
+					output.extend(item_output)
+
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		list(executor.map(run, items))
+
+	if errors:
+		raise errors[0]
+
+	return results
+
+
 def which(executable: str, raise_err: bool = False) -> str:
 	from shutil import which
 
@@ -243,6 +401,7 @@ def is_root():
 def run_frappe_cmd(*args, **kwargs):
 	from bench.cli import from_command_line
 	from bench.utils.bench import get_env_cmd
+	from bench.utils.resources import start_process, wait_process
 
 	bench_path = kwargs.get("bench_path", ".")
 	f = get_env_cmd("python", bench_path=bench_path)
@@ -252,48 +411,36 @@ def run_frappe_cmd(*args, **kwargs):
 	if is_async:
 		stderr = stdout = subprocess.PIPE
 	else:
+		from bench.utils.helper_daemon import run_in_daemon
+
 		stderr = stdout = None
+		return_code = run_in_daemon(list(args), bench_path=bench_path)
+		if return_code is not None:
+			if return_code > 0:
+				sys.exit(return_code)
+			return
 
-	p = subprocess.Popen(
+	p = start_process(
 		(f, "-m", "frappe.utils.bench_helper", "frappe") + args,
 		cwd=sites_dir,
 		stdout=stdout,
 		stderr=stderr,
 	)
 
-	return_code = print_output(p) if is_async else p.wait()
+	return_code = print_output(p) if is_async else wait_process(p)
 	if return_code > 0:
 		sys.exit(return_code)
 
 
-def print_output(p):
-	from select import select
+def print_output(p, **kwargs):
+	"""Relays the piped output of `p` as it runs and returns its exit code, kwargs are
+	passed to `bench.utils.relay.OutputRelay`"""
+	from bench.utils.relay import OutputRelay
+	from bench.utils.resources import wait_process
 
-	while p.poll() is None:
-		readx = select([p.stdout.fileno(), p.stderr.fileno()], [], [])[0]
-		send_buffer = []
-		for fd in readx:
-			if fd == p.stdout.fileno():
-				while 1:
-					buf = p.stdout.read(1)
-					if not len(buf):
-						break
-					if buf == "\r" or buf == "\n":
-						send_buffer.append(buf)
-						log_line("".join(send_buffer), "stdout")
-						send_buffer = []
-					else:
-						send_buffer.append(buf)
-
-			if fd == p.stderr.fileno():
-				log_line(p.stderr.readline(), "stderr")
-	return p.poll()
-
-
-def log_line(data, stream):
-	if stream == "stderr":
-		return sys.stderr.write(data)
-	return sys.stdout.write(data)
+	with OutputRelay(**kwargs) as relay:
+		relay.relay_process(p)
+	return wait_process(p)
 
 
 def get_bench_name(bench_path):
@@ -397,24 +544,80 @@ def find_parent_bench(path: str) -> str:
 def get_env_frappe_commands(bench_path=".") -> List:
 	"""Caches all available commands (even custom apps) via Frappe
 	Default caching behaviour: generated the first time any command (for a specific bench directory)
+	and again only once any app changes, see `get_cached_frappe_output`
 	"""
 	from bench.utils.bench import get_env_cmd
 
-	python = get_env_cmd("python", bench_path=bench_path)
-	sites_path = os.path.join(bench_path, "sites")
+	def generate():
+		python = get_env_cmd("python", bench_path=bench_path)
+		sites_path = os.path.join(bench_path, "sites")
 
-	try:
-		return json.loads(
-			get_cmd_output(
-				f"{python} -m frappe.utils.bench_helper get-frappe-commands", cwd=sites_path
+		try:
+			return json.loads(
+				get_cmd_output(
+					f"{python} -m frappe.utils.bench_helper get-frappe-commands", cwd=sites_path
+				)
 			)
-		)
 
-	except subprocess.CalledProcessError as e:
-		if hasattr(e, "stderr"):
-			print(e.stderr)
+		except subprocess.CalledProcessError as e:
+			if hasattr(e, "stderr"):
+				print(e.stderr)
+
+		return []
+
+	return get_cached_frappe_output("frappe_commands", generate, bench_path=bench_path)
+
+
+def get_cached_frappe_output(name: str, generate, bench_path="."):
+	"""Returns output of frappe's bench_helper cached under sites/.bench_cache, calling
+	`generate` to get it if there's none or any installed app changed since. Empty output
+	isn't cached, as that's what failures return."""
+	from hashlib import sha256
+
+	cache_path = os.path.join(bench_path, "sites", ".bench_cache", f"{name}.json")
+	key = sha256(json.dumps(get_frappe_apps_state(bench_path)).encode()).hexdigest()
 
-	return []
+	try:
+		with open(cache_path) as f:
+			cached = json.load(f)
+		if cached.get("key") == key:
+			return cached["value"]
+	except (FileNotFoundError, ValueError, KeyError):
+		pass
+
+	value = generate()
+	if value:
+		try:
+			os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+			tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+			with open(tmp_path, "w") as f:
+				json.dump({"key": key, "value": value}, f)
+			os.replace(tmp_path, cache_path)
+		except OSError:
+			pass
+
+	return value
+
+
+def get_frappe_apps_state(bench_path=".") -> List:
+	"""Commit & mtime of the commands module of each installed app. Frappe's commands
+	and help text only change with these."""
+	from bench.bench import Bench
+	from bench.utils.git import get_git_state
+
+	state = []
+	for app in Bench(bench_path).apps:
+		app_path = os.path.join(bench_path, "apps", app)
+		git_state = get_git_state(app_path)
+		commands_mtimes = []
+		for path in ("commands", "commands.py", os.path.join("commands", "__init__.py")):
+			try:
+				commands_mtimes.append(os.stat(os.path.join(app_path, app, path)).st_mtime)
+			except OSError:
+				commands_mtimes.append(None)
+		state.append([app, git_state.head if git_state else None, commands_mtimes])
+
+	return state
 
 
 def find_org(org_repo, using_cached: bool=False):
@@ -35,9 +35,9 @@ def is_version_upgrade(app="frappe", bench_path=".", branch=None):
 
 
 def switch_branch(branch, apps=None, bench_path=".", upgrade=False, check_upgrade=True):
-	import git
 	from bench.bench import Bench
 	from bench.utils import log, exec_cmd
+	from bench.utils.git import get_git_state
 	from bench.utils.bench import (
 		build_assets,
 		patch_sites,
@@ -61,8 +61,7 @@ def switch_branch(branch, apps=None, bench_path=".", upgrade=False, check_upgrad
 			log(f"{app} does not exist!", level=2)
 			continue
 
-		repo = git.Repo(app_dir)
-		unshallow_flag = os.path.exists(os.path.join(app_dir, ".git", "shallow"))
+		unshallow_flag = get_git_state(app_dir).is_shallow
 		log(f"Fetching upstream {'unshallow ' if unshallow_flag else ''}for {app}")
 
 		exec_cmd("git remote set-branches upstream  '*'", cwd=app_dir)
@@ -84,7 +83,7 @@ def switch_branch(branch, apps=None, bench_path=".", upgrade=False, check_upgrad
 		print("Switching for " + app)
 		exec_cmd(f"git checkout -f {branch}", cwd=app_dir)
 
-		if str(repo.active_branch) == branch:
+		if get_git_state(app_dir).branch == branch:
 			switched_apps.append(app)
 		else:
 			log(f"Switching branches failed for: {app}", level=2)
@@ -134,6 +133,8 @@ def get_develop_version(app, bench_path="."):
 
 
 def get_upstream_version(app, branch=None, bench_path="."):
+	from bench.utils.git import invalidate_git_state
+
 	repo_dir = get_repo_dir(app, bench_path=bench_path)
 	if not branch:
 		branch = get_current_branch(app, bench_path=bench_path)
@@ -144,6 +145,8 @@ def get_upstream_version(app, branch=None, bench_path="."):
 		)
 	except CommandFailedError:
 		raise InvalidRemoteException(f"Failed to fetch from remote named upstream for {app}")
+	finally:
+		invalidate_git_state(repo_dir)
 
 	try:
 		contents = subprocess.check_output(
@@ -169,10 +172,13 @@ def get_current_frappe_version(bench_path="."):
 
 
 def get_current_branch(app, bench_path="."):
-	from bench.utils import get_cmd_output
+	"""Full name of the branch checked out in app, e.g. `feature/x`, not only its last
+	component. None if HEAD is detached or app isn't a git repository."""
+	from bench.utils.git import get_git_state
 
 	repo_dir = get_repo_dir(app, bench_path=bench_path)
-	return get_cmd_output("basename $(git symbolic-ref -q HEAD)", cwd=repo_dir)
+	state = get_git_state(repo_dir)
+	return state.branch if state else None
 
 
 @lru_cache(maxsize=5)
@@ -207,19 +213,12 @@ def required_apps_from_hooks(required_deps: str, local: bool = False) -> List:
 
 
 def get_remote(app, bench_path="."):
+	from bench.utils.git import get_git_state
+
 	repo_dir = get_repo_dir(app, bench_path=bench_path)
-	contents = subprocess.check_output(
-		["git", "remote", "-v"], cwd=repo_dir, stderr=subprocess.STDOUT
-	)
-	contents = contents.decode("utf-8")
-	if re.findall(r"upstream[\s]+", contents):
-		return "upstream"
-	elif not contents:
-		# if contents is an empty string => remote doesn't exist
-		return False
-	else:
-		# get the first remote
-		return contents.splitlines()[0].split()[0]
+	state = get_git_state(repo_dir)
+	# False if remote doesn't exist, else upstream or the first remote
+	return state.get_remote() if state else False
 
 
 def get_app_name(bench_path: str, folder_name: str) -> str:
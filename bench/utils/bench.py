@@ -3,14 +3,17 @@ import contextlib
 import json
 import logging
 import os
+import queue
 import re
 import shutil
 import subprocess
 import sys
+import typing
 from functools import lru_cache
 from glob import glob
 from json.decoder import JSONDecodeError
 from pathlib import Path
+from typing import List, Optional
 
 # imports - third party imports
 import click
@@ -18,30 +21,38 @@ import click
 # imports - module imports
 import bench
 from bench.exceptions import PatchError, ValidationError
+from bench.utils.timings import Timing
 from bench.utils import (
+	echo,
 	exec_cmd,
 	get_bench_cache_path,
 	get_bench_name,
 	get_cmd_output,
 	log,
+	run_in_parallel,
 	which,
 )
 
 logger = logging.getLogger(bench.PROJECT_NAME)
+YARN_STAMP_FILE = ".bench-yarn-stamp"
+BUILD_MANIFEST_FILE = "bench_build_manifest.json"
+
+if typing.TYPE_CHECKING:
+	from bench.bench import Bench
 
 
 @lru_cache(maxsize=None)
 def get_env_cmd(cmd: str, bench_path: str = ".") -> str:
-	exact_location = os.path.abspath(
-		os.path.join(bench_path, "env", "bin", cmd.strip("*"))
-	)
+	from bench.utils.release import get_runtime_path
+
+	# benches running releases use the env of the current release
+	env_path = os.path.join(get_runtime_path(bench_path), "env")
+	exact_location = os.path.join(env_path, "bin", cmd.strip("*"))
 	if os.path.exists(exact_location):
 		return exact_location
 
 	# this supports envs' generated by patched virtualenv or venv (which may cause an extra 'local' folder to be created)
-	existing_python_bins = glob(
-		os.path.join(bench_path, "env", "**", "bin", cmd), recursive=True
-	)
+	existing_python_bins = glob(os.path.join(env_path, "**", "bin", cmd), recursive=True)
 
 	if existing_python_bins:
 		return os.path.abspath(existing_python_bins[0])
@@ -60,8 +71,10 @@ def get_venv_path(verbose=False, python="python3"):
 		log("venv cannot be found", level=2)
 
 
-def update_node_packages(bench_path=".", apps=None, verbose=None):
-	print("Updating node packages...")
+def update_node_packages(bench_path=".", apps=None, verbose=None, output=None, jobs=None):
+	"""Installs node dependencies of apps. Returns time taken per app, if known.
+	Output is collected in `output` if a list is passed, see `exec_cmd`."""
+	echo("Updating node packages...", output)
 	from distutils.version import LooseVersion
 
 	from bench.utils.app import get_develop_version
@@ -71,12 +84,15 @@ def update_node_packages(bench_path=".", apps=None, verbose=None):
 	# After rollup was merged, frappe_version = 10.1
 	# if develop_verion is 11 and up, only then install yarn
 	if v < LooseVersion("11.x.x-develop"):
-		update_npm_packages(bench_path, apps=apps, verbose=verbose)
+		update_npm_packages(bench_path, apps=apps, verbose=verbose, output=output)
+		return {}
 	else:
-		update_yarn_packages(bench_path, apps=apps, verbose=verbose)
+		return update_yarn_packages(
+			bench_path, apps=apps, verbose=verbose, output=output, jobs=jobs
+		)
 
 
-def install_python_dev_dependencies(bench_path=".", apps=None, verbose=False):
+def install_python_dev_dependencies(bench_path=".", apps=None, verbose=False, output=None):
 	import bench.cli
 	from bench.bench import Bench
 
@@ -99,11 +115,15 @@ def install_python_dev_dependencies(bench_path=".", apps=None, verbose=False):
 		if os.path.exists(pyproject_path):
 			pyproject_deps = _generate_dev_deps_pattern(pyproject_path)
 			if pyproject_deps:
-				bench.run(f"{bench.python} -m pip install {quiet_flag} --upgrade {pyproject_deps}")
+				bench.run(
+					f"{bench.python} -m pip install {quiet_flag} --upgrade {pyproject_deps}",
+					output=output,
+				)
 
 		if not pyproject_deps and os.path.exists(dev_requirements_path):
 			bench.run(
-				f"{bench.python} -m pip install {quiet_flag} --upgrade -r {dev_requirements_path}"
+				f"{bench.python} -m pip install {quiet_flag} --upgrade -r {dev_requirements_path}",
+				output=output,
 			)
 
 
@@ -123,7 +143,17 @@ def _generate_dev_deps_pattern(pyproject_path):
 	return requirements_pattern
 
 
-def update_yarn_packages(bench_path=".", apps=None, verbose=None):
+def update_yarn_packages(bench_path=".", apps=None, verbose=None, output=None, jobs=None):
+	"""Runs yarn install for apps on `jobs` parallel workers, which defaults to the
+	`node_install_concurrency` set in common_site_config.json, else one app at a time.
+
+	Installs use a yarn cache under ~/.cache/bench/yarn, each parallel worker its own one
+	as yarn v1 can't share a cache between running installs without serialising them.
+	Apps whose package.json & yarn.lock haven't changed since their last install are
+	skipped. Returns time taken per installed app.
+	"""
+	import time
+
 	import bench.cli as bench_cli
 	from bench.bench import Bench
 
@@ -131,24 +161,103 @@ def update_yarn_packages(bench_path=".", apps=None, verbose=None):
 	bench = Bench(bench_path)
 	apps = apps or bench.apps
 	apps_dir = os.path.join(bench.name, "apps")
+	jobs = jobs or bench.conf.get("node_install_concurrency") or 1
+	timings = {}
 
 	# TODO: Check for stuff like this early on only??
 	if not which("yarn"):
-		print("Please install yarn using below command and try again.")
-		print("`npm install -g yarn`")
-		return
+		echo("Please install yarn using below command and try again.", output)
+		echo("`npm install -g yarn`", output)
+		return timings
+
+	yarn_caches = get_yarn_caches(jobs)
+
+	def install(app, output):
+		start = time.monotonic()
+		with use_yarn_cache(yarn_caches) as yarn_cache:
+			if install_yarn_dependencies(
+				bench, app, verbose=verbose, output=output, yarn_cache=yarn_cache
+			):
+				timings[app] = time.monotonic() - start
+
+	node_apps = [
+		app for app in apps if os.path.exists(os.path.join(apps_dir, app, "package.json"))
+	]
+	run_in_parallel(install, node_apps, workers=jobs, output=output)
+
+	return timings
+
+
+def install_yarn_dependencies(
+	bench, app, verbose=False, output=None, yarn_cache=None
+) -> bool:
+	"""Runs yarn install for app using `yarn_cache`, else the bench's yarn cache, unless its package.json &
+	yarn.lock are unchanged since the last install and its node_modules is complete.
+	Returns False if it was skipped."""
+	app_path = os.path.join(bench.name, "apps", app)
+	stamp = get_yarn_stamp(app_path)
+	stamp_path = os.path.join(app_path, "node_modules", YARN_STAMP_FILE)
+
+	# yarn writes .yarn-integrity last, it's missing if node_modules was partly removed
+	integrity_path = os.path.join(app_path, "node_modules", ".yarn-integrity")
+	if os.path.exists(stamp_path) and os.path.exists(integrity_path):
+		with open(stamp_path) as f:
+			if f.read() == stamp:
+				echo(f"Node dependencies for {app} are up to date", output)
+				return False
+
+	yarn_cache = yarn_cache or get_bench_cache_path("yarn")
+	yarn_install = f"yarn install --check-files --prefer-offline --cache-folder {yarn_cache}"
+	if verbose:
+		yarn_install += " --verbose"
+
+	echo(click.style(f"\nInstalling node dependencies for {app}", fg="yellow"), output)
+	with Timing("yarn_install", app=app):
+		bench.run(yarn_install, cwd=app_path, output=output)
+
+	os.makedirs(os.path.dirname(stamp_path), exist_ok=True)
+	with open(stamp_path, "w") as f:
+		f.write(stamp)
+
+	return True
+
+
+def get_yarn_caches(jobs: int) -> queue.Queue:
+	"""Yarn cache folders for `jobs` installs running in parallel, one each. Yarn v1 isn't
+	safe with installs sharing a cache, and its --mutex would serialise them."""
+	yarn_caches = queue.Queue()
+	for i in range(jobs):
+		yarn_caches.put(get_bench_cache_path("yarn" if i == 0 else f"yarn-{i}"))
+	return yarn_caches
+
+
+@contextlib.contextmanager
+def use_yarn_cache(yarn_caches: queue.Queue):
+	"""Takes a yarn cache folder from `yarn_caches` for the block"""
+	yarn_cache = yarn_caches.get()
+	try:
+		yield yarn_cache
+	finally:
+		yarn_caches.put(yarn_cache)
 
-	for app in apps:
-		app_path = os.path.join(apps_dir, app)
-		if os.path.exists(os.path.join(app_path, "package.json")):
-			click.secho(f"\nInstalling node dependencies for {app}", fg="yellow")
-			yarn_install = "yarn install --check-files"
-			if verbose:
-				yarn_install += " --verbose"
-			bench.run(yarn_install, cwd=app_path)
 
+def get_yarn_stamp(app_path):
+	"""Hash of the app's package.json & yarn.lock, stored in node_modules after an install"""
+	from hashlib import sha256
+
+	stamp = sha256()
+	for filename in ("package.json", "yarn.lock"):
+		try:
+			with open(os.path.join(app_path, filename), "rb") as f:
+				stamp.update(f.read())
+		except FileNotFoundError:
+			pass
+		stamp.update(b"\0")
+
+	return stamp.hexdigest()
 
-def update_npm_packages(bench_path=".", apps=None, verbose=None):
+
+def update_npm_packages(bench_path=".", apps=None, verbose=None, output=None):
 	verbose = bench.cli.verbose or verbose
 	npm_install = "npm install --verbose" if verbose else "npm install"
 	apps_dir = os.path.join(bench_path, "apps")
@@ -182,7 +291,7 @@ def update_npm_packages(bench_path=".", apps=None, verbose=None):
 	with open(os.path.join(bench_path, "package.json"), "w") as f:
 		f.write(json.dumps(package_json, indent=1, sort_keys=True))
 
-	exec_cmd(npm_install, cwd=bench_path)
+	exec_cmd(npm_install, cwd=bench_path, output=output)
 
 
 def migrate_env(python, backup=False):
@@ -283,17 +392,17 @@ def post_upgrade(from_ver, to_ver, bench_path="."):
 		)
 
 
-def patch_sites(bench_path="."):
+def patch_sites(bench_path=".", concurrency=None):
 	from bench.bench import Bench
-	from bench.utils.system import migrate_site
+	from bench.utils.system import run_on_sites
 
 	bench = Bench(bench_path)
-
-	for site in bench.sites:
-		try:
-			migrate_site(site, bench_path=bench_path)
-		except subprocess.CalledProcessError:
-			raise PatchError
+	with Timing("patch_sites"):
+		results = run_on_sites(
+			"migrate", bench.sites, bench_path=bench_path, concurrency=concurrency
+		)
+		if any(results.values()):
+			raise PatchError("Migrate failed for some sites")
 
 
 def restart_supervisor_processes(bench_path=".", web_workers=False, _raise=False):
@@ -378,6 +487,78 @@ def build_assets(bench_path=".", app=None, using_cached=False):
 		env["USING_CACHED"] = "1"
 
 	exec_cmd(command, cwd=bench_path, env=env)
+	update_build_manifest(bench_path, [app] if app else None)
+
+
+def get_build_hash(bench_path, app) -> Optional[str]:
+	"""Hash of the git trees of the app's frontend sources & lockfiles at HEAD. None if it
+	can't be determined, i.e. the app isn't a git repository or those paths have
+	uncommitted changes."""
+	from hashlib import sha256
+
+	app_path = os.path.join(bench_path, "apps", app)
+	module = os.path.basename(os.path.realpath(app_path))
+	paths = [f"{module}/public", f"{module}/esbuild", "frontend", "package.json", "yarn.lock"]
+
+	def git(*args):
+		return subprocess.run(
+			["git", *args, "--", *paths],
+			cwd=app_path,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.DEVNULL,
+			universal_newlines=True,
+		)
+
+	tree = git("ls-tree", "HEAD")
+	if tree.returncode or git("status", "--porcelain").stdout.strip():
+		return None
+
+	return sha256(tree.stdout.encode()).hexdigest()
+
+
+def get_build_manifest(bench_path) -> dict:
+	try:
+		with open(os.path.join(bench_path, "sites", "assets", BUILD_MANIFEST_FILE)) as f:
+			return json.load(f)
+	except (FileNotFoundError, JSONDecodeError):
+		return {}
+
+
+def update_build_manifest(bench_path, apps=None):
+	"""Records build hashes of apps, or of all apps after a full build"""
+	from bench.bench import Bench
+
+	assets_path = os.path.join(bench_path, "sites", "assets")
+	if not os.path.isdir(assets_path):
+		return
+
+	manifest = get_build_manifest(bench_path) if apps else {}
+	for app in apps or Bench(bench_path).apps:
+		manifest[app] = get_build_hash(bench_path, app)
+
+	with open(os.path.join(assets_path, BUILD_MANIFEST_FILE), "w") as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def get_unchanged_apps(bench_path, apps) -> List[str]:
+	"""Returns apps whose frontend sources are unchanged since they were last built, as
+	recorded in sites/assets/bench_build_manifest.json. Nothing is unchanged if frappe
+	changed, as it ships the build tooling and sources the other apps' assets use."""
+	manifest = get_build_manifest(bench_path)
+	unchanged = []
+
+	for app in apps:
+		build_hash = get_build_hash(bench_path, app)
+		if (
+			build_hash
+			and manifest.get(app) == build_hash
+			and os.path.exists(os.path.join(bench_path, "sites", "assets", app))
+		):
+			unchanged.append(app)
+		elif app == "frappe":
+			return []
+
+	return unchanged
 
 
 def handle_version_upgrade(version_upgrade, bench_path, force, reset, conf):
@@ -426,16 +607,35 @@ def update(
 	reset: bool = False,
 	restart_supervisor: bool = False,
 	restart_systemd: bool = False,
+	jobs: int = None,
+	site_concurrency: int = None,
+	pipeline: bool = False,
+	minimal_downtime: bool = False,
 ):
-	"""command: bench update"""
+	"""command: bench update
+
+	With minimal_downtime, sites are backed up, apps are fetched & staged with their
+	dependencies prebuilt (see `stage_app`) and their assets are built (see
+	`stage_assets`) before maintenance mode is enabled, so that sites are down only while
+	the staged changes are applied, sites are migrated and processes are reloaded.
+	"""
 	import re
+	import time
 
 	from bench import patches
-	from bench.app import pull_apps
+	from bench.app import (
+		apply_staged_apps,
+		apply_staged_assets,
+		pull_apps,
+		remove_staging,
+		stage_apps,
+		stage_assets,
+	)
 	from bench.bench import Bench
 	from bench.config.common_site_config import update_config
-	from bench.exceptions import CannotUpdateReleaseBench
+	from bench.exceptions import CannotUpdateReleaseBench, CommandFailedError
 	from bench.utils.app import is_version_upgrade
+	from bench.utils.release import get_current_release
 	from bench.utils.system import backup_all_sites
 
 	bench_path = os.path.abspath(".")
@@ -449,6 +649,12 @@ def update(
 	if not (pull or patch or build or requirements):
 		pull, patch, build, requirements = True, True, True, True
 
+	if get_current_release(bench_path) and (patch or build or requirements):
+		raise CannotUpdateReleaseBench(
+			"This bench runs releases, update apps with `bench update --pull` and switch to"
+			" them with `bench release prepare` and `bench release activate`"
+		)
+
 	if apps and pull:
 		apps = [app.strip() for app in re.split(",| ", apps) if app]
 	else:
@@ -459,44 +665,345 @@ def update(
 	version_upgrade = is_version_upgrade()
 	handle_version_upgrade(version_upgrade, bench_path, force, reset, conf)
 
-	conf.update({"maintenance_mode": 1, "pause_scheduler": 1})
-	update_config(conf, bench_path=bench_path)
+	staged = staged_assets = None
+	staging_path = os.path.join(bench_path, ".staging")
+	find_links = os.environ.get("PIP_FIND_LINKS")
+
+	try:
+		if minimal_downtime:
+			if backup:
+				print("Backing up sites...")
+				backup_all_sites(bench_path=bench_path, concurrency=site_concurrency)
+				backup = False
+
+			if pull:
+				print("Staging apps source...")
+				remove_staging(staging_path, bench_path=bench_path)
+				staged = stage_apps(
+					staging_path,
+					apps=apps,
+					bench_path=bench_path,
+					reset=reset,
+					requirements=requirements,
+					build=build,
+					jobs=jobs,
+				)
+				# pip picks up wheels prebuilt while staging
+				os.environ["PIP_FIND_LINKS"] = os.path.abspath(os.path.join(staging_path, "wheels"))
+
+				if build:
+					print("Building staged assets...")
+					try:
+						staged_assets = stage_assets(staged, staging_path, bench_path=bench_path)
+					except CommandFailedError:
+						logger.exception("building staged assets failed")
+						click.secho(
+							"Building staged assets failed, they'll be built during maintenance",
+							fg="yellow",
+						)
+
+		update_config({"maintenance_mode": 1, "pause_scheduler": 1}, bench_path=bench_path)
+		downtime_start = time.monotonic()
+
+		if pipeline:
+			run_update_pipeline(
+				bench,
+				apps=apps,
+				pull=pull,
+				patch=patch,
+				build=build,
+				requirements=requirements,
+				backup=backup,
+				reset=reset,
+				post_upgrade_versions=version_upgrade[1:]
+				if version_upgrade[0] or force
+				else None,
+				restart_supervisor=restart_supervisor,
+				restart_systemd=restart_systemd,
+				jobs=jobs,
+				site_concurrency=site_concurrency,
+				staged=staged,
+				staged_assets=staged_assets,
+				staging_path=staging_path,
+			)
+		else:
+			if backup:
+				print("Backing up sites...")
+				backup_all_sites(bench_path=bench_path, concurrency=site_concurrency)
+
+			if staged is not None:
+				print("Applying staged apps source...")
+				apply_staged_apps(staged, bench_path=bench_path, reset=reset, jobs=jobs)
+			elif pull:
+				print("Updating apps source...")
+				pull_apps(apps=apps, bench_path=bench_path, reset=reset, jobs=jobs)
+
+			if requirements:
+				print("Setting up requirements...")
+				bench.setup.requirements()
+
+			if staged_assets:
+				print("Applying staged assets...")
+				apply_staged_assets(staged_assets, staging_path, bench_path=bench_path)
+
+			if patch:
+				print("Patching sites...")
+				patch_sites(bench_path=bench_path, concurrency=site_concurrency)
+
+			if build:
+				print("Building assets...")
+				skipped = bench.build()
+				if skipped:
+					print(f"Skipped building assets of unchanged apps: {', '.join(skipped)}")
+
+			if version_upgrade[0] or (not version_upgrade[0] and force):
+				post_upgrade(version_upgrade[1], version_upgrade[2], bench_path=bench_path)
+
+			bench.reload(web=False, supervisor=restart_supervisor, systemd=restart_systemd)
+
+		update_config({"maintenance_mode": 0, "pause_scheduler": 0}, bench_path=bench_path)
+
+		if minimal_downtime:
+			downtime = time.monotonic() - downtime_start
+			logger.log(f"sites were in maintenance mode for {downtime:.1f}s")
+			click.secho(f"Sites were in maintenance mode for {downtime:.1f}s", fg="green")
+	finally:
+		if minimal_downtime:
+			if find_links is None:
+				os.environ.pop("PIP_FIND_LINKS", None)
+			else:
+				os.environ["PIP_FIND_LINKS"] = find_links
+			remove_staging(staging_path, bench_path=bench_path)
+
+	print(
+		"_" * 80 + "\nBench: Deployment tool for Frappe and Frappe Applications"
+		" (https://frappe.io/bench).\nOpen source depends on your contributions, so do"
+		" give back by submitting bug reports, patches and fixes and be a part of the"
+		" community :)"
+	)
+
+
+def run_update_pipeline(
+	bench: "Bench",
+	apps=None,
+	pull=True,
+	patch=True,
+	build=True,
+	requirements=True,
+	backup=True,
+	reset=False,
+	post_upgrade_versions=None,
+	restart_supervisor=False,
+	restart_systemd=False,
+	jobs=None,
+	site_concurrency=None,
+	staged=None,
+	staged_assets=None,
+	staging_path=None,
+):
+	"""Runs the stages of bench update as a graph of tasks per app and per site, so that
+	independent tasks overlap, e.g. an app's pip install while other apps are fetched or
+	site backups while apps are fetched.
+
+	Each app is fetched, then its python & node dependencies are installed and its assets
+	are built. Sites are backed up then migrated once all apps are fetched and installed.
+	Reload runs last. Tasks run on `jobs` workers, or `pipeline_concurrency` set in
+	common_site_config.json, else 4. Only one pip install and one build run at a time.
+
+	If `staged` commits of apps are passed, see `stage_apps`, they're applied instead of
+	pulling the apps, and `staged_assets` built under staging_path are swapped in before
+	any builds, see `stage_assets`.
+	"""
+	import bench.cli as bench_cli
+	from bench.app import (
+		App,
+		apply_staged_app,
+		apply_staged_assets,
+		exclude_apps_without_remote,
+		get_apps_to_pull,
+		pull_app,
+	)
+	from bench.exceptions import CommandFailedError
+	from bench.utils.pipeline import TaskGraph
+	from bench.utils.system import get_site_concurrency, run_site_command
+
+	bench_path = bench.name
+	conf = bench.conf
+	quiet_flag = "" if bench_cli.verbose else "--quiet"
+	rebase = "--rebase" if conf.get("rebase_on_pull") else ""
+	apps_path = os.path.join(bench_path, "apps")
+	sites_path = os.path.join(bench_path, "sites")
+
+	if staged is not None:
+		apps_to_pull = list(staged)
+	elif pull:
+		apps_to_pull = get_apps_to_pull(bench, apps, reset=reset, jobs=jobs or 1)
+	else:
+		apps_to_pull = []
+	pulled = {}
+	frappe_build = {}
+	node_concurrency = conf.get("node_install_concurrency") or 1
+	yarn_caches = get_yarn_caches(node_concurrency)
+
+	graph = TaskGraph(
+		workers=jobs or conf.get("pipeline_concurrency") or 4,
+		resources={
+			"pip": 1,
+			"build": 1,
+			"node": node_concurrency,
+			"site": get_site_concurrency(bench_path, site_concurrency),
+		},
+	)
+
+	def site_task(command, site):
+		def run(output):
+			if run_site_command(command, site, bench_path=bench_path):
+				raise CommandFailedError(
+					f"{command} failed for {site}, see logs/{command}/{site}.log"
+				)
+
+		return run
+
+	def fetch(app):
+		def run(output):
+			if staged and staged[app]:
+				apply_staged_app(
+					bench, app, staged[app], reset=reset, rebase=rebase, output=output
+				)
+			else:
+				pulled[app] = pull_app(bench, app, reset=reset, rebase=rebase, output=output)
+
+		return run
+
+	def install_python(app):
+		def run(output):
+			app_dir = os.path.join(apps_path, app)
+			app_obj = App(app_dir, bench=bench, to_clone=False)
+			app_obj.validate_app_dependencies()
+			bench.run(
+				f"{bench.python} -m pip install {quiet_flag} --upgrade -e {os.path.realpath(app_dir)}",
+				output=output,
+			)
+			if conf.get("developer_mode"):
+				install_python_dev_dependencies(apps=app, bench_path=bench_path, output=output)
+			bench.apps.sync(
+				app_name=app, required=app_obj.local_resolution, branch=app_obj.tag, app_dir=app_dir
+			)
+
+		return run
+
+	def install_node(app):
+		def run(output):
+			with use_yarn_cache(yarn_caches) as yarn_cache:
+				install_yarn_dependencies(bench, app, output=output, yarn_cache=yarn_cache)
+
+		return run
+
+	def build_app(app):
+		def run(output):
+			# other apps' assets need rebuilding if frappe changed, decide that before
+			# frappe's build is recorded in the build manifest
+			changed = not get_unchanged_apps(bench_path, [app])
+			if app == "frappe":
+				frappe_build["changed"] = changed
+			if not (changed or frappe_build.get("changed")):
+				echo(f"Skipped building assets of unchanged app {app}", output)
+				return
+			bench.run(
+				f"{bench.python} -m frappe.utils.bench_helper frappe build --app {app}",
+				cwd=sites_path,
+				output=output,
+			)
+			update_build_manifest(bench_path, [app])
+
+		return run
+
+	def added(*names):
+		# tasks only exist for the stages being run, e.g. fetch tasks for apps pulled
+		return [name for name in names if name in graph.tasks]
 
 	if backup:
-		print("Backing up sites...")
-		backup_all_sites(bench_path=bench_path)
+		for site in bench.sites:
+			graph.add(f"backup:{site}", site_task("backup", site), resource="site", site=site)
 
-	if pull:
-		print("Updating apps source...")
-		pull_apps(apps=apps, bench_path=bench_path, reset=reset)
+	for app in apps_to_pull:
+		graph.add(f"fetch:{app}", fetch(app), app=app)
 
 	if requirements:
-		print("Setting up requirements...")
-		bench.setup.requirements()
+		graph.add(
+			"pip",
+			lambda output: bench.run(
+				f"{bench.python} -m pip install {quiet_flag} --upgrade pip", output=output
+			),
+			resource="pip",
+		)
+		for app in bench.apps:
+			graph.add(
+				f"python:{app}",
+				install_python(app),
+				deps=added("pip", f"fetch:{app}"),
+				resource="pip",
+				app=app,
+			)
+			if os.path.exists(os.path.join(apps_path, app, "package.json")):
+				graph.add(
+					f"node:{app}",
+					install_node(app),
+					deps=added(f"fetch:{app}"),
+					resource="node",
+					app=app,
+				)
 
-	if patch:
-		print("Patching sites...")
-		patch_sites(bench_path=bench_path)
+	if build and staged_assets:
+		graph.add(
+			"assets",
+			lambda output: apply_staged_assets(staged_assets, staging_path, bench_path=bench_path),
+			deps=added(*(f"fetch:{app}" for app in staged_assets), "python:frappe"),
+			resource="build",
+		)
 
 	if build:
-		print("Building assets...")
-		bench.build()
-
-	if version_upgrade[0] or (not version_upgrade[0] and force):
-		post_upgrade(version_upgrade[1], version_upgrade[2], bench_path=bench_path)
+		for app in bench.apps:
+			deps = added(
+				*(f"{task}:{name}" for task in ("fetch", "python", "node") for name in {"frappe", app}),
+				"assets",
+			)
+			if app != "frappe":
+				deps += added("build:frappe")
+			graph.add(f"build:{app}", build_app(app), deps=deps, resource="build", app=app)
 
-	bench.reload(web=False, supervisor=restart_supervisor, systemd=restart_systemd)
+	if patch:
+		apps_ready = [f"{task}:{app}" for task in ("fetch", "python") for app in bench.apps]
+		for site in bench.sites:
+			graph.add(
+				f"migrate:{site}",
+				site_task("migrate", site),
+				deps=added(f"backup:{site}", *apps_ready),
+				resource="site",
+				site=site,
+			)
 
-	conf.update({"maintenance_mode": 0, "pause_scheduler": 0})
-	update_config(conf, bench_path=bench_path)
+	if post_upgrade_versions:
+		graph.add(
+			"post-upgrade",
+			lambda output: post_upgrade(*post_upgrade_versions, bench_path=bench_path),
+			deps=list(graph.tasks),
+		)
 
-	print(
-		"_" * 80 + "\nBench: Deployment tool for Frappe and Frappe Applications"
-		" (https://frappe.io/bench).\nOpen source depends on your contributions, so do"
-		" give back by submitting bug reports, patches and fixes and be a part of the"
-		" community :)"
+	graph.add(
+		"reload",
+		lambda output: bench.reload(
+			web=False, supervisor=restart_supervisor, systemd=restart_systemd
+		),
+		deps=list(graph.tasks),
 	)
 
+	try:
+		graph.run()
+	finally:
+		graph.print_report()
+		exclude_apps_without_remote(pulled, bench_path=bench_path)
+
 
 def clone_apps_from(bench_path, clone_from, update_app=True):
 	from bench.app import install_app
@@ -547,12 +1054,21 @@ def remove_backups_crontab(bench_path="."):
 
 	bench_dir = os.path.abspath(bench_path)
 	user = Bench(bench_dir).conf.get("frappe_user")
-	logfile = os.path.join(bench_dir, "logs", "backup.log")
 	system_crontab = CronTab(user=user)
-	backup_command = f"cd {bench_dir} && {sys.argv[0]} --verbose --site all backup"
-	job_command = f"{backup_command} >> {logfile} 2>&1"
 
-	system_crontab.remove_all(command=job_command)
+	for job_command in get_backup_job_commands(bench_dir):
+		system_crontab.remove_all(command=job_command)
+	system_crontab.write()
+
+
+def get_backup_job_commands(bench_dir: str) -> List[str]:
+	"""Commands of the backups cronjob, the current one first. Older benches backed up
+	all sites at once every 6 hours, which is now staggered over 6 hours."""
+	logfile = os.path.join(bench_dir, "logs", "backup.log")
+	return [
+		f"cd {bench_dir} && {sys.argv[0]} backup-all-sites --scheduled >> {logfile} 2>&1",
+		f"cd {bench_dir} && {sys.argv[0]} --verbose --site all backup >> {logfile} 2>&1",
+	]
 
 
 def set_mariadb_host(host, bench_path="."):
@@ -572,18 +1088,9 @@ def set_redis_socketio_host(host, bench_path="."):
 
 
 def update_common_site_config(ddict, bench_path="."):
-	filename = os.path.join(bench_path, "sites", "common_site_config.json")
-
-	if os.path.exists(filename):
-		with open(filename) as f:
-			content = json.load(f)
-
-	else:
-		content = {}
+	from bench.config.common_site_config import update_config
 
-	content.update(ddict)
-	with open(filename, "w") as f:
-		json.dump(content, f, indent=1, sort_keys=True)
+	update_config(ddict, bench_path=bench_path)
 
 
 def validate_app_installed_on_sites(app, bench_path="."):
@@ -660,9 +1167,11 @@ To switch to your required branch, run the following commands: bench switch-to-b
 			sys.exit(1)
 
 
-def cache_helper(clear=False, remove_app="", remove_key="") -> None:
+def cache_helper(clear=False, remove_app="", remove_key="", gc=False) -> None:
 	can_remove = bool(remove_key or remove_app)
-	if not clear and not can_remove:
+	if gc:
+		cache_gc()
+	elif not clear and not can_remove:
 		cache_list()
 	elif can_remove:
 		cache_remove(remove_app, remove_key)
@@ -675,23 +1184,43 @@ def cache_helper(clear=False, remove_app="", remove_key="") -> None:
 def cache_list() -> None:
 	from datetime import datetime
 
+	from bench.utils.cache import (
+		COMPRESSED_SUFFIXES,
+		get_cache_index,
+		get_cache_items,
+		get_last_access,
+		get_manifest_size,
+		read_manifest,
+	)
+
+	index = get_cache_index()
 	tot_size = 0
 	tot_items = 0
+	store_items = 0
 
 	printed_header = False
-	for item in get_bench_cache_path("apps").iterdir():
-		if item.suffix not in [".tar", ".tgz"]:
-			continue
-
+	for item in get_cache_items():
 		stat = item.stat()
-		size_mb = stat.st_size / 1_000_000
+		size = stat.st_size
 		created = datetime.fromtimestamp(stat.st_ctime)
-		accessed = datetime.fromtimestamp(stat.st_atime)
+		accessed = datetime.fromtimestamp(get_last_access(item, index))
+
+		if item.suffix == ".json":
+			# size of the app directory, files shared with other items are stored once
+			size = get_manifest_size(read_manifest(item) or {"entries": []})
+			store_items += 1
+		else:
+			tot_size += size
 
+		size_mb = size / 1_000_000
 		app = item.name.split("-")[0]
 		tot_items += 1
-		tot_size += stat.st_size
-		compressed = item.suffix == ".tgz"
+		compressed = item.suffix in COMPRESSED_SUFFIXES
+
+		# ratio of compressed to uncompressed size, and time taken to compress
+		stats = index.get(item.name, {})
+		ratio = f"{size / stats['raw_size']:.2f}" if stats.get("raw_size") else "-"
+		taken = f"{stats['compress_time']:.1f}s" if "compress_time" in stats else "-"
 
 		if not printed_header:
 			click.echo(
@@ -699,6 +1228,8 @@ def cache_list() -> None:
 				f"{'FILE':25}  "
 				f"{'SIZE':>13}  "
 				f"{'COMPRESSED'}  "
+				f"{'RATIO':>5}  "
+				f"{'TIME':>7}  "
 				f"{'CREATED':19}  "
 				f"{'ACCESSED':19}  "
 			)
@@ -709,27 +1240,65 @@ def cache_list() -> None:
 			f"{item.name:25}  "
 			f"{size_mb:10.3f} MB  "
 			f"{str(compressed):10}  "
+			f"{ratio:>5}  "
+			f"{taken:>7}  "
 			f"{created:%Y-%m-%d %H:%M:%S}  "
 			f"{accessed:%Y-%m-%d %H:%M:%S}  "
 		)
 
+	if store_items:
+		from bench.utils.cache import get_objects_size
+
+		tot_size += get_objects_size()
+
 	if tot_items:
 		click.echo(f"Total size {tot_size / 1_000_000:.3f} MB belonging to {tot_items} items")
 	else:
 		click.echo("No cached items")
 
 
+def cache_gc() -> None:
+	"""Prints items that eviction would remove as per ~/.cache/bench/config.json"""
+	from bench.utils.cache import get_cache_config, get_eviction_plan
+
+	config = get_cache_config()
+	if not (config.get("max_cache_size") or config.get("max_cache_age")):
+		click.echo(
+			"No eviction policy set. Set max_cache_size and/or max_cache_age (in days)"
+			f" in {get_bench_cache_path(None) / 'config.json'}"
+		)
+		return
+
+	plan = get_eviction_plan(config)
+	if not plan:
+		click.echo("Nothing to evict")
+		return
+
+	for item, size, reason in plan:
+		click.echo(f"Would remove {item.name:25}  {size / 1_000_000:10.3f} MB  ({reason})")
+
+	tot_size = sum(size for _, size, _ in plan)
+	click.echo(f"Would free {tot_size / 1_000_000:.3f} MB belonging to {len(plan)} items")
+
+
 def cache_remove(app: str = "", key: str = "") -> None:
+	from bench.utils.cache import cache_lock, prune_cache_index, prune_objects
+
 	rem_items = 0
 	rem_size = 0
-	for item in get_bench_cache_path("apps").iterdir():
-		if not should_remove_item(item, app, key):
-			continue
+	with cache_lock():
+		for item in get_bench_cache_path("apps").iterdir():
+			if not should_remove_item(item, app, key):
+				continue
 
-		rem_items += 1
-		rem_size += item.stat().st_size
-		item.unlink(True)
-		click.echo(f"Removed {item.name}")
+			rem_items += 1
+			rem_size += item.stat().st_size
+			item.unlink(True)
+			click.echo(f"Removed {item.name}")
+
+		if rem_items:
+			rem_size += prune_objects()[1]
+			prune_cache_index()
 
 	if rem_items:
 		click.echo(f"Cleared {rem_size / 1_000_000:.3f} MB belonging to {rem_items} items")
@@ -738,7 +1307,7 @@ def cache_remove(app: str = "", key: str = "") -> None:
 
 
 def should_remove_item(item: Path, app: str, key: str) -> bool:
-	if item.suffix not in [".tar", ".tgz"]:
+	if item.suffix not in [".json", ".tar", ".tgz", ".tzst"]:
 		return False
 
 	name = item.name
@@ -761,8 +1330,20 @@ def cache_clear() -> None:
 		click.echo("No cached items")
 		return
 
-	tot_size = get_dir_size(cache_path)
-	shutil.rmtree(cache_path)
+	from bench.utils.cache import (
+		cache_lock,
+		get_objects_path,
+		get_objects_size,
+		prune_cache_index,
+	)
+
+	with cache_lock():
+		tot_size = get_dir_size(cache_path)
+		shutil.rmtree(cache_path)
+
+		tot_size += get_objects_size()
+		shutil.rmtree(get_objects_path())
+		prune_cache_index()
 
 	if tot_items:
 		click.echo(f"Cleared {tot_size / 1_000_000:.3f} MB belonging to {tot_items} items")
@@ -0,0 +1,532 @@
+"""
+Content Addressed App Cache
+
+Files of cached app directories are stored once per content under
+~/.cache/bench/objects/<hash[:2]>/<hash[2:]>, shared by all cache keys and
+benches on the host. A JSON manifest per app & cache key under
+~/.cache/bench/apps lists the directory's entries and the objects they
+point to.
+
+Restoring an app materializes its entries as reflinks of the objects where
+the filesystem supports them, else as copies, with the modes recorded in the
+manifest. Hard links are opt-in through {"hardlink_objects": true} in
+~/.cache/bench/config.json, for hosts whose restored apps are never modified:
+hard linked files share the object's read-only mode, and are never used when
+running as root, which could write to them in place. An object whose size
+doesn't match the manifest is treated as a miss.
+
+Compressed caches are tar archives streamed through the fastest available
+compressor: zstd through the zstandard module or binary, else gzip through
+pigz or Python's gzip. Sizes, timings and last access times of caches are
+kept in ~/.cache/bench/index.json.
+
+Processes storing objects and writing their manifest hold the cache's store
+lock shared, pruning objects or evicting caches hold it exclusively so that
+objects of a manifest yet to be written aren't pruned, see cache_lock.
+
+If max_cache_size or max_cache_age (in days) are set in
+~/.cache/bench/config.json, least recently used caches are evicted after new
+ones are added, e.g. {"max_cache_size": "20GB", "max_cache_age": 30}
+"""
+
+# imports - standard imports
+import contextlib
+import gzip
+import json
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# imports - module imports
+from bench.exceptions import CommandFailedError
+from bench.utils import get_bench_cache_path, which
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+HASH_CHUNK_SIZE = 1024 * 1024
+EXCLUDED_NAMES = {"__pycache__"}
+EXCLUDED_SUFFIXES = (".egg-info", ".pyc")
+COMPRESSED_SUFFIXES = (".tzst", ".tgz")
+
+
+class CacheMiss(Exception):
+	pass
+
+
+@contextlib.contextmanager
+def cache_lock(name: str = "store", shared: bool = False):
+	"""Holds the flock `name` of the cache directory, "store" for objects & manifests and
+	"index" for index.json. Locks aren't re-entrant, "index" is taken within "store"."""
+	import fcntl
+
+	fd = os.open(get_bench_cache_path(None) / f".{name}.lock", os.O_RDONLY | os.O_CREAT, 0o644)
+	try:
+		fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+		yield
+	finally:
+		os.close(fd)
+
+
+def get_objects_path() -> Path:
+	return get_bench_cache_path("objects")
+
+
+def get_object_path(objects_path: Path, object_id: str) -> Path:
+	return objects_path / object_id[:2] / object_id[2:]
+
+
+def get_manifest_filename(app_name: str, cache_key: str) -> str:
+	return f"{app_name}-{cache_key[:10]}.json"
+
+
+def read_manifest(manifest_path: Path) -> Optional[dict]:
+	try:
+		with open(manifest_path) as f:
+			return json.load(f)
+	except (FileNotFoundError, ValueError):
+		return None
+
+
+def write_manifest(manifest_path: Path, manifest: dict) -> None:
+	tmp_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+	with open(tmp_path, "w") as f:
+		json.dump(manifest, f)
+	os.replace(tmp_path, manifest_path)
+
+
+def store_directory(path: Path, app_name: str, cache_key: str) -> dict:
+	"""Adds files of the directory at path to the object store and returns its manifest"""
+	objects_path = get_objects_path()
+	entries = []
+	files = []
+
+	for root, dirs, filenames in os.walk(path):
+		dirs[:] = [d for d in dirs if not is_excluded(d)]
+		rel_root = os.path.relpath(root, path)
+
+		for name in dirs + filenames:
+			if is_excluded(name):
+				continue
+			abs_path = os.path.join(root, name)
+			rel_path = os.path.normpath(os.path.join(rel_root, name))
+			st = os.lstat(abs_path)
+
+			if stat.S_ISLNK(st.st_mode):
+				entries.append([rel_path, "l", 0, os.readlink(abs_path), 0])
+			elif stat.S_ISDIR(st.st_mode):
+				entries.append([rel_path, "d", stat.S_IMODE(st.st_mode), None, 0])
+			elif stat.S_ISREG(st.st_mode):
+				entry = [rel_path, "f", stat.S_IMODE(st.st_mode), None, st.st_size]
+				entries.append(entry)
+				files.append((entry, abs_path))
+
+	def store(item):
+		entry, abs_path = item
+		entry[3] = store_file(objects_path, abs_path, entry[2])
+
+	# hashlib releases the GIL while hashing, so large trees hash on all cores
+	with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+		list(executor.map(store, files))
+
+	return {
+		"app": app_name,
+		"cache_key": cache_key,
+		"created": time.time(),
+		"entries": entries,
+	}
+
+
+def is_excluded(name: str) -> bool:
+	return name in EXCLUDED_NAMES or name.endswith(EXCLUDED_SUFFIXES)
+
+
+def store_file(objects_path: Path, path: str, mode: int) -> str:
+	"""Copies file at path into the object store, if it isn't there yet. Returns its id"""
+	digest = sha256()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+			digest.update(chunk)
+
+	# executable bit is part of the id as hard linked files share their mode
+	executable = bool(mode & stat.S_IXUSR)
+	object_id = digest.hexdigest() + ("x" if executable else "")
+	object_path = get_object_path(objects_path, object_id)
+
+	if not object_path.exists():
+		object_path.parent.mkdir(exist_ok=True)
+		fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=object_path.parent)
+		os.close(fd)
+		try:
+			clone_file(path, tmp_path)
+			os.chmod(tmp_path, 0o555 if executable else 0o444)
+			os.replace(tmp_path, object_path)
+		except (FileNotFoundError, FileExistsError):
+			# stored by another thread or process meanwhile
+			if not object_path.exists():
+				raise
+		finally:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(tmp_path)
+
+	return object_id
+
+
+def materialize(manifest: dict, dest: Path, hardlink: bool = False) -> None:
+	"""Creates the directory described by the manifest at dest, raises CacheMiss if any
+	of its objects are missing or damaged. Files are hard linked to their objects only
+	if hardlink is set, leaving them read-only."""
+	objects_path = get_objects_path()
+	dest.mkdir(parents=True)
+	dest_prefix = str(dest.resolve()) + os.sep
+	dirs = []
+	# root can write to read-only files, in place writes to a hard link would change the
+	# object shared by every app restored from it
+	link_state = {"reflink": True, "hardlink": hardlink and os.geteuid() != 0}
+
+	for rel_path, kind, mode, target, size in manifest["entries"]:
+		if os.path.isabs(rel_path) or ".." in Path(rel_path).parts:
+			raise CacheMiss(f"Invalid path in manifest: {rel_path}")
+		path = dest / rel_path
+
+		if kind == "d":
+			path.mkdir()
+			dirs.append((path, mode))
+		elif kind == "l":
+			# same as tarfile's data_filter, links that resolve outside dest are skipped
+			resolved = os.path.realpath(os.path.join(path.parent, target))
+			if os.path.isabs(target) or not resolved.startswith(dest_prefix):
+				continue
+			os.symlink(target, path)
+		elif kind == "f":
+			object_path = get_object_path(objects_path, target)
+			try:
+				if object_path.stat().st_size != size:
+					raise CacheMiss(f"Cached object {target} is damaged")
+			except FileNotFoundError:
+				raise CacheMiss(f"Cached object {target} is missing")
+			link_file(object_path, path, mode, link_state)
+
+	# directory modes are set last, in case any are read-only
+	for path, mode in reversed(dirs):
+		os.chmod(path, mode)
+
+
+def link_file(src: Path, dst: Path, mode: int, link_state: Dict[str, bool]) -> None:
+	"""Reflinks, hard links or copies src to dst, in that order of preference. Methods
+	that fail on the filesystem are disabled in link_state for subsequent files. Hard
+	links keep the object's read-only mode, the others get mode."""
+	if link_state["reflink"]:
+		try:
+			reflink(src, dst)
+			os.chmod(dst, mode)
+			return
+		except OSError:
+			link_state["reflink"] = False
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(dst)
+
+	if link_state["hardlink"]:
+		try:
+			os.link(src, dst)
+			return
+		except OSError:
+			link_state["hardlink"] = False
+
+	shutil.copyfile(src, dst)
+	os.chmod(dst, mode)
+
+
+def clone_file(src, dst) -> None:
+	try:
+		reflink(src, dst)
+	except OSError:
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(dst)
+		shutil.copyfile(src, dst)
+
+
+def reflink(src, dst) -> None:
+	import fcntl
+
+	with open(src, "rb") as s, open(dst, "wb") as d:
+		fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def get_manifests() -> Iterable[Tuple[Path, dict]]:
+	for item in get_bench_cache_path("apps").iterdir():
+		if item.suffix != ".json":
+			continue
+		manifest = read_manifest(item)
+		if manifest:
+			yield item, manifest
+
+
+def get_manifest_size(manifest: dict) -> int:
+	return sum(entry[4] for entry in manifest["entries"])
+
+
+def prune_objects() -> Tuple[int, int]:
+	"""Removes objects not referenced by any manifest, under an exclusive cache_lock.
+	Returns count and size removed"""
+	referenced = set()
+	for _, manifest in get_manifests():
+		referenced.update(entry[3] for entry in manifest["entries"] if entry[1] == "f")
+
+	count = size = 0
+	for object_path in iter_objects():
+		object_id = object_path.parent.name + object_path.name
+		if object_id in referenced:
+			continue
+		count += 1
+		size += object_path.stat().st_size
+		object_path.unlink()
+
+	return count, size
+
+
+def iter_objects() -> Iterable[Path]:
+	for prefix in get_objects_path().iterdir():
+		if prefix.is_dir():
+			yield from (p for p in prefix.iterdir() if not p.name.startswith("."))
+
+
+def get_objects_size() -> int:
+	return sum(p.stat().st_size for p in iter_objects())
+
+
+def get_cache_items() -> List[Path]:
+	"""Manifests and tar archives in the app cache"""
+	return [
+		item
+		for item in get_bench_cache_path("apps").iterdir()
+		if item.suffix in (".json", ".tar", *COMPRESSED_SUFFIXES)
+	]
+
+
+def get_cache_index() -> Dict[str, dict]:
+	try:
+		with open(get_bench_cache_path(None) / "index.json") as f:
+			return json.load(f)
+	except (FileNotFoundError, ValueError):
+		return {}
+
+
+def update_cache_index(name: str, **values) -> None:
+	"""Updates recorded stats of the app cache item with name"""
+	index_path = get_bench_cache_path(None) / "index.json"
+	with cache_lock("index"):
+		index = get_cache_index()
+		index.setdefault(name, {}).update(values)
+		write_manifest(index_path, index)
+
+
+def prune_cache_index() -> None:
+	"""Drops recorded stats of items that are no longer in the app cache"""
+	with cache_lock("index"):
+		index = get_cache_index()
+		items = {item.name for item in get_cache_items()}
+		write_manifest(
+			get_bench_cache_path(None) / "index.json",
+			{name: stats for name, stats in index.items() if name in items},
+		)
+
+
+def get_cache_config() -> dict:
+	try:
+		with open(get_bench_cache_path(None) / "config.json") as f:
+			return json.load(f)
+	except (FileNotFoundError, ValueError):
+		return {}
+
+
+def parse_size(size) -> int:
+	"""Parses sizes like 500MB or 20G into bytes, plain numbers are bytes"""
+	if isinstance(size, (int, float)):
+		return int(size)
+
+	size = size.strip().upper().rstrip("B")
+	units = {"K": 10**3, "M": 10**6, "G": 10**9, "T": 10**12}
+	if size and size[-1] in units:
+		return int(float(size[:-1]) * units[size[-1]])
+	return int(size)
+
+
+def get_last_access(item: Path, index: Dict[str, dict]) -> float:
+	"""Access time as recorded by bench, filesystem atimes are unreliable with noatime"""
+	return index.get(item.name, {}).get("accessed") or item.stat().st_mtime
+
+
+def get_eviction_plan(config: dict = None) -> List[Tuple[Path, int, str]]:
+	"""Returns items to evict under the cache's max_cache_age & max_cache_size, least
+	recently used first, with the bytes evicting each one frees and the reason"""
+	config = get_cache_config() if config is None else config
+	max_size = parse_size(config["max_cache_size"]) if config.get("max_cache_size") else None
+	max_age = config.get("max_cache_age")
+	if max_size is None and not max_age:
+		return []
+
+	index = get_cache_index()
+	items = sorted(get_cache_items(), key=lambda item: get_last_access(item, index))
+
+	# objects are shared by manifests, evicting one frees only what no other uses
+	object_refs: Dict[str, int] = {}
+	object_sizes: Dict[str, int] = {}
+	item_objects: Dict[Path, set] = {}
+	for item in items:
+		if item.suffix != ".json":
+			continue
+		manifest = read_manifest(item) or {"entries": []}
+		objects = {entry[3]: entry[4] for entry in manifest["entries"] if entry[1] == "f"}
+		item_objects[item] = set(objects)
+		object_sizes.update(objects)
+		for object_id in objects:
+			object_refs[object_id] = object_refs.get(object_id, 0) + 1
+
+	def evict(item) -> int:
+		if item.suffix != ".json":
+			return item.stat().st_size
+		freed = 0
+		for object_id in item_objects[item]:
+			object_refs[object_id] -= 1
+			if not object_refs[object_id]:
+				freed += object_sizes[object_id]
+		return freed
+
+	total_size = sum(object_sizes.values()) + sum(
+		item.stat().st_size for item in items if item.suffix != ".json"
+	)
+	now = time.time()
+	plan = []
+
+	for item in items:
+		if max_age and now - get_last_access(item, index) > max_age * 86400:
+			reason = f"not used in {max_age} days"
+		elif max_size is not None and total_size > max_size:
+			reason = f"cache exceeds {config['max_cache_size']}"
+		else:
+			break
+
+		freed = evict(item)
+		total_size -= freed
+		plan.append((item, freed, reason))
+
+	return plan
+
+
+def evict_cache_items() -> Tuple[int, int]:
+	"""Evicts items as per the cache's config. Returns count and size freed"""
+	with cache_lock():
+		plan = get_eviction_plan()
+		if not plan:
+			return 0, 0
+
+		for item, _, _ in plan:
+			with contextlib.suppress(FileNotFoundError):
+				item.unlink()
+
+		freed = prune_objects()[1] + sum(
+			size for item, size, _ in plan if item.suffix != ".json"
+		)
+		prune_cache_index()
+	return len(plan), freed
+
+
+def get_compression_backend() -> str:
+	with contextlib.suppress(ImportError):
+		import zstandard  # noqa: F401
+
+		return "zstandard"
+
+	for binary in ("zstd", "pigz"):
+		if which(binary):
+			return binary
+
+	return "gzip"
+
+
+def get_compressed_suffix(backend: str) -> str:
+	return ".tzst" if backend in ("zstandard", "zstd") else ".tgz"
+
+
+class CountingWriter:
+	"""Counts bytes written through it to get the uncompressed size of a stream"""
+
+	def __init__(self, fileobj):
+		self.fileobj = fileobj
+		self.count = 0
+
+	def write(self, data) -> int:
+		self.count += len(data)
+		return self.fileobj.write(data)
+
+
+@contextlib.contextmanager
+def compressed_writer(path: Path, backend: str):
+	"""Yields a file object that compresses data written to it into path, using all
+	cores where the backend supports it"""
+	with open(path, "wb") as f:
+		if backend == "zstandard":
+			import zstandard
+
+			with zstandard.ZstdCompressor(threads=-1).stream_writer(f) as writer:
+				yield writer
+
+		elif backend in ("zstd", "pigz"):
+			cmd = ["zstd", "-T0", "-q", "-c"] if backend == "zstd" else ["pigz", "-c"]
+			with piped_command(cmd, stdin=subprocess.PIPE, stdout=f) as proc:
+				yield proc.stdin
+
+		else:
+			with gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6) as writer:
+				yield writer
+
+
+@contextlib.contextmanager
+def compressed_reader(path: Path):
+	"""Yields a file object of the decompressed contents of path. Binaries decompress in a
+	separate process, in parallel with whatever consumes the stream."""
+	if path.suffix == ".tzst" and get_compression_backend() == "zstandard":
+		import zstandard
+
+		with open(path, "rb") as f, zstandard.ZstdDecompressor().stream_reader(f) as reader:
+			yield reader
+		return
+
+	if path.suffix == ".tzst":
+		cmd = ["zstd", "-d", "-q", "-c", str(path)]
+	elif which("pigz"):
+		cmd = ["pigz", "-d", "-c", str(path)]
+	else:
+		with gzip.open(path, "rb") as reader:
+			yield reader
+		return
+
+	with piped_command(cmd, stdout=subprocess.PIPE) as proc:
+		yield proc.stdout
+
+
+@contextlib.contextmanager
+def piped_command(cmd: List[str], **kwargs):
+	proc = subprocess.Popen(cmd, **kwargs)
+	try:
+		yield proc
+	except BaseException:
+		proc.kill()
+		proc.wait()
+		raise
+
+	if proc.stdin:
+		proc.stdin.close()
+	if proc.stdout:
+		# tar streams end before the compressed stream does
+		proc.stdout.read()
+		proc.stdout.close()
+
+	if proc.wait():
+		raise CommandFailedError(" ".join(cmd))
@@ -35,6 +35,31 @@ class MultiCommandGroup(click.Group):
 					self.commands[_name] = cmd
 
 
+class LazyCommandGroup(MultiCommandGroup):
+	"""Group that imports a command's module only when the command is invoked, or when
+	all commands are listed for help. Commands are registered as a mapping of name to
+	`module:attribute` in `lazy_commands`."""
+
+	def __init__(self, *args, lazy_commands=None, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.lazy_commands = lazy_commands or {}
+
+	def has_command(self, name: str) -> bool:
+		return name in self.commands or name in self.lazy_commands
+
+	def list_commands(self, ctx):
+		return sorted({*self.commands, *self.lazy_commands})
+
+	def get_command(self, ctx, cmd_name):
+		if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+			from importlib import import_module
+
+			module_name, attr = self.lazy_commands[cmd_name].split(":")
+			self.add_command(getattr(import_module(module_name), attr), cmd_name)
+
+		return super().get_command(ctx, cmd_name)
+
+
 class SugaredOption(click.Option):
 	def __init__(self, *args, **kwargs):
 		self.only_if_set: List = kwargs.pop("only_if_set")
@@ -0,0 +1,270 @@
+# imports - standard imports
+import os
+import re
+import subprocess
+from typing import Dict, Optional, Tuple
+
+_git_states: Dict[str, "GitState"] = {}
+config_section_re = re.compile(r'^\[\s*([^\s\]"]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+sha_re = re.compile(r"^[0-9a-f]{40}([0-9a-f]{24})?$")
+
+
+class GitState:
+	"""Reads the state of a git repository (HEAD, branch, remotes, remote HEADs and
+	shallow status) straight from the files in its git directory instead of spawning
+	a git process for each of them.
+
+	Use `get_git_state` to get a memoized instance for an app and `invalidate_git_state`
+	after running commands that change the repository.
+	"""
+
+	def __init__(self, path: str):
+		self.path = os.path.abspath(path)
+		self.git_dir, self.common_dir = get_git_dirs(self.path)
+		self.config = read_git_config(os.path.join(self.common_dir, "config"))
+		if any(key.startswith(("include.", "includeif.")) for key in self.config):
+			# included files can be conditional, leave resolving them to git
+			self.config = get_git_config(self.path) or self.config
+		self.packed_refs = read_packed_refs(os.path.join(self.common_dir, "packed-refs"))
+		self.is_shallow = os.path.exists(os.path.join(self.common_dir, "shallow"))
+
+		head = self.read_ref_file("HEAD") or ""
+		if head.startswith("ref:"):
+			self.head_ref = head[4:].strip()
+			self.branch = self.head_ref.replace("refs/heads/", "", 1)
+		else:
+			self.head_ref = None
+			self.branch = None
+
+	@property
+	def head(self) -> Optional[str]:
+		"""Commit hash HEAD points to"""
+		return self.resolve("HEAD")
+
+	@property
+	def remotes(self) -> Dict[str, str]:
+		"""Remote names mapped to their urls, in the order they're configured"""
+		return {
+			key[len("remote.") : -len(".url")]: value
+			for key, value in self.config.items()
+			if key.startswith("remote.") and key.endswith(".url")
+		}
+
+	def get_remote(self):
+		"""Returns upstream if it exists, else the first remote. False if there are none"""
+		remotes = self.remotes
+		if "upstream" in remotes:
+			return "upstream"
+		elif not remotes:
+			return False
+		return sorted(remotes)[0]
+
+	def get_branch_remote(self, branch: str = None) -> Optional[str]:
+		"""Remote that the branch tracks, equivalent of `git config branch.<branch>.remote`"""
+		return self.config.get(f"branch.{branch or self.branch}.remote")
+
+	def get_upstream_head(self, remote: str = None) -> Optional[str]:
+		"""Default branch of a remote, as set in refs/remotes/<remote>/HEAD"""
+		remote = remote or self.get_remote()
+		head = self.read_ref_file(f"refs/remotes/{remote}/HEAD") or ""
+		if not head.startswith("ref:"):
+			return None
+		return head[4:].strip().rsplit("/")[-1]
+
+	def read_ref_file(self, ref: str) -> Optional[str]:
+		# HEAD and other pseudo refs are per worktree, refs/* are shared
+		for directory in (self.git_dir, self.common_dir):
+			try:
+				with open(os.path.join(directory, ref)) as f:
+					return f.read().strip()
+			except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+				continue
+		return None
+
+	def resolve_ref(self, ref: str, depth: int = 0) -> Optional[str]:
+		value = self.read_ref_file(ref)
+		if value is None:
+			return self.packed_refs.get(ref)
+		if value.startswith("ref:") and depth < 5:
+			return self.resolve_ref(value[4:].strip(), depth + 1)
+		return value if sha_re.match(value) else None
+
+	def resolve(self, name: str) -> Optional[str]:
+		"""Resolves a ref, branch, tag or remote branch to a commit hash using the rules
+		of `git rev-parse <name>`. Falls back to running git for anything else, such as
+		abbreviated hashes or revision expressions."""
+		if sha_re.match(name):
+			return name
+
+		refs = [
+			f"refs/{name}",
+			f"refs/tags/{name}",
+			f"refs/heads/{name}",
+			f"refs/remotes/{name}",
+			f"refs/remotes/{name}/HEAD",
+		]
+		if name.isupper() or name.startswith("refs/"):
+			refs.insert(0, name)
+
+		for ref in refs:
+			commit_hash = self.resolve_ref(ref)
+			if commit_hash:
+				return commit_hash
+
+		try:
+			return subprocess.check_output(
+				["git", "rev-parse", "--verify", "--quiet", name],
+				cwd=self.path,
+				stderr=subprocess.DEVNULL,
+				encoding="utf-8",
+			).strip()
+		except subprocess.CalledProcessError:
+			return None
+
+
+def get_git_state(path: str) -> Optional[GitState]:
+	"""Returns the memoized GitState of the repository at path, None if it isn't one"""
+	path = os.path.abspath(path)
+	if path not in _git_states:
+		try:
+			_git_states[path] = GitState(path)
+		except FileNotFoundError:
+			return None
+	return _git_states[path]
+
+
+def invalidate_git_state(path: str = None) -> None:
+	"""Drops the memoized state of the repository at path, or of all repositories"""
+	if path is None:
+		_git_states.clear()
+	else:
+		_git_states.pop(os.path.abspath(path), None)
+
+
+def get_git_dirs(path: str) -> Tuple[str, str]:
+	"""Returns the git directory of the work tree at path and the common directory that
+	holds its refs, objects & config. These differ only for linked work trees."""
+	dot_git = os.path.join(path, ".git")
+
+	if os.path.isfile(dot_git):
+		with open(dot_git) as f:
+			content = f.read().strip()
+		if not content.startswith("gitdir:"):
+			raise FileNotFoundError(f"{dot_git} does not point to a git directory")
+		git_dir = os.path.normpath(os.path.join(path, content[len("gitdir:") :].strip()))
+	elif os.path.isdir(dot_git):
+		git_dir = dot_git
+	else:
+		raise FileNotFoundError(f"{path} is not a git repository")
+
+	common_dir = git_dir
+	commondir_file = os.path.join(git_dir, "commondir")
+	if os.path.isfile(commondir_file):
+		with open(commondir_file) as f:
+			common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+
+	if not os.path.isfile(os.path.join(git_dir, "HEAD")):
+		raise FileNotFoundError(f"{git_dir} is not a git directory")
+
+	return git_dir, common_dir
+
+
+def read_git_config(config_path: str) -> Dict[str, str]:
+	"""Parses a git config file into a flat dict of `section.subsection.key` to value.
+	Section and key names are lowercased as git treats them case insensitively."""
+	config = {}
+	section = None
+
+	try:
+		with open(config_path) as f:
+			lines = f.read().splitlines()
+	except FileNotFoundError:
+		return config
+
+	for line in lines:
+		line = line.strip()
+		if not line or line[0] in "#;":
+			continue
+
+		match = config_section_re.match(line)
+		if match:
+			name, subsection = match.groups()
+			section = name.lower()
+			if subsection is not None:
+				section += "." + subsection.replace('\\"', '"').replace("\\\\", "\\")
+			elif "." in name:
+				# deprecated [section.subsection] syntax
+				_section, _subsection = name.split(".", 1)
+				section = f"{_section.lower()}.{_subsection}"
+			line = line[match.end() :].strip()
+			if not line:
+				continue
+
+		if section is None:
+			continue
+
+		key, _, value = line.partition("=")
+		config[f"{section}.{key.strip().lower()}"] = parse_config_value(value.strip())
+
+	return config
+
+
+def get_git_config(path: str) -> Dict[str, str]:
+	"""Config of the repository at path as resolved by git, following its includes, in
+	the format of `read_git_config`. Empty if git fails."""
+	try:
+		output = subprocess.check_output(
+			["git", "config", "--local", "--includes", "--list", "-z"],
+			cwd=path,
+			stderr=subprocess.DEVNULL,
+			encoding="utf-8",
+		)
+	except (OSError, subprocess.CalledProcessError):
+		return {}
+
+	config = {}
+	for item in output.split("\0"):
+		if item:
+			key, _, value = item.partition("\n")
+			config[key] = value
+	return config
+
+
+def parse_config_value(value: str) -> str:
+	parsed = []
+	in_quotes = False
+	escaped = False
+
+	for char in value:
+		if escaped:
+			parsed.append({"n": "\n", "t": "\t", "b": "\b"}.get(char, char))
+			escaped = False
+		elif char == "\\":
+			escaped = True
+		elif char == '"':
+			in_quotes = not in_quotes
+		elif char in "#;" and not in_quotes:
+			break
+		else:
+			parsed.append(char)
+
+	return "".join(parsed).strip()
+
+
+def read_packed_refs(packed_refs_path: str) -> Dict[str, str]:
+	refs = {}
+
+	try:
+		with open(packed_refs_path) as f:
+			lines = f.read().splitlines()
+	except FileNotFoundError:
+		return refs
+
+	for line in lines:
+		# skip the header & peeled tags, i.e. the commits annotated tags point to
+		if not line or line[0] in "#^":
+			continue
+		commit_hash, _, ref = line.partition(" ")
+		refs[ref.strip()] = commit_hash
+
+	return refs
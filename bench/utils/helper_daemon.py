@@ -0,0 +1,232 @@
+# imports - standard imports
+import array
+import contextlib
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+# imports - third party imports
+import click
+
+# imports - module imports
+from bench.exceptions import CommandFailedError
+
+# long running or interactive commands are always run in their own process
+EXCLUDED_COMMANDS = {
+	"console",
+	"db-console",
+	"jupyter",
+	"mariadb",
+	"postgres",
+	"schedule",
+	"serve",
+	"watch",
+	"worker",
+}
+
+
+def get_socket_path(bench_path=".") -> str:
+	return os.path.abspath(os.path.join(bench_path, "config", "helper-daemon.sock"))
+
+
+def get_info_path(bench_path=".") -> str:
+	return os.path.join(bench_path, "config", "helper-daemon.json")
+
+
+def get_daemon_info(bench_path=".") -> Optional[dict]:
+	try:
+		with open(get_info_path(bench_path)) as f:
+			return json.load(f)
+	except (FileNotFoundError, ValueError):
+		return None
+
+
+def get_fingerprint(bench_path=".") -> str:
+	"""Identifies the code a daemon has imported, it's stale once this changes"""
+	from glob import glob
+	from hashlib import sha256
+
+	from bench.utils import get_frappe_apps_state
+	from bench.utils.bench import get_env_cmd
+
+	python = get_env_cmd("python", bench_path=bench_path)
+	state = [os.path.realpath(python)]
+	state.extend(get_frappe_apps_state(bench_path))
+
+	# installing, upgrading or removing packages adds & removes their .dist-info in
+	# site-packages, which changes its mtime
+	env_path = os.path.dirname(os.path.dirname(python))
+	for site_packages in sorted(glob(os.path.join(env_path, "lib", "python*", "site-packages"))):
+		state.append([site_packages, os.stat(site_packages).st_mtime_ns])
+
+	return sha256(json.dumps(state).encode()).hexdigest()
+
+
+def is_running(info: Optional[dict]) -> bool:
+	if not info:
+		return False
+	try:
+		os.kill(info["pid"], 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+
+def start_daemon(bench_path=".") -> None:
+	from bench.utils.bench import get_env_cmd
+
+	if is_running(get_daemon_info(bench_path)):
+		click.echo("Helper daemon is already running")
+		return
+
+	socket_path = get_socket_path(bench_path)
+	if len(socket_path) > 100:
+		raise CommandFailedError(f"Socket path {socket_path} is too long for a Unix socket")
+
+	server = os.path.join(os.path.dirname(os.path.abspath(__file__)), "helper_daemon_server.py")
+	python = get_env_cmd("python", bench_path=bench_path)
+	sites_path = os.path.abspath(os.path.join(bench_path, "sites"))
+	fingerprint = get_fingerprint(bench_path)
+
+	with open(os.path.join(bench_path, "logs", "helper-daemon.log"), "a") as log_file:
+		process = subprocess.Popen(
+			[python, server, socket_path, sites_path],
+			stdin=subprocess.DEVNULL,
+			stdout=log_file,
+			stderr=subprocess.STDOUT,
+			start_new_session=True,
+		)
+
+	with open(get_info_path(bench_path), "w") as f:
+		json.dump({"pid": process.pid, "fingerprint": fingerprint, "started": time.time()}, f)
+
+	# frappe & apps take a while to import before the socket is up
+	for _ in range(300):
+		if process.poll() is not None:
+			os.remove(get_info_path(bench_path))
+			raise CommandFailedError("Helper daemon failed to start, see logs/helper-daemon.log")
+		if os.path.exists(socket_path):
+			click.secho(f"Helper daemon started with PID {process.pid}", fg="green")
+			return
+		time.sleep(0.1)
+
+	click.secho("Helper daemon is still starting, see logs/helper-daemon.log", fg="yellow")
+
+
+def stop_daemon(bench_path=".") -> None:
+	info = get_daemon_info(bench_path)
+	if is_running(info):
+		os.kill(info["pid"], signal.SIGTERM)
+		click.echo(f"Stopped helper daemon with PID {info['pid']}")
+	else:
+		click.echo("Helper daemon is not running")
+
+	for path in (get_info_path(bench_path), get_socket_path(bench_path)):
+		if os.path.exists(path):
+			os.remove(path)
+
+
+def print_daemon_status(bench_path=".") -> None:
+	info = get_daemon_info(bench_path)
+	if not is_running(info):
+		click.echo("Helper daemon is not running")
+		return
+
+	if info["fingerprint"] == get_fingerprint(bench_path):
+		click.echo(f"Helper daemon is running with PID {info['pid']}")
+	else:
+		click.secho(
+			f"Helper daemon is running with PID {info['pid']}, but apps changed since it"
+			" started so commands aren't sent to it. Restart it to pick up the changes.",
+			fg="yellow",
+		)
+
+
+def get_command_name(args: List[str]) -> Optional[str]:
+	"""First argument that isn't an option or the value of --site"""
+	skip_next = False
+	for arg in args:
+		if skip_next:
+			skip_next = False
+		elif arg == "--site":
+			skip_next = True
+		elif not arg.startswith("-"):
+			return arg
+
+
+def run_in_daemon(args: List[str], bench_path=".") -> Optional[int]:
+	"""Runs frappe command with args in the helper daemon on this process's stdin, stdout
+	& stderr. Returns its exit code, or None if the daemon isn't running, is stale or
+	the command must not run in it."""
+	from bench.config.common_site_config import get_config
+
+	if get_command_name(args) in EXCLUDED_COMMANDS:
+		return None
+
+	info = get_daemon_info(bench_path)
+	if not info or get_config(bench_path).get("developer_mode"):
+		return None
+
+	if info["fingerprint"] != get_fingerprint(bench_path):
+		return None
+
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(get_socket_path(bench_path))
+	except OSError:
+		sock.close()
+		return None
+
+	sys.stdout.flush()
+	sys.stderr.flush()
+
+	request = {
+		"args": args,
+		"cwd": os.path.abspath(os.path.join(bench_path, "sites")),
+		"env": dict(os.environ),
+	}
+	fds = array.array("i", [0, 1, 2])
+	sock.sendmsg(
+		[json.dumps(request).encode()],
+		[(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)],
+	)
+
+	return wait_for_exit(sock)
+
+
+def wait_for_exit(sock: socket.socket) -> int:
+	"""Reads replies of the command's process, forwarding signals to it meanwhile"""
+	forwarded = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+	handlers = {signum: signal.getsignal(signum) for signum in forwarded}
+	pid = None
+
+	def forward(signum, frame):
+		if pid:
+			with contextlib.suppress(ProcessLookupError):
+				os.kill(pid, signum)
+
+	for signum in forwarded:
+		signal.signal(signum, forward)
+
+	try:
+		with sock.makefile("r") as replies:
+			for reply in replies:
+				kind, _, value = reply.strip().partition(" ")
+				if kind == "pid":
+					pid = int(value)
+				elif kind == "exit":
+					return int(value)
+	finally:
+		for signum, handler in handlers.items():
+			signal.signal(signum, handler)
+		sock.close()
+
+	# the process died without reporting, i.e. it was killed
+	return 1
@@ -0,0 +1,134 @@
+"""
+Frappe Helper Daemon
+
+Started by `bench helper-daemon start` with the bench's env python, not
+imported by bench. It imports frappe & the commands of all apps once, then
+listens on a Unix socket and forks a copy-on-write child per request to run
+a frappe command, the same as `python -m frappe.utils.bench_helper frappe`.
+
+Clients send a JSON request along with their stdin, stdout & stderr file
+descriptors, which the child runs the command on. The child replies with
+`pid <pid>` once it starts, for the client to forward signals to, and with
+`exit <code>` once the command is done.
+
+Only the standard library may be imported at module level.
+"""
+
+# imports - standard imports
+import array
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+
+MAX_REQUEST_SIZE = 1024 * 1024
+
+
+def serve(socket_path: str, sites_path: str) -> None:
+	os.chdir(sites_path)
+	# as with `python -m`, sites is first on the path & not the dir of this script
+	sys.path[0] = sites_path
+
+	import frappe.utils.bench_helper as bench_helper
+
+	bench_helper.get_app_groups()
+
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	if os.path.exists(socket_path):
+		os.unlink(socket_path)
+	server.bind(socket_path)
+	os.chmod(socket_path, 0o600)
+	server.listen(64)
+
+	def shutdown(signum, frame):
+		os.unlink(socket_path)
+		sys.exit(0)
+
+	signal.signal(signal.SIGTERM, shutdown)
+	# children are reaped automatically, they report their exit code to clients
+	signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+	print(f"Listening on {socket_path}", flush=True)
+
+	while True:
+		conn, _ = server.accept()
+		try:
+			request, fds = receive_request(conn)
+		except Exception:
+			traceback.print_exc()
+			conn.close()
+			continue
+
+		if os.fork() == 0:
+			code = 1
+			try:
+				server.close()
+				signal.signal(signal.SIGTERM, signal.SIG_DFL)
+				signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+				code = run_request(bench_helper, conn, request, fds)
+			finally:
+				# the child must never return to accepting requests
+				os._exit(code)
+
+		conn.close()
+		for fd in fds:
+			os.close(fd)
+
+
+def receive_request(conn: socket.socket):
+	fds = array.array("i")
+	data, ancdata, _, _ = conn.recvmsg(
+		MAX_REQUEST_SIZE, socket.CMSG_LEN(3 * fds.itemsize)
+	)
+	for level, kind, cmsg_data in ancdata:
+		if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+			fds.frombytes(cmsg_data[: len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+
+	if len(fds) != 3:
+		for fd in fds:
+			os.close(fd)
+		raise ValueError("Expected stdin, stdout & stderr with the request")
+
+	return json.loads(data), list(fds)
+
+
+def run_request(bench_helper, conn: socket.socket, request: dict, fds) -> int:
+	for target, fd in enumerate(fds):
+		os.dup2(fd, target)
+		os.close(fd)
+
+	sys.stdin = os.fdopen(0, "r", closefd=False)
+	sys.stdout = os.fdopen(1, "w", buffering=1, closefd=False)
+	sys.stderr = os.fdopen(2, "w", buffering=1, closefd=False)
+
+	os.environ.clear()
+	os.environ.update(request["env"])
+	os.chdir(request["cwd"])
+	sys.argv = ["frappe.utils.bench_helper", "frappe", *request["args"]]
+	conn.sendall(f"pid {os.getpid()}\n".encode())
+
+	code = 0
+	try:
+		bench_helper.main()
+	except SystemExit as e:
+		if isinstance(e.code, int) or e.code is None:
+			code = e.code or 0
+		else:
+			print(e.code, file=sys.stderr)
+			code = 1
+	except KeyboardInterrupt:
+		traceback.print_exc()
+		code = 130
+	except Exception:
+		traceback.print_exc()
+		code = 1
+
+	sys.stdout.flush()
+	sys.stderr.flush()
+	conn.sendall(f"exit {code}\n".encode())
+	return code
+
+
+if __name__ == "__main__":
+	serve(*sys.argv[1:3])
@@ -0,0 +1,156 @@
+# imports - standard imports
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+# imports - third party imports
+import click
+
+# imports - module imports
+from bench.utils.timings import Timing, get_timing_context, set_timing_context
+
+
+class Task:
+	def __init__(
+		self,
+		name: str,
+		fn: Callable,
+		deps: Iterable[str] = (),
+		resource: str = None,
+		labels: Optional[Dict[str, str]] = None,
+	):
+		self.name = name
+		self.fn = fn
+		self.deps = list(deps)
+		self.resource = resource
+		self.labels = labels or {}
+		self.start = None
+		self.end = None
+		self.result = None
+		self.error = None
+
+	@property
+	def duration(self) -> float:
+		return (self.end - self.start) if self.end else 0.0
+
+
+class TaskGraph:
+	"""Runs tasks on a pool of threads as soon as the tasks they depend on are done.
+
+	Tasks are called as `fn(output)`, with a list they collect their output into, which
+	is printed in one piece once the task is done so that output of concurrent tasks
+	doesn't interleave. A task may name a resource, of which at most as many tasks as
+	its capacity in `resources` run at a time, e.g. a single pip install in an env.
+
+	After the first failure no more tasks are started, and the failure is re-raised
+	once the running tasks are done.
+	"""
+
+	def __init__(self, workers: int = 1, resources: Optional[Dict[str, int]] = None):
+		self.workers = max(1, workers)
+		self.resources = resources or {}
+		self.tasks: Dict[str, Task] = {}
+
+	def add(
+		self, name: str, fn: Callable, deps: Iterable[str] = (), resource: str = None, **labels
+	) -> Task:
+		"""Adds a task, its dependencies must have been added before it. `labels`, like
+		the app or site the task is of, are recorded with its timing."""
+		deps = list(deps)
+		for dep in deps:
+			if dep not in self.tasks:
+				raise ValueError(f"Task {name} depends on {dep}, which isn't in the graph")
+
+		self.tasks[name] = Task(name, fn, deps=deps, resource=resource, labels=labels)
+		return self.tasks[name]
+
+	def run(self):
+		pending = list(self.tasks.values())
+		running = {}
+		in_use = {resource: 0 for resource in self.resources}
+		self.start = time.monotonic()
+		error = None
+		timing_context = get_timing_context()
+
+		def is_ready(task):
+			if any(self.tasks[dep].end is None for dep in task.deps):
+				return False
+			return task.resource not in self.resources or (
+				in_use[task.resource] < self.resources[task.resource]
+			)
+
+		def run_task(task, output):
+			set_timing_context(timing_context)
+			task.start = time.monotonic()
+			try:
+				with Timing(task.name, kind="task", **task.labels):
+					task.result = task.fn(output)
+			except Exception as e:
+				task.error = e
+			finally:
+				task.end = time.monotonic()
+
+		with ThreadPoolExecutor(max_workers=self.workers) as executor:
+			while pending or running:
+				while not error and len(running) < self.workers:
+					task = next((task for task in pending if is_ready(task)), None)
+					if not task:
+						break
+					pending.remove(task)
+					if task.resource in in_use:
+						in_use[task.resource] += 1
+					output = []
+					running[executor.submit(run_task, task, output)] = (task, output)
+
+				if not running:
+					break
+
+				done, _ = wait(running, return_when=FIRST_COMPLETED)
+				for future in done:
+					task, output = running.pop(future)
+					if task.resource in in_use:
+						in_use[task.resource] -= 1
+
+					click.echo("".join(output), nl=False)
+					# raises what isn't an Exception, e.g. SystemExit, no more tasks start
+					future.result()
+					if task.error:
+						click.secho(f"{task.name} failed after {task.duration:.1f}s", fg="red")
+						error = error or task.error
+					else:
+						click.secho(f"{task.name} done in {task.duration:.1f}s", fg="green")
+
+		self.end = time.monotonic()
+		if error:
+			raise error
+
+	def get_critical_path(self) -> List[Task]:
+		"""Chain of tasks that ended last, each one's dependency that ended last, i.e. the
+		tasks that held up the ones after them"""
+		tasks = [task for task in self.tasks.values() if task.end]
+		path = []
+		task = max(tasks, key=lambda task: task.end, default=None)
+		while task:
+			path.insert(0, task)
+			deps = [self.tasks[dep] for dep in task.deps if self.tasks[dep].end]
+			task = max(deps, key=lambda task: task.end, default=None)
+		return path
+
+	def print_report(self):
+		click.echo(f"\n{'TASK':30}  {'AFTER':30}  {'START':>8}  {'TIME':>8}")
+		for task in sorted(self.tasks.values(), key=lambda task: task.start or float("inf")):
+			deps = ", ".join(task.deps) if len(task.deps) <= 2 else f"{len(task.deps)} tasks"
+			if task.start is None:
+				click.echo(f"{task.name:30}  {deps:30}  {'-':>8}  {'-':>8}")
+				continue
+			click.echo(
+				f"{task.name:30}  {deps:30}  {task.start - self.start:>7.1f}s"
+				f"  {task.duration:>7.1f}s"
+			)
+
+		path = self.get_critical_path()
+		total = sum(task.duration for task in path)
+		click.echo(
+			f"\nCritical path, {total:.1f}s of {self.end - self.start:.1f}s: "
+			+ " -> ".join(f"{task.name} ({task.duration:.1f}s)" for task in path)
+		)
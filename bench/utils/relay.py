@@ -0,0 +1,98 @@
+# imports - standard imports
+import codecs
+import os
+import sys
+import threading
+import time
+from typing import IO, Iterable, List, Optional
+
+CHUNK_SIZE = 64 * 1024
+
+# shared by relays so that lines of processes relayed concurrently don't interleave
+_write_lock = threading.Lock()
+
+
+class OutputRelay:
+	"""Relays output of processes line by line, with a thread per stream reading it in
+	chunks, so that relaying doesn't hold up the process on a full pipe.
+
+	Lines keep their order per stream and are written whole, optionally prefixed, e.g.
+	with the site they're of, and timestamped. They're written to the `tee` files as
+	well. If a list is passed as `output`, lines are appended to it instead of being
+	written to stdout & stderr, see `bench.utils.exec_cmd`.
+
+	with OutputRelay(prefix=f"{site}: ", tee=[log]) as relay:
+	        relay.relay_process(p)
+	"""
+
+	def __init__(
+		self,
+		prefix: str = "",
+		timestamps: bool = False,
+		tee: Iterable[IO] = (),
+		output: Optional[List[str]] = None,
+	):
+		self.prefix = prefix
+		self.timestamps = timestamps
+		self.tee = list(tee)
+		self.output = output
+		self.threads: List[threading.Thread] = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.join()
+
+	def relay_process(self, p):
+		"""Relays the piped stdout & stderr of subprocess.Popen `p`"""
+		if p.stdout:
+			self.relay(p.stdout, sys.stdout)
+		if p.stderr:
+			self.relay(p.stderr, sys.stderr)
+
+	def relay(self, stream: IO, sink: IO):
+		thread = threading.Thread(target=self.pump, args=(stream, sink), daemon=True)
+		thread.start()
+		self.threads.append(thread)
+
+	def join(self):
+		for thread in self.threads:
+			thread.join()
+		self.threads = []
+
+	def pump(self, stream: IO, sink: IO):
+		fd = stream.fileno()
+		decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+		pending = ""
+
+		while True:
+			chunk = os.read(fd, CHUNK_SIZE)
+			pending += decoder.decode(chunk, final=not chunk)
+
+			# a line ends with \n, or with \r for progress bars redrawing a line
+			end = len(pending) if not chunk else max(pending.rfind("\n"), pending.rfind("\r")) + 1
+			if end:
+				self.write(pending[:end], sink)
+				pending = pending[end:]
+
+			if not chunk:
+				break
+
+	def write(self, text: str, sink: IO):
+		if self.prefix or self.timestamps:
+			prefix = self.prefix
+			if self.timestamps:
+				prefix = f"{time.strftime('%H:%M:%S')} {prefix}"
+			text = "".join(prefix + line for line in text.splitlines(keepends=True))
+
+		with _write_lock:
+			if self.output is None:
+				sink.write(text)
+				sink.flush()
+			else:
+				self.output.append(text)
+
+			for f in self.tee:
+				f.write(text)
+				f.flush()
@@ -0,0 +1,376 @@
+# imports - standard imports
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from typing import List, Optional
+
+# imports - third party imports
+import click
+
+# imports - module imports
+import bench
+from bench.exceptions import ValidationError
+from bench.utils import exec_cmd, get_bench_cache_path, get_cmd_output, log, which
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+
+# A release is a copy of what a bench runs under releases/<name>: apps as worktrees of
+# the repos in apps/, an env with those installed and sites/ with their built assets.
+# Processes run the release the `current` symlink points to, sites stay shared.
+RELEASES_DIR = "releases"
+CURRENT_RELEASE = "current"
+
+
+def get_runtime_path(bench_path=".") -> str:
+	"""Path that env/ & apps/ of running processes are in, the `current` symlink of
+	benches running releases, unresolved so that processes follow it when it switches"""
+	bench_dir = os.path.abspath(bench_path)
+	current = os.path.join(bench_dir, CURRENT_RELEASE)
+	return current if os.path.islink(current) else bench_dir
+
+
+def get_current_release(bench_path=".") -> Optional[str]:
+	current = os.path.join(bench_path, CURRENT_RELEASE)
+	if os.path.islink(current):
+		return os.path.basename(os.readlink(current))
+
+
+def get_releases(bench_path=".") -> List[str]:
+	"""Names of prepared releases, oldest first"""
+	releases_path = os.path.join(bench_path, RELEASES_DIR)
+	try:
+		names = os.listdir(releases_path)
+	except FileNotFoundError:
+		return []
+
+	return sorted(
+		name
+		for name in names
+		if os.path.isfile(os.path.join(releases_path, name, "release.json"))
+	)
+
+
+def get_release_history(bench_path=".") -> List[str]:
+	"""Activated releases, last one is current"""
+	try:
+		with open(os.path.join(bench_path, RELEASES_DIR, "history.json")) as f:
+			return json.load(f)
+	except (FileNotFoundError, ValueError):
+		return []
+
+
+def set_release_history(history: List[str], bench_path="."):
+	history_path = os.path.join(bench_path, RELEASES_DIR, "history.json")
+	with open(f"{history_path}.tmp", "w") as f:
+		json.dump(history, f)
+	os.replace(f"{history_path}.tmp", history_path)
+
+
+def prepare_release(bench_path=".") -> str:
+	"""Creates a release of the apps at their current commits, with a new env that has
+	the packages of the bench's env and the apps installed, and their assets built.
+	Returns the name of the release."""
+	from bench.bench import Bench
+
+	bench = Bench(bench_path)
+	name = time.strftime("%Y%m%d%H%M%S")
+	release_path = os.path.abspath(os.path.join(bench_path, RELEASES_DIR, name))
+	if os.path.exists(release_path):
+		raise ValidationError(f"Release {name} already exists")
+
+	click.secho(f"Preparing release {name}", fg="yellow")
+	logger.log(f"preparing release {name}")
+	os.makedirs(os.path.join(release_path, "apps"))
+
+	try:
+		commits = add_release_apps(bench, release_path)
+		setup_release_env(bench, release_path)
+		setup_release_sites(bench, release_path)
+	except BaseException:
+		log(f"Removing incomplete release {name}", level=2)
+		remove_release(name, bench_path=bench_path)
+		raise
+
+	with open(os.path.join(release_path, "release.json"), "w") as f:
+		json.dump({"name": name, "created": time.time(), "apps": commits}, f, indent=1)
+
+	log(f"Release {name} is ready, run `bench release activate {name}` to switch to it", level=1)
+	gc_releases(bench_path=bench_path)
+	return name
+
+
+def add_release_apps(bench, release_path) -> dict:
+	"""Adds apps to the release as worktrees at their current commit, or as copies if
+	they aren't git repos. Returns a dict of app to commit."""
+	from bench.app import has_local_changes
+
+	commits = {}
+	for app in bench.apps:
+		app_path = os.path.abspath(os.path.join(bench.name, "apps", app))
+		release_app_path = os.path.join(release_path, "apps", app)
+
+		if not os.path.exists(os.path.join(app_path, ".git")):
+			shutil.copytree(app_path, release_app_path, symlinks=True)
+			commits[app] = None
+			continue
+
+		if has_local_changes(app, bench_path=bench.name):
+			log(f"Uncommitted changes of {app} aren't part of the release", level=3)
+
+		exec_cmd(f"git worktree add --detach {release_app_path} HEAD", cwd=app_path)
+		commits[app] = get_cmd_output("git rev-parse HEAD", cwd=app_path)
+
+	return commits
+
+
+def setup_release_env(bench, release_path):
+	"""Creates the release's env with the same python and packages as the bench's env,
+	then installs the release's apps and their node dependencies"""
+	import bench.cli as bench_cli
+
+	quiet_flag = "" if bench_cli.verbose else "--quiet"
+	env_path = os.path.join(release_path, "env")
+	python = os.path.join(env_path, "bin", "python")
+	apps_path = os.path.join(release_path, "apps")
+	base_python = get_cmd_output(
+		f"{bench.python} -c 'import sys; print(getattr(sys, \"_base_executable\", sys.executable))'"
+	)
+
+	exec_cmd(f"{base_python} -m venv {env_path}")
+	exec_cmd(f"{python} -m pip install {quiet_flag} --upgrade pip")
+
+	# editable installs are the bench's apps, installed from the release below
+	frozen = get_cmd_output(f"{bench.python} -m pip freeze --exclude-editable")
+	requirements_path = os.path.join(release_path, "requirements.txt")
+	with open(requirements_path, "w") as f:
+		f.write("\n".join(line for line in frozen.splitlines() if " @ file://" not in line))
+	exec_cmd(f"{python} -m pip install {quiet_flag} -r {requirements_path}")
+
+	editables = " ".join(f"-e {os.path.join(apps_path, app)}" for app in bench.apps)
+	exec_cmd(f"{python} -m pip install {quiet_flag} --upgrade {editables}")
+
+	yarn_cache = get_bench_cache_path("yarn")
+	for app in bench.apps:
+		if os.path.exists(os.path.join(apps_path, app, "package.json")):
+			exec_cmd(
+				f"yarn install --check-files --prefer-offline --cache-folder {yarn_cache}",
+				cwd=os.path.join(apps_path, app),
+			)
+
+
+def setup_release_sites(bench, release_path):
+	"""Builds the release's assets in its sites/, which frappe's build tooling finds next
+	to the release's apps. Sites themselves stay in the bench's sites/."""
+	sites_path = os.path.join(release_path, "sites")
+	os.makedirs(os.path.join(sites_path, "assets"))
+	shutil.copy(bench.apps_txt, os.path.join(sites_path, "apps.txt"))
+
+	common_site_config = os.path.abspath(
+		os.path.join(bench.name, "sites", "common_site_config.json")
+	)
+	os.symlink(
+		os.path.relpath(common_site_config, sites_path),
+		os.path.join(sites_path, "common_site_config.json"),
+	)
+
+	python = os.path.join(release_path, "env", "bin", "python")
+	exec_cmd(f"{python} -m frappe.utils.bench_helper frappe build", cwd=sites_path)
+
+
+def switch_release(name, bench_path="."):
+	"""Points the `current` symlink to release `name` atomically, and the bench's
+	sites/assets to the assets of the current release"""
+	from bench.utils.bench import get_env_cmd
+
+	current = os.path.join(bench_path, CURRENT_RELEASE)
+	if os.path.exists(current) and not os.path.islink(current):
+		raise ValidationError(f"{current} exists and isn't a symlink to a release")
+
+	tmp_link = f"{current}.tmp"
+	if os.path.lexists(tmp_link):
+		os.remove(tmp_link)
+	os.symlink(os.path.join(RELEASES_DIR, name), tmp_link)
+	os.replace(tmp_link, current)
+	get_env_cmd.cache_clear()
+
+	assets_path = os.path.join(bench_path, "sites", "assets")
+	if not os.path.islink(assets_path):
+		if os.path.exists(assets_path):
+			archived_path = os.path.join(bench_path, "archived", f"assets-{name}")
+			os.makedirs(os.path.dirname(archived_path), exist_ok=True)
+			shutil.move(assets_path, archived_path)
+			log(f"Moved assets built before releases to {archived_path}")
+		os.symlink(os.path.join("..", CURRENT_RELEASE, "sites", "assets"), assets_path)
+
+	logger.log(f"switched to release {name}")
+
+
+def activate_release(
+	name=None, bench_path=".", migrate=True, restart_supervisor=False, restart_systemd=False
+):
+	"""Switches to release `name`, or the latest one, and migrates sites in maintenance
+	mode before reloading processes"""
+	from bench.bench import Bench
+	from bench.config.common_site_config import update_config
+	from bench.utils.bench import patch_sites
+
+	releases = get_releases(bench_path)
+	name = name or (releases[-1] if releases else None)
+	if name not in releases:
+		raise ValidationError(f"No prepared release {name or ''}, see `bench release list`")
+
+	if name == get_current_release(bench_path):
+		log(f"Release {name} is already active")
+		return
+
+	bench = Bench(bench_path)
+	start = time.monotonic()
+	first_activation = not get_current_release(bench_path)
+	update_config({"maintenance_mode": 1, "pause_scheduler": 1}, bench_path=bench_path)
+
+	switch_release(name, bench_path=bench_path)
+	set_release_history(get_release_history(bench_path) + [name], bench_path=bench_path)
+
+	# process configs made before releases point to the bench's env & apps, later ones
+	# to `current` and follow it as it switches
+	if first_activation:
+		setup_release_processes(bench_path=bench_path)
+
+	if migrate:
+		try:
+			patch_sites(bench_path=bench_path)
+		except Exception:
+			log(
+				f"Migrating sites failed on release {name}. Sites are still in maintenance mode,"
+				" run `bench release rollback` to switch back to the previous release",
+				level=2,
+			)
+			raise
+
+	bench.reload(web=False, supervisor=restart_supervisor, systemd=restart_systemd)
+	update_config({"maintenance_mode": 0, "pause_scheduler": 0}, bench_path=bench_path)
+
+	log(f"Release {name} is active, activated in {time.monotonic() - start:.1f}s", level=1)
+	gc_releases(bench_path=bench_path)
+
+
+def setup_release_processes(bench_path="."):
+	"""Regenerates the bench's Procfile, supervisor and systemd configs, those that exist,
+	to run processes through the `current` release, as they read the paths of env/ &
+	apps/ when generated. Supervisor and systemd are reloaded to pick them up."""
+	from bench.config.procfile import setup_procfile
+	from bench.config.production_setup import reload_supervisor
+	from bench.config.supervisor import generate_supervisor_config
+	from bench.config.systemd import generate_systemd_config
+
+	config_path = os.path.join(bench_path, "config")
+
+	if os.path.exists(os.path.join(bench_path, "Procfile")):
+		setup_procfile(bench_path, yes=True)
+
+	supervisor_conf = os.path.join(config_path, "supervisor.conf")
+	if os.path.exists(supervisor_conf):
+		user = get_config_user(supervisor_conf, r"^user=(\S+)")
+		generate_supervisor_config(bench_path, user=user, yes=True)
+		if which("supervisorctl"):
+			reload_supervisor()
+
+	systemd_path = os.path.join(config_path, "systemd")
+	if os.path.isdir(systemd_path):
+		users = [
+			get_config_user(os.path.join(systemd_path, unit), r"^User=(\S+)")
+			for unit in sorted(os.listdir(systemd_path))
+			if unit.endswith(".service")
+		]
+		user = next((user for user in users if user), None)
+		generate_systemd_config(bench_path, user=user, yes=True)
+		exec_cmd("sudo systemctl daemon-reload")
+
+	log("Process configs now run the current release", level=1)
+
+
+def get_config_user(path, pattern) -> Optional[str]:
+	"""User processes of the config at path run as, to regenerate it for the same user"""
+	with open(path) as f:
+		match = re.search(pattern, f.read(), re.MULTILINE)
+	return match.group(1) if match else None
+
+
+def rollback_release(bench_path=".", restart_supervisor=False, restart_systemd=False):
+	"""Switches back to the release that was active before the current one. Database
+	migrations of the current release aren't undone."""
+	from bench.bench import Bench
+	from bench.config.common_site_config import update_config
+
+	releases = get_releases(bench_path)
+	history = [name for name in get_release_history(bench_path) if name in releases]
+	if len(history) < 2:
+		raise ValidationError("No previous release to roll back to")
+
+	name = history[-2]
+	switch_release(name, bench_path=bench_path)
+	set_release_history(history[:-1], bench_path=bench_path)
+
+	bench = Bench(bench_path)
+	bench.reload(web=False, supervisor=restart_supervisor, systemd=restart_systemd)
+	if bench.conf.get("maintenance_mode"):
+		update_config({"maintenance_mode": 0, "pause_scheduler": 0}, bench_path=bench_path)
+
+	log(f"Rolled back to release {name}", level=1)
+
+
+def remove_release(name, bench_path="."):
+	release_path = os.path.join(bench_path, RELEASES_DIR, name)
+	apps_path = os.path.join(release_path, "apps")
+
+	for app in os.listdir(apps_path) if os.path.isdir(apps_path) else []:
+		app_path = os.path.join(bench_path, "apps", app)
+		if os.path.isfile(os.path.join(apps_path, app, ".git")) and os.path.isdir(app_path):
+			exec_cmd(
+				f"git worktree remove --force {os.path.abspath(os.path.join(apps_path, app))}",
+				cwd=app_path,
+				_raise=False,
+			)
+
+	shutil.rmtree(release_path, ignore_errors=True)
+	logger.log(f"removed release {name}")
+
+
+def gc_releases(bench_path=".", retention=None):
+	"""Removes releases other than the newest `release_retention` set in
+	common_site_config.json (3 by default), the current release and the one before it"""
+	from bench.bench import Bench
+
+	retention = retention or Bench(bench_path).conf.get("release_retention") or 3
+	releases = get_releases(bench_path)
+	keep = set(releases[-retention:]) | set(get_release_history(bench_path)[-2:])
+
+	for name in releases:
+		if name not in keep:
+			log(f"Removing old release {name}")
+			remove_release(name, bench_path=bench_path)
+
+
+def print_releases(bench_path="."):
+	current = get_current_release(bench_path)
+	releases = get_releases(bench_path)
+	if not releases:
+		click.echo("No releases prepared, run `bench release prepare`")
+		return
+
+	click.echo(f"{'RELEASE':16}  {'CREATED':20}  APPS")
+	for name in releases:
+		with open(os.path.join(bench_path, RELEASES_DIR, name, "release.json")) as f:
+			release = json.load(f)
+		created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(release["created"]))
+		apps = ", ".join(
+			f"{app}@{commit[:7]}" if commit else app for app, commit in release["apps"].items()
+		)
+		line = f"{name:16}  {created:20}  {apps}"
+		if name == current:
+			click.secho(f"{line}  (current)", fg="green")
+		else:
+			click.echo(line)
@@ -32,24 +32,34 @@ class Capturing(list):
 
 
 class Rendering:
-	def __init__(self, success, title, is_parent, args, kwargs):
+	def __init__(self, success, title, is_parent, args, kwargs, name=None):
 		import bench.cli
+		from bench.utils.timings import Timing
 
 		self.dynamic_feed = bench.cli.from_command_line and bench.cli.dynamic_feed
 
-		if not self.dynamic_feed:
-			return
-
 		try:
 			self.kw = args[0].__dict__
 		except Exception:
 			self.kw = kwargs
 
+		app = self.kw.get("app_name") or self.kw.get("app") or self.kw.get("repo")
+		self.timing = Timing(
+			name or title,
+			kind="job" if is_parent else "step",
+			app=app if isinstance(app, str) else None,
+		)
+
+		if not self.dynamic_feed:
+			return
+
 		self.is_parent = is_parent
 		self.title = title
 		self.success = success
 
 	def __enter__(self, *args, **kwargs):
+		self.timing.__enter__()
+
 		if not self.dynamic_feed:
 			return
 
@@ -68,6 +78,8 @@ class Rendering:
 		)
 
 	def __exit__(self, *args, **kwargs):
+		self.timing.__exit__(*args)
+
 		if not self.dynamic_feed:
 			return
 
@@ -101,6 +113,7 @@ def job(title: str = None, success: str = None):
 				is_parent=True,
 				args=args,
 				kwargs=kwargs,
+				name=fn.__qualname__,
 			):
 				return fn(*args, **kwargs)
 
@@ -122,6 +135,7 @@ def step(title: str = None, success: str = None):
 				is_parent=False,
 				args=args,
 				kwargs=kwargs,
+				name=fn.__qualname__,
 			):
 				return fn(*args, **kwargs)
 
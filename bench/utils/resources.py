@@ -0,0 +1,139 @@
+# imports - standard imports
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+# imports - third party imports
+import click
+
+# imports - module imports
+import bench
+from bench.utils.timings import Timing, format_duration, get_current_labels
+
+logger = logging.getLogger(bench.PROJECT_NAME)
+
+# resource usage of processes run by this bench process, for `--resource-report`
+process_usage: List[Dict] = []
+_usage_lock = threading.Lock()
+
+
+def start_process(args, cwd=".", **kwargs) -> subprocess.Popen:
+	"""Starts a process like subprocess.Popen, to be reaped with `wait_process` so that
+	its resource usage is recorded against the step running it"""
+	cmd = args if isinstance(args, str) else " ".join(str(arg) for arg in args)
+	timing = Timing(cmd, kind="process", cwd=os.path.abspath(cwd), **get_current_labels())
+	p = subprocess.Popen(args, cwd=cwd, **kwargs)
+	p.timing = timing.__enter__()
+	return p
+
+
+def wait_process(p: subprocess.Popen, block=True) -> Optional[int]:
+	"""Reaps `p` with os.wait4 to get its resource usage along with its exit code, which
+	is returned, or None if `block` isn't set and it's still running.
+
+	User & system CPU time, max RSS and blocks read & written of the process, along with
+	those of its descendants that it waited for, are logged to bench.log, recorded in
+	logs/bench-timings.jsonl and kept in `process_usage`.
+	"""
+	if p.returncode is not None:
+		return p.returncode
+
+	if not hasattr(p, "timing"):
+		# not started with `start_process`
+		return p.wait() if block else p.poll()
+
+	try:
+		pid, status, rusage = os.wait4(p.pid, 0 if block else os.WNOHANG)
+	except ChildProcessError:
+		# reaped by something else, without usage to record
+		return p.wait() if block else p.poll()
+
+	if not pid:
+		return None
+
+	p.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+	# ru_maxrss is in bytes on macOS, kilobytes elsewhere
+	max_rss = rusage.ru_maxrss / (1024 if sys.platform == "darwin" else 1)
+	usage = {
+		"cpu_user": round(rusage.ru_utime, 3),
+		"cpu_system": round(rusage.ru_stime, 3),
+		"max_rss_mb": round(max_rss / 1024, 1),
+		"blocks_read": rusage.ru_inblock,
+		"blocks_written": rusage.ru_oublock,
+	}
+
+	timing = p.timing
+	timing.exit_code = p.returncode
+	timing.fields.update(usage)
+	timing.__exit__(None, None, None)
+
+	usage = {
+		"cmd": timing.name,
+		**timing.labels,
+		"wall": round(time.monotonic() - timing.monotonic_start, 3),
+		**usage,
+		"exit_code": p.returncode,
+	}
+	logger.info(f"process resources: {json.dumps(usage)}")
+	with _usage_lock:
+		process_usage.append(usage)
+
+	return p.returncode
+
+
+def run_process(args, cwd=".", relay=None, **kwargs) -> Tuple[int, Optional[str]]:
+	"""Runs a process like subprocess.call, recording its resource usage. Returns its exit
+	code and its output if stdout is piped, unless an OutputRelay is passed as `relay`
+	to relay piped output as it runs."""
+	with start_process(args, cwd=cwd, **kwargs) as p:
+		try:
+			if relay:
+				relay.relay_process(p)
+				relay.join()
+				return wait_process(p), None
+			stdout = p.stdout.read() if p.stdout else None
+			return wait_process(p), stdout
+		except BaseException:
+			p.kill()
+			p.timing.__exit__(*sys.exc_info())
+			raise
+
+
+def print_resource_report():
+	"""Prints the processes that used the most memory & CPU time, and totals per step"""
+	if not process_usage:
+		return
+
+	def echo(message=""):
+		click.echo(message, err=True)
+
+	echo()
+	echo(f"{'PROCESS':50}  {'STEP':24}  {'WALL':>7}  {'CPU':>7}  {'MAX RSS':>9}  {'I/O BLOCKS':>10}")
+	for usage in sorted(process_usage, key=lambda usage: -usage["max_rss_mb"])[:20]:
+		cpu = usage["cpu_user"] + usage["cpu_system"]
+		io = usage["blocks_read"] + usage["blocks_written"]
+		step = " ".join(filter(None, (usage.get("step"), usage.get("app") or usage.get("site"))))
+		echo(
+			f"{usage['cmd'][:50]:50}  {step[:24]:24}  {format_duration(usage['wall']):>7}"
+			f"  {format_duration(cpu):>7}  {usage['max_rss_mb']:>7.0f}MB  {io:>10}"
+		)
+
+	steps = defaultdict(lambda: {"processes": 0, "cpu": 0.0, "max_rss_mb": 0.0})
+	for usage in process_usage:
+		step = steps[usage.get("step", "-")]
+		step["processes"] += 1
+		step["cpu"] += usage["cpu_user"] + usage["cpu_system"]
+		step["max_rss_mb"] = max(step["max_rss_mb"], usage["max_rss_mb"])
+
+	echo(f"\n{'STEP':50}  {'PROCESSES':>9}  {'CPU':>7}  {'MAX RSS':>9}")
+	for name, step in sorted(steps.items(), key=lambda item: -item[1]["cpu"]):
+		echo(
+			f"{name[:50]:50}  {step['processes']:>9}  {format_duration(step['cpu']):>7}"
+			f"  {step['max_rss_mb']:>7.0f}MB"
+		)
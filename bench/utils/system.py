@@ -1,10 +1,14 @@
 # imports - standard imports
 import grp
+import json
 import os
 import pwd
 import shutil
 import sys
 
+# imports - third party imports
+import click
+
 # imports - module imports
 import bench
 from bench.utils import (
@@ -18,6 +22,11 @@ from bench.utils import (
 )
 from bench.utils.bench import build_assets, clone_apps_from
 from bench.utils.render import job
+from bench.utils.timings import Timing
+
+# minutes between backups of a site, and between runs of scheduled backups
+BACKUP_INTERVAL = 6 * 60
+BACKUP_TICK = 10
 
 
 @job(title="Initializing Bench {path}", success="Bench {path} initialized")
@@ -176,11 +185,316 @@ def backup_site(site, bench_path="."):
 	run_frappe_cmd("--site", site, "backup", bench_path=bench_path)
 
 
-def backup_all_sites(bench_path="."):
+def backup_all_sites(bench_path=".", concurrency=None):
 	from bench.bench import Bench
+	from bench.exceptions import CommandFailedError
+
+	with Timing("backup_all_sites"):
+		results = run_on_sites(
+			"backup", Bench(bench_path).sites, bench_path=bench_path, concurrency=concurrency
+		)
+		if any(results.values()):
+			raise CommandFailedError("Backup failed for some sites")
+
+
+def get_backup_slot(site: str, slots: int) -> int:
+	from hashlib import sha1
+
+	return int(sha1(site.encode()).hexdigest(), 16) % slots
+
+
+def get_backup_schedule(sites, stats: dict, slots: int) -> dict:
+	"""Spreads sites over the `slots` runs of scheduled backups in a backup interval and
+	returns a dict of site to slot.
+
+	Sites are placed in a slot picked by the hash of their name, so that the schedule
+	stays put as sites come and go. Once their backups have been timed, sites are placed
+	longest first in the least loaded slot, starting from the one of their hash.
+	"""
+	timed = {
+		site: stats[site]["duration"]
+		for site in sites
+		if stats.get(site, {}).get("duration")
+	}
+	default = sorted(timed.values())[len(timed) // 2] if timed else 1
+	load = [0.0] * slots
+	schedule = {}
+
+	for site in sites:
+		if site not in timed:
+			schedule[site] = get_backup_slot(site, slots)
+			load[schedule[site]] += default
+
+	for site in sorted(timed, key=lambda site: (-timed[site], site)):
+		preferred = get_backup_slot(site, slots)
+		schedule[site] = min(
+			((preferred + i) % slots for i in range(slots)), key=lambda slot: load[slot]
+		)
+		load[schedule[site]] += timed[site]
+
+	return schedule
+
+
+def get_retry_delay(failures: int) -> int:
+	"""Minutes before a site whose backups failed `failures` times in a row is retried,
+	doubling from a tick up to an interval"""
+	return min(BACKUP_TICK * 2 ** (failures - 1), BACKUP_INTERVAL)
+
+
+def get_due_sites(schedule: dict, stats: dict, now: float) -> list:
+	"""Sites in the slot of the current run, plus sites that missed their last backup or
+	whose last backup failed, once their retry delay passed. Sites backed up within half
+	an interval are skipped, in case the schedule moved them."""
+	slots = BACKUP_INTERVAL // BACKUP_TICK
+	current_slot = int(now // 60 // BACKUP_TICK) % slots
+	due = []
+
+	for site, slot in schedule.items():
+		if site not in stats:
+			if slot == current_slot:
+				due.append(site)
+			continue
+
+		failures = stats[site].get("failures") or int(bool(stats[site].get("failed")))
+		if failures:
+			# runs are a tick apart give or take a few seconds
+			since_attempt = (now - stats[site].get("last_attempt", 0)) / 60
+			if since_attempt > get_retry_delay(failures) - BACKUP_TICK / 2:
+				due.append(site)
+			continue
+
+		age = (now - stats[site]["last_backup"]) / 60
+		if age > BACKUP_INTERVAL + BACKUP_TICK or (
+			slot == current_slot and age > BACKUP_INTERVAL / 2
+		):
+			due.append(site)
+
+	return due
+
+
+def backup_scheduled_sites(bench_path="."):
+	"""Backs up the sites due in this run of scheduled backups at low CPU & IO priority,
+	on `backup_concurrency` sites at a time, and records the duration and size of their
+	backups in config/backups.json to balance the schedule by.
+
+	The backups cronjob runs this every BACKUP_TICK minutes, so that each site is backed
+	up every BACKUP_INTERVAL minutes without backing up all sites at once. Sites whose
+	backups failed are retried with exponential backoff, see `get_retry_delay`, and
+	their consecutive failures are recorded & logged.
+	"""
+	import fcntl
+	import time
+
+	from bench.bench import Bench
+
+	bench = Bench(bench_path)
+	stats_path = os.path.join(bench_path, "config", "backups.json")
+
+	with open(f"{stats_path}.lock", "w") as lock_file:
+		try:
+			fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			log("Previous scheduled backups are still running, skipping this run", level=3)
+			return
+
+		try:
+			with open(stats_path) as f:
+				stats = json.load(f)
+		except (FileNotFoundError, ValueError):
+			stats = {}
+
+		now = time.time()
+		sites = bench.sites
+		schedule = get_backup_schedule(sites, stats, BACKUP_INTERVAL // BACKUP_TICK)
+		due = get_due_sites(schedule, stats, now)
+		if not due:
+			return
+
+		prefix = []
+		if which("nice"):
+			prefix += ["nice", "-n", "19"]
+		if which("ionice"):
+			prefix += ["ionice", "-c", "2", "-n", "7"]
+
+		durations = {}
+		results = run_on_sites(
+			"backup",
+			due,
+			bench_path=bench_path,
+			concurrency=bench.conf.get("backup_concurrency") or 1,
+			prefix=prefix,
+			durations=durations,
+		)
+
+		for site in due:
+			backups_path = os.path.join(bench_path, "sites", site, "private", "backups")
+			size = 0
+			if os.path.isdir(backups_path):
+				for entry in os.scandir(backups_path):
+					if entry.is_file() and entry.stat().st_mtime >= now:
+						size += entry.stat().st_size
+
+			# failed backups keep the time of the last one that succeeded
+			previous = stats.get(site, {})
+			failures = previous.get("failures", 0) + 1 if results[site] else 0
+			stats[site] = {
+				"last_backup": previous.get("last_backup") if results[site] else now,
+				"last_attempt": now,
+				"duration": previous.get("duration") if results[site] else durations.get(site),
+				"size": size,
+				"failed": bool(results[site]),
+				"failures": failures,
+			}
+			if failures:
+				log(
+					f"Backups of {site} failed {failures} time(s) in a row, retrying in"
+					f" {get_retry_delay(failures)} minutes. See logs/backup/{site}.log",
+					level=2,
+				)
+
+		# forget removed sites
+		stats = {site: stats[site] for site in sites if site in stats}
+		tmp_path = f"{stats_path}.tmp"
+		with open(tmp_path, "w") as f:
+			json.dump(stats, f, indent=1)
+		os.replace(tmp_path, stats_path)
+
+
+def get_site_concurrency(bench_path=".", concurrency=None) -> int:
+	"""Returns `concurrency`, else `site_concurrency` set in common_site_config.json, else
+	1, capped so that jobs on sites can't use up the connections of the database.
+
+	Each job may hold a couple of connections, and web & background workers keep theirs
+	while jobs run. `db_max_connections` defaults to MariaDB's max_connections of 151.
+	"""
+	from bench.bench import Bench
+
+	conf = Bench(bench_path).conf
+	concurrency = concurrency or conf.get("site_concurrency") or 1
+
+	max_connections = conf.get("db_max_connections") or 151
+	reserved = (conf.get("gunicorn_workers") or 0) + (conf.get("background_workers") or 1) * 3
+	limit = max(1, (max_connections - reserved) // 2)
+
+	if concurrency > limit:
+		log(
+			f"Running jobs on {limit} sites at a time instead of {concurrency}, to stay within"
+			f" {max_connections} database connections",
+			level=3,
+		)
+	return min(concurrency, limit)
+
+
+def get_site_logs_path(command, bench_path=".") -> str:
+	logs_path = os.path.abspath(os.path.join(bench_path, "logs", command))
+	os.makedirs(logs_path, exist_ok=True)
+	return logs_path
+
+
+def run_site_command(command, site, bench_path=".", args=(), prefix=()) -> int:
+	"""Runs frappe `command` on site with its output going to logs/<command>/<site>.log,
+	and with --verbose to the terminal as well, prefixed with the site. Returns its exit
+	code."""
+	import subprocess
+
+	import bench.cli as bench_cli
+	from bench.utils.bench import get_env_cmd
+	from bench.utils.relay import OutputRelay
+	from bench.utils.resources import run_process
+
+	python = get_env_cmd("python", bench_path=bench_path)
+	log_file = os.path.join(get_site_logs_path(command, bench_path), f"{site}.log")
+
+	with open(log_file, "w") as f, Timing(command, kind="site", site=site) as timing:
+		if bench_cli.verbose:
+			streams = {"stdout": subprocess.PIPE, "relay": OutputRelay(prefix=f"{site}: ", tee=[f])}
+		else:
+			streams = {"stdout": f}
+
+		timing.exit_code, _ = run_process(
+			tuple(prefix)
+			+ (python, "-m", "frappe.utils.bench_helper", "frappe", "--site", site, command)
+			+ tuple(args),
+			cwd=os.path.abspath(os.path.join(bench_path, "sites")),
+			stdin=subprocess.DEVNULL,
+			stderr=subprocess.STDOUT,
+			**streams,
+		)
+		return timing.exit_code
+
+
+def run_on_sites(
+	command, sites, bench_path=".", concurrency=None, args=(), prefix=(), durations=None
+) -> dict:
+	"""Runs frappe `command` on each of the sites, on as many sites at a time as
+	`get_site_concurrency` allows, and returns a dict of site to exit code.
+
+	Output of each site goes to logs/<command>/<site>.log. Failed sites don't stop the
+	others, they're listed in the summary printed at the end. `prefix` is prepended to
+	the commands run, and seconds taken per site are set in `durations` if passed.
+	"""
+	import time
+	from threading import Lock
+
+	from bench.utils import run_in_parallel, echo
+
+	sites = list(sites)
+	if not sites:
+		return {}
+
+	workers = min(get_site_concurrency(bench_path, concurrency), len(sites))
+	logs_path = get_site_logs_path(command, bench_path)
+
+	lock = Lock()
+	progress = {"done": 0, "failed": 0}
+	start = time.monotonic()
+
+	def run(site, output):
+		log_file = os.path.join(logs_path, f"{site}.log")
+		site_start = time.monotonic()
+		return_code = run_site_command(command, site, bench_path, args=args, prefix=prefix)
+
+		with lock:
+			progress["done"] += 1
+			progress["failed"] += bool(return_code)
+			status = f"[{progress['done']}/{len(sites)}, {progress['failed']} failed]"
+
+		duration = time.monotonic() - site_start
+		if durations is not None:
+			durations[site] = duration
+
+		if return_code:
+			echo(
+				click.style(
+					f"{status} {site}: {command} failed with exit code {return_code} after"
+					f" {duration:.1f}s, see {os.path.relpath(log_file)}",
+					fg="red",
+				),
+				output,
+			)
+		else:
+			echo(f"{status} {site}: {command} done in {duration:.1f}s", output)
+
+		return return_code
+
+	click.secho(
+		f"Running {command} on {len(sites)} sites, {workers} at a time. Logs are in"
+		f" {os.path.relpath(logs_path)}",
+		fg="yellow",
+	)
+	results = run_in_parallel(run, sites, workers=workers, stop_on_failure=False)
+	failed = [site for site in sites if results[site]]
+
+	summary = (
+		f"{command} done on {len(sites) - len(failed)} of {len(sites)} sites in"
+		f" {time.monotonic() - start:.1f}s"
+	)
+	if failed:
+		click.secho(f"{summary}, failed on: {', '.join(failed)}", fg="red")
+	else:
+		click.secho(summary, fg="green")
 
-	for site in Bench(bench_path).sites:
-		backup_site(site, bench_path=bench_path)
+	return results
 
 
 def fix_prod_setup_perms(bench_path=".", frappe_user=None):
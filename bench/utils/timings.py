@@ -0,0 +1,258 @@
+# imports - standard imports
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# imports - third party imports
+import click
+
+TIMINGS_FILE = "bench-timings.jsonl"
+MAX_TIMINGS_SIZE = 10 * 1024 * 1024
+
+# set by `setup_timings` when bench runs from the command line in a bench directory
+timings_path = None
+run_info = {}
+
+_ids = itertools.count(1)
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def setup_timings(command: str, bench_path="."):
+	"""Starts a run that timings of this process are recorded under, in
+	logs/bench-timings.jsonl of the bench"""
+	global timings_path
+
+	logs_path = os.path.join(bench_path, "logs")
+	if not os.path.isdir(logs_path):
+		return
+
+	timings_path = os.path.abspath(os.path.join(logs_path, TIMINGS_FILE))
+	run_info.update(run=f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}", command=command)
+	trim_timings()
+
+
+def trim_timings():
+	"""Drops the older half of recorded timings once the file grows past MAX_TIMINGS_SIZE"""
+	try:
+		if os.path.getsize(timings_path) < MAX_TIMINGS_SIZE:
+			return
+		with open(timings_path) as f:
+			lines = f.readlines()
+		with open(f"{timings_path}.tmp", "w") as f:
+			f.writelines(lines[len(lines) // 2 :])
+		os.replace(f"{timings_path}.tmp", timings_path)
+	except OSError:
+		pass
+
+
+def get_stack() -> List["Timing"]:
+	if not hasattr(_local, "stack"):
+		_local.stack = []
+	return _local.stack
+
+
+def get_timing_context() -> Tuple["Timing", ...]:
+	"""Timed blocks running in this thread, outermost first, to pass to threads it starts
+	with `set_timing_context`"""
+	return tuple(get_stack())
+
+
+def set_timing_context(context: Tuple["Timing", ...]):
+	"""Nests blocks timed in this thread under the blocks of another thread"""
+	_local.stack = list(context)
+
+
+def get_current_labels() -> Dict:
+	"""Name of the innermost timed block as `step` and the app & site of the blocks it's
+	nested in, innermost first"""
+	labels = {}
+	for timing in reversed(get_stack()):
+		labels.setdefault("step", timing.name)
+		for key, value in timing.labels.items():
+			labels.setdefault(key, value)
+	return labels
+
+
+class Timing:
+	"""Records wall time, status and nesting of the block it wraps. Blocks that run a
+	process can set its `exit_code`, a non zero one marks the block failed, and add
+	fields like its resource usage to `fields`."""
+
+	def __init__(self, name: str, kind: str = "step", **labels):
+		self.name = name
+		self.kind = kind
+		self.labels = {key: value for key, value in labels.items() if value}
+		self.exit_code = None
+		self.fields = {}
+
+	def __enter__(self):
+		stack = get_stack()
+		self.id = next(_ids)
+		self.parent = stack[-1].id if stack else None
+		self.depth = len(stack)
+		stack.append(self)
+		self.start = time.time()
+		self.monotonic_start = time.monotonic()
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		stack = get_stack()
+		if self in stack:
+			stack.remove(self)
+		if not timings_path:
+			return
+
+		record = {
+			**run_info,
+			"id": self.id,
+			"parent": self.parent,
+			"depth": self.depth,
+			"kind": self.kind,
+			"name": self.name,
+			**self.labels,
+			"start": round(self.start, 3),
+			"duration": round(time.monotonic() - self.monotonic_start, 3),
+			"status": "ok",
+			**self.fields,
+		}
+
+		if isinstance(exc, SystemExit):
+			self.exit_code = exc.code
+		elif exc_type:
+			record["status"] = "failed"
+			record["error"] = exc_type.__name__
+
+		if self.exit_code:
+			record["status"] = "failed"
+			record["exit_code"] = self.exit_code
+
+		write_timing(record)
+
+
+def write_timing(record: Dict):
+	if not timings_path:
+		return
+
+	line = json.dumps(record) + "\n"
+	with _write_lock:
+		try:
+			with open(timings_path, "a") as f:
+				f.write(line)
+		except OSError:
+			pass
+
+
+def get_timings(bench_path=".") -> List[Dict]:
+	records = []
+	try:
+		with open(os.path.join(bench_path, "logs", TIMINGS_FILE)) as f:
+			for line in f:
+				try:
+					records.append(json.loads(line))
+				except ValueError:
+					pass
+	except FileNotFoundError:
+		pass
+	return records
+
+
+def format_duration(seconds: float) -> str:
+	if seconds >= 3600:
+		return f"{seconds // 3600:.0f}h{seconds % 3600 // 60:02.0f}m"
+	if seconds >= 60:
+		return f"{seconds // 60:.0f}m{seconds % 60:02.0f}s"
+	return f"{seconds:.1f}s"
+
+
+def print_timings(bench_path=".", runs=10, command=None, app=None):
+	"""Summarises timings of the last `runs` runs, of `command` if passed: the runs,
+	slowest steps, how top level steps of the runs trend and time taken per app"""
+	records = get_timings(bench_path)
+	by_run = defaultdict(list)
+	for record in records:
+		if not command or record.get("command", "").split(" ")[0] == command:
+			by_run[record["run"]].append(record)
+
+	if not by_run:
+		click.echo("No timings recorded yet")
+		return
+
+	run_ids = list(by_run)[-runs:]
+
+	def get_span(run_records):
+		return max(r["start"] + r["duration"] for r in run_records) - min(
+			r["start"] for r in run_records
+		)
+
+	click.secho("Runs", bold=True)
+	click.echo(f"{'RUN':24}  {'TIME':>8}  {'STATUS':8}  COMMAND")
+	for run_id in run_ids:
+		run_records = by_run[run_id]
+		failed = any(r["status"] != "ok" and r["kind"] == "command" for r in run_records)
+		status = click.style("failed", fg="red") if failed else "ok    "
+		click.echo(
+			f"{run_id:24}  {format_duration(get_span(run_records)):>8}  {status:8}"
+			f"  {run_records[0].get('command', '')}"
+		)
+
+	selected = [r for run_id in run_ids for r in by_run[run_id] if r["kind"] != "command"]
+	if app:
+		selected = [r for r in selected if r.get("app") == app]
+
+	click.secho("\nSlowest steps", bold=True)
+	click.echo(f"{'STEP':45}  {'RUNS':>4}  {'AVERAGE':>8}  {'MAX':>8}")
+	steps = defaultdict(list)
+	for record in selected:
+		name = record["name"]
+		if record.get("app") and record["app"] not in name:
+			name = f"{name} [{record['app']}]"
+		steps[name].append(record["duration"])
+	slowest = sorted(steps.items(), key=lambda item: -max(item[1]))[:15]
+	for name, durations in slowest:
+		click.echo(
+			f"{name[:45]:45}  {len(durations):>4}  {format_duration(sum(durations) / len(durations)):>8}"
+			f"  {format_duration(max(durations)):>8}"
+		)
+
+	# tasks of update pipelines are per app or site, e.g. migrate:<site>, their stages
+	# are compared by the time from the first of them starting to the last one ending
+	click.secho("\nTop level steps per run", bold=True)
+	trend_runs = run_ids[-5:]
+	click.echo(
+		f"{'STEP':35}"
+		+ "".join(
+			f"  {time.strftime('%m-%d %H:%M', time.localtime(by_run[run_id][0]['start'])):>11}"
+			for run_id in trend_runs
+		)
+	)
+	top_level = defaultdict(dict)
+	for run_id in trend_runs:
+		top_level["total"][run_id] = get_span(by_run[run_id])
+		stages = defaultdict(list)
+		for record in by_run[run_id]:
+			if record["depth"] == 1:
+				stages[record["name"].split(":")[0]].append(record)
+		for name, records in stages.items():
+			top_level[name][run_id] = get_span(records)
+	for name, durations in top_level.items():
+		click.echo(
+			f"{name[:35]:35}"
+			+ "".join(
+				f"  {format_duration(durations[run_id]) if run_id in durations else '-':>11}"
+				for run_id in trend_runs
+			)
+		)
+
+	click.secho("\nPer app", bold=True)
+	click.echo(f"{'APP':25}  {'STEP':35}  {'TOTAL':>8}")
+	per_app = defaultdict(float)
+	for record in selected:
+		if record.get("app"):
+			per_app[(record["app"], record["name"])] += record["duration"]
+	for (app_name, name), duration in sorted(per_app.items(), key=lambda item: (item[0][0], -item[1])):
+		click.echo(f"{app_name[:25]:25}  {name[:35]:35}  {format_duration(duration):>8}")